@@ -24,7 +24,7 @@ IMPORT_ERR = ""
 try:
     from modules.ai_client import GeminiClient
     from modules.data_loader import load_default_db
-    from modules.ui_tabs import _init_state, render_sidebar, tab1_matrix_exam, tab2_build_question, tab3_review_export
+    from modules.ui_tabs import _init_state, render_sidebar, show_flash, tab1_matrix_exam, tab2_build_question, tab3_review_export
 except Exception as e:
     MODULES_OK = False
     IMPORT_ERR = str(e)
@@ -47,8 +47,13 @@ if not MODULES_OK:
 
 # --- Normal flow
 _init_state()
+show_flash()
 
-ai = GeminiClient(api_key=st.session_state.get("api_key",""))
+# client giữ API key của từng người dùng -> mỗi phiên 1 client, tạo 1 lần
+if "ai_client" not in st.session_state:
+    st.session_state.ai_client = GeminiClient(api_key=st.session_state.get("api_key",""))
+ai = st.session_state.ai_client
+# DB CT2018 dùng chung cho mọi phiên; load_default_db tự nạp lại khi file JSON/.ct18 đổi
 db = load_default_db()
 
 render_sidebar(ai)
@@ -56,7 +61,7 @@ render_sidebar(ai)
 tab1, tab2, tab3 = st.tabs(["Tab 1: Tạo đề từ ma trận", "Tab 2: Tạo câu hỏi theo bài/YCCĐ", "Tab 3: Ghép & Xuất đề"])
 
 with tab1:
-    tab1_matrix_exam(ai)
+    tab1_matrix_exam(ai, db)
 
 with tab2:
     tab2_build_question(ai, db)
@@ -1,12 +1,18 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import hashlib
 import os
 import random
-from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Protocol, Sequence, Set, Tuple
 
+from . import metrics
 from .bootstrap import safe_import_genai
+from .response_cache import ResponseCache, make_key
 
 DEFAULT_MODELS: List[str] = [
     # Thứ tự ưu tiên; sẽ tự thử lần lượt nếu model không khả dụng.
@@ -22,56 +28,668 @@ DEFAULT_GEN_CONFIG: Dict[str, object] = {
     "max_output_tokens": 2048,
 }
 
+# Cấu hình cho prompt sinh nhiều câu/lần (đầu ra JSON dài hơn)
+BATCH_GEN_CONFIG: Dict[str, object] = {**DEFAULT_GEN_CONFIG, "max_output_tokens": 8192}
+
+@dataclass(frozen=True)
+class ModelProfile:
+    tier: str            # "fast" (rẻ, nhanh) | "strong" (chất lượng cao, chậm hơn)
+    context_tokens: int  # giới hạn prompt + đầu ra
+
+MODEL_PROFILES: Dict[str, ModelProfile] = {
+    "gemini-1.5-pro": ModelProfile("strong", 1_000_000),
+    "gemini-1.5-flash": ModelProfile("fast", 1_000_000),
+    "gemini-1.0-pro": ModelProfile("strong", 30_720),
+}
+_UNKNOWN_PROFILE = ModelProfile("strong", 30_720)
+
+# task="auto": prompt dài hơn ngưỡng này coi là việc nặng (cả đề) -> ưu tiên model "strong"
+HEAVY_PROMPT_TOKENS = 1500
+TASKS = ("auto", "fast", "strong")
+
+# Circuit breaker theo (key, model): lỗi liên tiếp thì tạm bỏ qua model thay vì gọi lại mỗi lần
+BREAKER_THRESHOLD = 2
+BREAKER_COOLDOWN_S = 60.0
+QUOTA_COOLDOWN_S = 60.0          # 429: hết quota phút -> ngắt ngay
+NOT_FOUND_COOLDOWN_S = 3600.0    # model không tồn tại với key này
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng thô số token của prompt (tiếng Việt có dấu ~3 ký tự/token)."""
+    return max(1, len(text) // 3)
+
+# Key đã kiểm tra hợp lệ được tin cậy trong khoảng này; lỗi xác thực sẽ huỷ sớm hơn.
+SESSION_TTL_S = 15 * 60
+
+# Giới hạn gọi API theo key (request/phút), timeout mỗi request và thử lại khi 429/5xx
+DEFAULT_RPM = 60
+REQUEST_TIMEOUT_S = 90.0
+MAX_RETRIES_PER_MODEL = 2
+BACKOFF_BASE_S = 1.0
+
+class AIBackend(Protocol):
+    """Phần của google.generativeai mà client dùng. Thay bằng backend khác (vd. `mock_backend`) để chạy offline.
+
+    Model trả về từ `GenerativeModel(name)` cần có
+    `generate_content(prompt, generation_config=..., request_options=..., stream=False)`
+    trả về đối tượng có `.text` (hoặc, khi `stream=True`, iterable các đoạn có `.text`) và dùng client ở `_client`.
+    Backend khác google.generativeai cung cấp `key_clients(api_key)` -> (client sinh nội dung, client liệt kê model).
+    Backend đặt `offline = True` thì không cần API key.
+    """
+
+    def list_models(self, client: object = None) -> Iterable[object]: ...
+
+    def GenerativeModel(self, model_name: str) -> object: ...
+
 @dataclass
 class AIStatus:
     ok: bool
     message: str
     used_model: Optional[str] = None
+    cached: bool = False
+
+def _profile(model: str) -> ModelProfile:
+    return MODEL_PROFILES.get(model, _UNKNOWN_PROFILE)
+
+class _Breaker:
+    """Đóng -> (lỗi liên tiếp / 429) mở trong một khoảng nghỉ -> hết nghỉ cho thử 1 lần; thành công thì đóng lại."""
+
+    def __init__(self):
+        self.failures = 0
+        self.open_until = 0.0
+        self.last_error = ""
+        self._lock = threading.Lock()
+
+    def allow(self, now: float) -> bool:
+        return now >= self.open_until
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.open_until = 0.0
+            self.last_error = ""
+
+    def failure(self, err: Exception, cooldown_s: float = BREAKER_COOLDOWN_S, trip: bool = False) -> None:
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(err)[:200]
+            if trip or self.failures >= BREAKER_THRESHOLD:
+                self.open_until = time.monotonic() + cooldown_s
+
+class _RateLimiter:
+    """Token bucket đơn giản, an toàn đa luồng: tối đa `rpm` request mỗi phút."""
+
+    def __init__(self, rpm: int):
+        self.capacity = float(max(1, rpm))
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait_s = (1.0 - self.tokens) / self.rate
+            time.sleep(wait_s)
+
+    def release(self) -> None:
+        """Trả lại 1 lượt (request đã gọi nhưng kết quả bị bỏ, vd. nhánh thua khi gọi song song)."""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1.0)
+
+class _Cancelled(Exception):
+    """Lời gọi đã bị huỷ (nhánh còn lại của lời gọi song song đã có kết quả)."""
+
+@dataclass
+class _KeySession:
+    """Trạng thái dùng chung theo API key: lần kiểm tra gần nhất, model khả dụng, client riêng của key, model handle."""
+    validated_at: float = 0.0
+    client: object = None        # client sinh nội dung, gắn vào mọi handle của key này
+    model_client: object = None  # client cho list_models
+    available_models: Set[str] = field(default_factory=set)
+    handles: Dict[str, object] = field(default_factory=dict)
+    limiter: _RateLimiter = field(default_factory=lambda: _RateLimiter(DEFAULT_RPM))
+    breakers: Dict[str, _Breaker] = field(default_factory=dict)
+
+    def fresh(self) -> bool:
+        return self.validated_at > 0 and time.monotonic() - self.validated_at < SESSION_TTL_S
+
+    def breaker(self, model: str) -> _Breaker:
+        b = self.breakers.get(model)
+        if b is None:
+            b = self.breakers.setdefault(model, _Breaker())
+        return b
+
+# Dùng chung cho mọi phiên Streamlit trong tiến trình; khoá theo (backend, hash của API key).
+_SESSIONS: Dict[Tuple[int, str], _KeySession] = {}
+_SESSIONS_LOCK = threading.Lock()
+
+def _key_id(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+def _key_clients(backend: AIBackend, api_key: str) -> Tuple[object, object]:
+    """(client sinh nội dung, client liệt kê model) chỉ dùng `api_key`.
+
+    Không dùng genai.configure: đó là trạng thái toàn cục, handle chưa gắn client sẽ lấy client mặc định
+    của lần configure gần nhất — có thể là key của phiên khác — và giữ nó suốt đời tiến trình.
+    """
+    make = getattr(backend, "key_clients", None)
+    if make is not None:
+        return make(api_key)
+    from google.ai import generativelanguage as glm
+    opts = {"api_key": api_key}
+    return glm.GenerativeServiceClient(client_options=opts), glm.ModelServiceClient(client_options=opts)
+
+def _is_auth_error(e: Exception) -> bool:
+    name = type(e).__name__
+    text = str(e)
+    return name in ("PermissionDenied", "Unauthenticated") or "API_KEY_INVALID" in text or "API key not valid" in text
+
+def _is_retryable(e: Exception) -> bool:
+    """429 (hết quota tạm thời) và lỗi 5xx/timeout phía server thì nên thử lại sau."""
+    name = type(e).__name__
+    if name in ("ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError", "DeadlineExceeded"):
+        return True
+    code = getattr(e, "code", None)
+    code = code() if callable(code) else code
+    try:
+        return int(code) == 429 or 500 <= int(code) < 600  # type: ignore[arg-type]
+    except (TypeError, ValueError):
+        return False
+
+def _is_quota(e: Exception) -> bool:
+    code = getattr(e, "code", None)
+    code = code() if callable(code) else code
+    return type(e).__name__ in ("ResourceExhausted", "TooManyRequests") or str(code) == "429"
+
+def _is_not_found(e: Exception) -> bool:
+    code = getattr(e, "code", None)
+    code = code() if callable(code) else code
+    return type(e).__name__ == "NotFound" or str(code) == "404"
+
+def _record_failure(sess: "_KeySession", model: str, e: Exception) -> None:
+    if _is_quota(e):
+        sess.breaker(model).failure(e, QUOTA_COOLDOWN_S, trip=True)
+    elif _is_not_found(e):
+        sess.breaker(model).failure(e, NOT_FOUND_COOLDOWN_S, trip=True)
+    else:
+        sess.breaker(model).failure(e)
+
+def _note_failed(sp: Dict[str, object], model: str) -> None:
+    """Ghi model lỗi vào span hiện tại (để biết model dự phòng nào đã bị bỏ qua)."""
+    sp.setdefault("failed", []).append(model)  # type: ignore[union-attr]
+    metrics.incr("ai.fallbacks")
+
+def _cache_get(cache: ResponseCache, key: str) -> Optional[str]:
+    # cache hỏng/khoá file không được làm hỏng việc sinh câu hỏi
+    try:
+        return cache.get(key)
+    except Exception:
+        return None
+
+def _cache_put(cache: ResponseCache, key: str, model: str, text: str) -> None:
+    try:
+        cache.put(key, model, text)
+    except Exception:
+        pass
+
+def _timed_stream(stream: "AIStream", chunks: Iterator[str], task: str) -> Iterator[str]:
+    """Ghi span "ai.stream": tổng thời gian, thời gian tới đoạn đầu tiên, model dùng."""
+    t0 = time.perf_counter()
+    first_ms: Optional[float] = None
+    n_chars = 0
+    try:
+        for piece in chunks:
+            if first_ms is None:
+                first_ms = round((time.perf_counter() - t0) * 1000, 1)
+            n_chars += len(piece)
+            yield piece
+    finally:
+        stt = stream.status
+        if stt is not None and not stt.cached:
+            metrics.incr("ai.tokens_out", estimate_tokens(stream.text) if n_chars else 0)
+        metrics.record("ai.stream", (time.perf_counter() - t0) * 1000, ok=stt is None or stt.ok, task=task,
+                       model=stt.used_model if stt else None, cached=bool(stt and stt.cached),
+                       first_chunk_ms=first_ms, cancelled=stream.cancelled)
+
+class AIStream:
+    """Kết quả sinh dạng luồng: lặp để nhận từng đoạn văn bản; `status` có sau khi lặp xong.
+
+    Gọi `cancel()` (từ luồng khác hoặc giữa vòng lặp) để dừng sớm; phần đã nhận vẫn nằm trong `text`.
+    """
+
+    def __init__(self, produce: Callable[["AIStream"], Iterator[str]]):
+        self._cancel = threading.Event()
+        self.text = ""
+        self.status: Optional[AIStatus] = None
+        self._chunks = produce(self)  # generator: chỉ chạy khi bắt đầu lặp
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def __iter__(self) -> Iterator[str]:
+        for chunk in self._chunks:
+            if self._cancel.is_set():
+                break
+            self.text += chunk
+            yield chunk
+        close = getattr(self._chunks, "close", None)
+        if close is not None:
+            close()  # dừng sớm: đóng luồng phía model ngay thay vì chờ thu gom rác
+        if self._cancel.is_set() and self.status is None:
+            self.status = AIStatus(False, "Đã dừng sinh; giữ lại phần đã nhận.")
 
 class GeminiClient:
     """Gemini client with strong failure handling (không làm app crash trước UI)."""
 
-    def __init__(self, api_key: Optional[str] = None, models: Optional[List[str]] = None):
+    def __init__(self, api_key: Optional[str] = None, models: Optional[List[str]] = None,
+                 timeout_s: float = REQUEST_TIMEOUT_S, backend: Optional[AIBackend] = None,
+                 rpm: int = DEFAULT_RPM):
+        """`backend=None` -> google.generativeai (hoặc mock nếu đặt DEKIEMTRA_AI_BACKEND=mock).
+
+        google.generativeai nhập mất cỡ 1 giây -> chỉ nhập ở lần đầu thực sự dùng AI, không phải lúc tạo client.
+        """
         self.api_key = (api_key or os.getenv("GEMINI_API_KEY") or "").strip()
         self.models = models or DEFAULT_MODELS
-        self._genai_ok, self._genai, self._genai_err = safe_import_genai()
+        self.timeout_s = timeout_s
+        self.rpm = rpm
+        if backend is None and os.getenv("DEKIEMTRA_AI_BACKEND", "").lower() == "mock":
+            from .mock_backend import MockGenAI
+            backend = MockGenAI.from_env()
+        self._backend: Optional[AIBackend] = backend
+        self._backend_err = ""
+        self._backend_lock = threading.Lock()
+
+    def _load_backend(self) -> Optional[AIBackend]:
+        if self._backend is None and not self._backend_err:
+            with self._backend_lock:
+                if self._backend is None and not self._backend_err:
+                    with metrics.span("ai.import"):
+                        ok, mod, err = safe_import_genai()
+                    self._backend, self._backend_err = (mod, "") if ok else (None, err)  # type: ignore[assignment]
+        return self._backend
+
+    @property
+    def _genai(self) -> Optional[AIBackend]:
+        return self._load_backend()
 
-    def check_api(self) -> AIStatus:
-        if not self.api_key:
+    @property
+    def _genai_ok(self) -> bool:
+        return self._load_backend() is not None
+
+    @property
+    def _genai_err(self) -> str:
+        self._load_backend()
+        return self._backend_err
+
+    @property
+    def offline(self) -> bool:
+        return bool(getattr(self._genai, "offline", False))
+
+    def _session(self) -> _KeySession:
+        with _SESSIONS_LOCK:
+            key = (id(self._genai), _key_id(self.api_key))
+            sess = _SESSIONS.get(key)
+            if sess is None:
+                sess = _SESSIONS[key] = _KeySession(limiter=_RateLimiter(self.rpm))
+            return sess
+
+    def _bind(self, sess: _KeySession) -> None:
+        """Tạo client riêng của key (1 lần cho mỗi phiên key)."""
+        if sess.client is None:
+            with _SESSIONS_LOCK:
+                if sess.client is None:
+                    client, sess.model_client = _key_clients(self._genai, self.api_key)  # type: ignore[arg-type]
+                    sess.client = client  # gán sau cùng: luồng khác thấy client thì model_client đã có
+
+    def invalidate(self) -> None:
+        """Bỏ kết quả kiểm tra key (vd. sau lỗi xác thực) để lần sau kiểm tra lại."""
+        with _SESSIONS_LOCK:
+            _SESSIONS.pop((id(self._genai), _key_id(self.api_key)), None)
+
+    def check_api(self, force: bool = False) -> AIStatus:
+        if not self.api_key and not self.offline:
             return AIStatus(False, "Chưa có API key (GEMINI_API_KEY hoặc nhập trong Sidebar).")
         if not self._genai_ok or self._genai is None:
             return AIStatus(False, self._genai_err or "Thiếu thư viện google.generativeai.")
+        sess = self._session()
+        if not force and sess.fresh():
+            return AIStatus(True, "API key hợp lệ và đã kết nối.")
         try:
-            self._genai.configure(api_key=self.api_key)
+            self._bind(sess)
             # list_models là cách nhẹ nhất để kiểm tra key; nếu fail -> bắt exception
-            _ = list(self._genai.list_models())
+            models = list(self._genai.list_models(client=sess.model_client))
+            sess.available_models = {
+                str(getattr(m, "name", "")).split("/")[-1]
+                for m in models
+                if "generateContent" in (getattr(m, "supported_generation_methods", None) or ["generateContent"])
+            }
+            sess.validated_at = time.monotonic()
             return AIStatus(True, "API key hợp lệ và đã kết nối.")
         except Exception as e:
+            self.invalidate()
             return AIStatus(False, f"Không kết nối được API: {e}")
 
-    def generate(self, prompt: str, gen_config: Optional[Dict[str, object]] = None) -> AIStatus:
-        """Try multiple models; always returns AIStatus."""
+    def _model(self, sess: _KeySession, name: str) -> object:
+        handle = sess.handles.get(name)
+        if handle is None:
+            self._bind(sess)
+            handle = self._genai.GenerativeModel(name)  # type: ignore[union-attr]
+            handle._client = sess.client  # gắn ngay, không để handle tự lấy client mặc định lúc gọi lần đầu
+            handle = sess.handles.setdefault(name, handle)
+        return handle
+
+    @staticmethod
+    def _acquire(sess: _KeySession) -> None:
+        t0 = time.perf_counter()
+        sess.limiter.acquire()
+        waited = (time.perf_counter() - t0) * 1000
+        if waited >= 1:
+            metrics.incr("ai.ratelimit_wait_ms", round(waited))
+
+    def _call(self, sess: _KeySession, name: str, prompt: str, gen_config: Dict[str, object],
+              retry_quota: bool = True, cancel: Optional[threading.Event] = None) -> str:
+        """Gọi 1 model (có giới hạn tốc độ); thử lại với backoff luỹ thừa khi gặp 429/5xx.
+
+        `retry_quota=False` -> gặp 429 thì bỏ ngay để model kế tiếp xử lý (không ngồi chờ backoff).
+        `cancel` đã đặt -> không gọi nữa (_Cancelled); kết quả về sau khi huỷ thì bỏ và trả lại lượt cho bộ giới hạn.
+        """
+        model = self._model(sess, name)
+        for attempt in range(MAX_RETRIES_PER_MODEL + 1):
+            if cancel is not None and cancel.is_set():
+                raise _Cancelled()
+            self._acquire(sess)
+            try:
+                with metrics.span("ai.call", model=name, attempt=attempt):
+                    metrics.incr("ai.tokens_in", estimate_tokens(prompt))
+                    res = model.generate_content(  # type: ignore[attr-defined]
+                        prompt, generation_config=gen_config, request_options={"timeout": self.timeout_s},
+                    )
+                text = (getattr(res, "text", None) or "").strip()
+                metrics.incr("ai.tokens_out", estimate_tokens(text) if text else 0)
+            except Exception as e:
+                if attempt >= MAX_RETRIES_PER_MODEL or not _is_retryable(e) or (_is_quota(e) and not retry_quota):
+                    raise
+                metrics.incr("ai.retries")
+                delay = BACKOFF_BASE_S * (2 ** attempt) + random.uniform(0, BACKOFF_BASE_S)
+                if cancel is not None:
+                    cancel.wait(delay)
+                else:
+                    time.sleep(delay)
+                continue
+            if cancel is not None and cancel.is_set():
+                sess.limiter.release()
+                raise _Cancelled()
+            return text
+        return ""
+
+    def route(self, prompt: str, gen_config: Optional[Dict[str, object]] = None, task: str = "auto",
+              models: Optional[Sequence[str]] = None) -> List[str]:
+        """Thứ tự model sẽ thử: đúng nhóm của việc trước (giữ thứ tự gốc), bỏ model key không có,
+        model không đủ ngữ cảnh cho prompt + đầu ra, và model đang bị ngắt (circuit breaker mở)."""
+        gen_config = gen_config or DEFAULT_GEN_CONFIG
+        sess = self._session()
+        prompt_tokens = estimate_tokens(prompt)
+        ordered = self._tier_order(prompt, task, models)
+        usable = [m for m in ordered if not sess.available_models or m in sess.available_models] or ordered
+        need = prompt_tokens + int(gen_config.get("max_output_tokens", 0) or 0)  # type: ignore[call-overload]
+        usable = [m for m in usable if _profile(m).context_tokens >= need] or usable
+        now = time.monotonic()
+        return [m for m in usable if sess.breaker(m).allow(now)]
+
+    def _tier_order(self, prompt: str, task: str = "auto", models: Optional[Sequence[str]] = None) -> List[str]:
+        """Mọi model ứng viên, đúng nhóm của việc trước (giữ thứ tự gốc) — thứ tự tra cache, chưa lọc model nào."""
+        candidates = list(models or self.models)
+        if task == "auto":
+            task = "strong" if estimate_tokens(prompt) > HEAVY_PROMPT_TOKENS else "fast"
+        return sorted(candidates, key=lambda m: (_profile(m).tier != task, candidates.index(m)))
+
+    def _all_open(self, models: Sequence[str]) -> AIStatus:
+        sess = self._session()
+        wait_s = min((sess.breaker(m).open_until for m in models), default=0.0) - time.monotonic()
+        return AIStatus(False, f"Các model đang tạm ngưng do lỗi/quota gần đây; thử lại sau khoảng {max(1, int(wait_s))} giây.")
+
+    def health(self) -> Dict[str, Dict[str, object]]:
+        """Trạng thái từng model theo key hiện tại (để hiển thị/gỡ lỗi)."""
+        sess = self._session()
+        now = time.monotonic()
+        out: Dict[str, Dict[str, object]] = {}
+        for m in self.models:
+            b = sess.breaker(m)
+            out[m] = {
+                "tier": _profile(m).tier,
+                "state": "open" if not b.allow(now) else ("half-open" if b.failures >= BREAKER_THRESHOLD else "closed"),
+                "failures": b.failures,
+                "retry_in_s": max(0.0, round(b.open_until - now, 1)),
+                "last_error": b.last_error,
+            }
+        return out
+
+    def generate(self, prompt: str, gen_config: Optional[Dict[str, object]] = None,
+                 seed: Optional[int] = None, cache: Optional[ResponseCache] = None,
+                 models: Optional[Sequence[str]] = None, task: str = "auto",
+                 cancel: Optional[threading.Event] = None) -> AIStatus:
+        """Try multiple models; always returns AIStatus.
+
+        `seed=None` -> seed ngẫu nhiên (luôn ra biến thể mới, không dùng cache).
+        Có `seed` + `cache` -> trả kết quả đã lưu nếu trùng prompt/model/config/seed.
+        `models` -> chỉ thử các model này (mặc định: self.models).
+        `task`: "fast" (câu lẻ mức dễ, lô câu) | "strong" (cả đề, câu vận dụng) | "auto" (theo độ dài prompt).
+        `cancel`: đặt Event này thì dừng ở lần gọi kế tiếp (trả về lỗi "đã huỷ").
+        """
+        with metrics.span("ai.generate", task=task) as sp:
+            res = self._generate(prompt, gen_config, seed, cache, models, task, sp, cancel)
+            sp.update(ok=res.ok, model=res.used_model, cached=res.cached)
+        return res
+
+    def _generate(self, prompt: str, gen_config: Optional[Dict[str, object]], seed: Optional[int],
+                  cache: Optional[ResponseCache], models: Optional[Sequence[str]], task: str,
+                  sp: Dict[str, object], cancel: Optional[threading.Event] = None) -> AIStatus:
+        gen_config = gen_config or DEFAULT_GEN_CONFIG
+        candidates = list(models or self.models)
+        use_cache = cache is not None and seed is not None
+        if use_cache:
+            # tra theo thứ tự định tuyến: có sẵn kết quả của model hợp việc thì không lấy bản của model khác;
+            # không bỏ model đang bị ngắt/thiếu ngữ cảnh vì đọc cache không gọi API
+            for m in self._tier_order(prompt, task, candidates):
+                text = _cache_get(cache, make_key(prompt, m, gen_config, seed))  # type: ignore[arg-type]
+                if text is not None:
+                    metrics.incr("ai.cache_hit")
+                    return AIStatus(True, text, used_model=m, cached=True)
+            metrics.incr("ai.cache_miss")
+
         st = self.check_api()
         if not st.ok:
             return st
 
         assert self._genai is not None
-        gen_config = gen_config or DEFAULT_GEN_CONFIG
+        sess = self._session()
 
-        # seed nhẹ để đa dạng đề mà vẫn có thể lặp lại khi cần
-        seed = random.randint(1, 10_000_000)
+        # seed để đa dạng đề mà vẫn có thể lặp lại khi cần
+        if seed is None:
+            seed = random.randint(1, 10_000_000)
         prompt2 = f"{prompt}\n\n[seed:{seed}]"
 
+        models = self.route(prompt, gen_config, task, candidates)
+        if not models:
+            return self._all_open(candidates)
         last_err: Optional[Exception] = None
-        for m in self.models:
+        for k, m in enumerate(models):
             try:
-                model = self._genai.GenerativeModel(m)  # type: ignore[attr-defined]
-                res = model.generate_content(prompt2, generation_config=gen_config)
-                text = getattr(res, "text", None) or ""
-                if text.strip():
-                    return AIStatus(True, text.strip(), used_model=m)
+                text = self._call(sess, m, prompt2, gen_config, retry_quota=k == len(models) - 1, cancel=cancel)
+            except _Cancelled:
+                sp["cancelled"] = True
+                return AIStatus(False, "Đã huỷ: đã có kết quả từ lời gọi khác.")
+            except Exception as e:
+                if _is_auth_error(e):
+                    self.invalidate()
+                    return AIStatus(False, f"API key bị từ chối, cần kiểm tra lại: {e}")
+                _record_failure(sess, m, e)
+                last_err = e
+                _note_failed(sp, m)
+                continue
+            if not text:
                 last_err = RuntimeError("Model trả về rỗng.")
+                sess.breaker(m).failure(last_err)
+                _note_failed(sp, m)
+                continue
+            sess.breaker(m).success()
+            if use_cache:
+                _cache_put(cache, make_key(prompt, m, gen_config, seed), m, text)  # type: ignore[arg-type]
+            return AIStatus(True, text, used_model=m)
+        return AIStatus(False, f"AI thất bại sau khi thử {len(models)} model. Lỗi cuối: {last_err}")
+
+    def _generate_hedged(self, prompt: str, hedge_after_s: float, task: str = "auto", **kwargs) -> AIStatus:
+        """Gọi model chính; nếu sau `hedge_after_s` chưa xong thì gọi song song model dự phòng, lấy kết quả về trước."""
+        order = self.route(prompt, kwargs.get("gen_config"), task)  # type: ignore[arg-type]
+        primary, fallback = order[:1], order[1:]
+        if not fallback:
+            return self.generate(prompt, task=task, **kwargs)
+        pool = ThreadPoolExecutor(max_workers=2)
+        rec = metrics.current()
+        cancel = threading.Event()  # đặt khi đã có kết quả -> nhánh thua dừng, không tốn thêm lượt/quota
+
+        def run(models: List[str]) -> AIStatus:
+            with metrics.use(rec):
+                return self.generate(prompt, models=models, task=task, cancel=cancel, **kwargs)
+        try:
+            first = pool.submit(run, primary)
+            done, _ = wait([first], timeout=hedge_after_s)
+            if done:
+                res = first.result()
+                return res if res.ok else self.generate(prompt, models=fallback, task=task, **kwargs)
+            metrics.incr("ai.hedged")
+            pending = {first, pool.submit(run, fallback)}
+            res = AIStatus(False, "AI thất bại.")
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    res = f.result()
+                    if res.ok:
+                        return res
+            return res
+        finally:
+            cancel.set()
+            pool.shutdown(wait=False)
+
+    def generate_many(self, prompts: Sequence[str], concurrency: int = 4,
+                      gen_config: Optional[Dict[str, object]] = None,
+                      seeds: Optional[Sequence[Optional[int]]] = None,
+                      cache: Optional[ResponseCache] = None,
+                      hedge_after_s: Optional[float] = None,
+                      on_done: Optional[Callable[[int, AIStatus], None]] = None,
+                      task: str = "auto") -> List[AIStatus]:
+        """Sinh song song nhiều prompt (tối đa `concurrency` luồng); kết quả theo đúng thứ tự prompts.
+
+        Giới hạn tốc độ theo key, timeout và backoff 429/5xx áp dụng cho từng request như `generate`.
+        `on_done(i, status)` được gọi (từ luồng con) ngay khi prompt thứ i xong — dùng để báo tiến độ.
+        """
+        if not prompts:
+            return []
+        seeds = list(seeds) if seeds is not None else [None] * len(prompts)
+        rec = metrics.current()  # luồng con ghi số liệu vào cùng phiên
+
+        def one(i: int) -> AIStatus:
+            kwargs = {"gen_config": gen_config, "seed": seeds[i], "cache": cache, "task": task}
+            try:
+                with metrics.use(rec):
+                    if hedge_after_s is not None:
+                        stt = self._generate_hedged(prompts[i], hedge_after_s, **kwargs)
+                    else:
+                        stt = self.generate(prompts[i], **kwargs)
+            except Exception as e:  # an toàn: lỗi 1 prompt không làm hỏng cả lô
+                stt = AIStatus(False, f"Lỗi khi sinh: {e}")
+            if on_done is not None:
+                on_done(i, stt)
+            return stt
+
+        if concurrency <= 1 or len(prompts) == 1:
+            return [one(i) for i in range(len(prompts))]
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(prompts))) as pool:
+            return list(pool.map(one, range(len(prompts))))
+
+    def generate_stream(self, prompt: str, gen_config: Optional[Dict[str, object]] = None,
+                        seed: Optional[int] = None, cache: Optional[ResponseCache] = None,
+                        task: str = "strong") -> AIStream:
+        """Như `generate` nhưng trả về từng đoạn văn bản ngay khi model sinh ra (mặc định dùng cho cả đề -> "strong").
+
+        Chỉ chuyển sang model dự phòng nếu model trước lỗi khi chưa trả về đoạn nào.
+        """
+        return AIStream(lambda stream: _timed_stream(
+            stream, self._stream_chunks(stream, prompt, gen_config or DEFAULT_GEN_CONFIG, seed, cache, task), task))
+
+    def _stream_chunks(self, stream: AIStream, prompt: str, gen_config: Dict[str, object],
+                       seed: Optional[int], cache: Optional[ResponseCache], task: str) -> Iterator[str]:
+        use_cache = cache is not None and seed is not None
+        if use_cache:
+            for m in self._tier_order(prompt, task):
+                text = _cache_get(cache, make_key(prompt, m, gen_config, seed))  # type: ignore[arg-type]
+                if text is not None:
+                    metrics.incr("ai.cache_hit")
+                    stream.status = AIStatus(True, text, used_model=m, cached=True)
+                    yield text
+                    return
+            metrics.incr("ai.cache_miss")
+
+        st = self.check_api()
+        if not st.ok:
+            stream.status = st
+            return
+        sess = self._session()
+        if seed is None:
+            seed = random.randint(1, 10_000_000)
+        prompt2 = f"{prompt}\n\n[seed:{seed}]"
+
+        models = self.route(prompt, gen_config, task)
+        if not models:
+            stream.status = self._all_open(self.models)
+            return
+        last_err: Optional[Exception] = None
+        for m in models:
+            parts: List[str] = []
+            try:
+                self._acquire(sess)
+                metrics.incr("ai.tokens_in", estimate_tokens(prompt2))
+                res = self._model(sess, m).generate_content(  # type: ignore[attr-defined]
+                    prompt2, generation_config=gen_config, stream=True,
+                    request_options={"timeout": self.timeout_s},
+                )
+                for chunk in res:
+                    if stream.cancelled:
+                        return
+                    piece = getattr(chunk, "text", None) or ""
+                    if piece:
+                        parts.append(piece)
+                        yield piece
             except Exception as e:
+                if _is_auth_error(e):
+                    self.invalidate()
+                    stream.status = AIStatus(False, f"API key bị từ chối, cần kiểm tra lại: {e}")
+                    return
+                _record_failure(sess, m, e)
+                if parts:  # đã hiện một phần cho người dùng -> không đổi model giữa chừng
+                    stream.status = AIStatus(False, f"Mất kết nối khi đang sinh ({m}): {e}", used_model=m)
+                    return
                 last_err = e
+                metrics.incr("ai.fallbacks")
+                continue
+            text = "".join(parts).strip()
+            if not text:
+                last_err = RuntimeError("Model trả về rỗng.")
+                sess.breaker(m).failure(last_err)
                 continue
-        return AIStatus(False, f"AI thất bại sau khi thử {len(self.models)} model. Lỗi cuối: {last_err}")
+            sess.breaker(m).success()
+            if use_cache:
+                _cache_put(cache, make_key(prompt, m, gen_config, seed), m, text)  # type: ignore[arg-type]
+            stream.status = AIStatus(True, text, used_model=m)
+            return
+        stream.status = AIStatus(False, f"AI thất bại sau khi thử {len(models)} model. Lỗi cuối: {last_err}")
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""Sinh nhiều câu hỏi trong một lần gọi AI (đầu ra JSON có cấu trúc)."""
+from __future__ import annotations
+
+import json
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Hashable, List, Optional, Sequence
+
+from .ai_client import BATCH_GEN_CONFIG, GeminiClient, estimate_tokens
+from .response_cache import ResponseCache
+from .question_format import normalize_question
+from .similarity import DuplicateIndex, signature
+from .validators import validate_question_format, validate_question_schema
+
+# Ước lượng số token đầu ra cho 1 câu (đề + đáp án + khung JSON)
+OUT_TOKENS_PER_QUESTION = 350
+DEFAULT_PROMPT_BUDGET = 6000
+
+@dataclass
+class QuestionSpec:
+    subject: str
+    grade: str
+    topic: str
+    lesson: str
+    yccd: str
+    q_type: str
+    level: str
+    points: float
+
+    def to_question(self, content: str, answer: str) -> Dict[str, object]:
+        """Cùng schema với câu hỏi trong st.session_state.questions."""
+        return {
+            "subject": self.subject,
+            "grade": self.grade,
+            "topic": self.topic,
+            "lesson": self.lesson,
+            "yccd": self.yccd,
+            "type": self.q_type,
+            "level": self.level,
+            "points": float(self.points),
+            "content": content.strip(),
+            "answer": answer.strip(),
+        }
+
+@dataclass
+class BatchResult:
+    questions: List[Optional[Dict[str, object]]]  # theo đúng thứ tự specs; None nếu thất bại
+    failed: List[int] = field(default_factory=list)
+    calls: int = 0
+    messages: List[str] = field(default_factory=list)
+    duplicates: int = 0  # số câu AI trả về bị loại vì gần trùng (đã được sinh lại)
+    malformed: int = 0   # số câu sai định dạng theo dạng câu (đã được sinh lại)
+
+_PROMPT_HEAD = """Đóng vai giáo viên Tiểu học theo CT GDPT 2018 và TT27.
+Soạn {n} câu hỏi kiểm tra theo danh sách YÊU CẦU (JSON) bên dưới, mỗi yêu cầu đúng 1 câu, các câu không trùng nhau.
+
+ĐỊNH DẠNG "content" theo dạng câu:
+- Trắc nghiệm: đề + 4 lựa chọn A/B/C/D mỗi lựa chọn 1 dòng; "answer": 'X'
+- Đúng/Sai: 3-4 mệnh đề a/b/c...; "answer": 'a-Đ, b-S, ...'
+- Ghép nối: Cột A (1..), Cột B (a..); "answer": '1-b, 2-a, ...'
+- Điền khuyết: chừa chỗ trống bằng '........'; "answer": các từ cần điền
+- Tự luận: nêu yêu cầu rõ; "answer": gợi ý đáp án ngắn
+
+CHỈ TRẢ VỀ một mảng JSON, mỗi phần tử: {{"id": <id của yêu cầu>, "content": "...", "answer": "..."}}.
+"content" KHÔNG chứa dòng đáp án. Không viết gì ngoài JSON.
+
+YÊU CẦU:
+"""
+
+def _spec_payload(i: int, spec: QuestionSpec) -> str:
+    return json.dumps({
+        "id": i, "mon": spec.subject, "lop": spec.grade, "chu_de": spec.topic, "bai": spec.lesson,
+        "yccd": spec.yccd, "dang": spec.q_type, "muc": spec.level, "diem": spec.points,
+    }, ensure_ascii=False)
+
+def build_batch_prompt(items: List[str]) -> str:
+    return _PROMPT_HEAD.format(n=len(items)) + "[\n" + ",\n".join(items) + "\n]\n"
+
+def pack_specs(specs: List[QuestionSpec], ids: List[int], prompt_budget: int = DEFAULT_PROMPT_BUDGET,
+               max_output_tokens: int = int(BATCH_GEN_CONFIG["max_output_tokens"]),
+               group_keys: Optional[Sequence[Hashable]] = None) -> List[List[int]]:
+    """Chia các yêu cầu thành ít nhóm nhất vừa ngân sách token đầu vào lẫn đầu ra.
+
+    Có `group_keys` (song song với specs) thì không gộp 2 yêu cầu khác khoá vào cùng nhóm.
+    """
+    per_call = max(1, max_output_tokens // OUT_TOKENS_PER_QUESTION)
+    budget = prompt_budget - estimate_tokens(_PROMPT_HEAD)
+    groups: List[List[int]] = []
+    cur: List[int] = []
+    used = 0
+    for i in ids:
+        cost = estimate_tokens(_spec_payload(i, specs[i]))
+        new_key = group_keys is not None and bool(cur) and group_keys[cur[0]] != group_keys[i]
+        if cur and (new_key or len(cur) >= per_call or used + cost > budget):
+            groups.append(cur)
+            cur, used = [], 0
+        cur.append(i)
+        used += cost
+    if cur:
+        groups.append(cur)
+    return groups
+
+def parse_batch_response(text: str) -> Dict[int, Dict[str, str]]:
+    """Đọc mảng JSON từ đầu ra AI (chịu được ```json ... ``` và chữ thừa quanh mảng)."""
+    t = text.strip()
+    start, end = t.find("["), t.rfind("]")
+    if start < 0 or end <= start:
+        return {}
+    try:
+        arr = json.loads(t[start:end + 1])
+    except ValueError:
+        return {}
+    out: Dict[int, Dict[str, str]] = {}
+    if not isinstance(arr, list):
+        return out
+    for it in arr:
+        if not isinstance(it, dict):
+            continue
+        try:
+            i = int(it.get("id"))
+        except (TypeError, ValueError):
+            continue
+        content = it.get("content")
+        if not isinstance(content, str):
+            continue
+        answer = it.get("answer", "")
+        out[i] = {"content": content, "answer": answer if isinstance(answer, str) else json.dumps(answer, ensure_ascii=False)}
+    return out
+
+def generate_batch(ai: GeminiClient, specs: List[QuestionSpec], max_retries: int = 1,
+                   prompt_budget: int = DEFAULT_PROMPT_BUDGET, seed: Optional[int] = None,
+                   cache: Optional[ResponseCache] = None, concurrency: int = 4,
+                   group_keys: Optional[Sequence[Hashable]] = None,
+                   avoid: Sequence[DuplicateIndex] = (),
+                   progress: Optional[Callable[[int, int], None]] = None) -> BatchResult:
+    """Sinh câu hỏi cho cả danh sách specs; các nhóm chạy song song, chỉ gọi lại AI cho câu lỗi/thiếu.
+
+    Câu gần trùng với câu khác trong lô hoặc với các chỉ mục `avoid` (đề hiện tại, ngân hàng)
+    được coi như lỗi và sinh lại ở lần thử sau.
+    `progress(đã xong, tổng)` báo số yêu cầu đã có phản hồi trong lần thử hiện tại.
+    """
+    result = BatchResult(questions=[None] * len(specs))
+    seen = DuplicateIndex()
+    pending = list(range(len(specs)))
+    for attempt in range(max_retries + 1):
+        if not pending:
+            break
+        # lần thử lại phải đổi seed, nếu không sẽ nhận lại đúng kết quả lỗi từ cache
+        attempt_seed = None if seed is None else seed + attempt
+        groups = pack_specs(specs, pending, prompt_budget, group_keys=group_keys)
+        prompts = [build_batch_prompt([_spec_payload(i, specs[i]) for i in group]) for group in groups]
+        on_done = None
+        if progress is not None:
+            done = [len(specs) - len(pending)]
+            lock = threading.Lock()
+
+            def on_done(g: int, _stt: object) -> None:
+                with lock:
+                    done[0] += len(groups[g])
+                    progress(done[0], len(specs))
+        statuses = ai.generate_many(prompts, concurrency=concurrency, gen_config=BATCH_GEN_CONFIG,
+                                    seeds=[attempt_seed] * len(prompts), cache=cache, on_done=on_done,
+                                    task="fast")  # đầu ra JSON được kiểm tra và sinh lại nếu lỗi -> ưu tiên model rẻ
+        still: List[int] = []
+        for group, stt in zip(groups, statuses):
+            result.calls += 0 if stt.cached else 1
+            if not stt.ok:
+                result.messages.append(stt.message)
+                still.extend(group)
+                continue
+            parsed = parse_batch_response(stt.message)
+            for i in group:
+                item = parsed.get(i)
+                if item is None:
+                    still.append(i)
+                    continue
+                q = normalize_question(specs[i].to_question(item["content"], item["answer"]))
+                if any(x.level == "error" for x in validate_question_schema(q)):
+                    still.append(i)
+                    continue
+                if any(x.level == "error" for x in validate_question_format(q)):
+                    result.malformed += 1
+                    still.append(i)
+                    continue
+                sig = signature(str(q["content"]))
+                if sig is not None and any(idx.best(sig=sig) for idx in (seen, *avoid)):
+                    result.duplicates += 1
+                    still.append(i)
+                    continue
+                if sig is not None:
+                    seen.add(i, sig=sig)
+                result.questions[i] = q
+        pending = still
+    result.failed = pending
+    if result.duplicates:
+        result.messages.append(f"Đã loại {result.duplicates} câu gần trùng với câu đã có.")
+    if result.malformed:
+        result.messages.append(f"Đã loại {result.malformed} câu sai định dạng (thiếu lựa chọn, đáp án không khớp...).")
+    return result
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""Đo hiệu năng các bước chính của app trên dữ liệu tổng hợp, AI dùng `mock_backend` (không cần mạng).
+
+    python -m modules.benchmark                      # chạy tất cả, ghi thêm vào benchmarks.jsonl
+    python -m modules.benchmark --only docx_export,generate_batch --repeat 10
+    python -m modules.benchmark --latency 0.5 --error-rate 0.1 --compare
+    python -m modules.benchmark --check-import       # thời gian import lúc khởi động có vượt ngân sách không
+
+Mỗi lần chạy ghi 1 dòng JSON cho mỗi phép đo (thời điểm, commit, tham số, min/median/max giây, thông lượng)
+vào file `--out`; `--compare` so median với lần chạy trước có cùng tham số.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from .ai_client import GeminiClient
+from .batch_gen import QuestionSpec, build_batch_prompt, generate_batch, pack_specs, _spec_payload
+from .curriculum_store import CompactStore, build_store
+from .data_loader import CurriculumDB
+from .docx_export import export_exam_docx, export_variants_zip
+from .matrix_normalizer import matrix_table, normalize_matrix
+from .matrix_parser import parse_matrix_file
+from .mock_backend import MockGenAI
+from .validators import ALLOWED_LEVELS, ALLOWED_TYPES
+from .variants import make_variants
+
+DEFAULT_OUT = Path("benchmarks.jsonl")
+# Khởi động lạnh: import các module của app (sau streamlit) phải nhanh và chưa kéo theo thư viện nặng
+IMPORT_BUDGET_S = 0.15
+HEAVY_MODULES = ("pandas", "numpy", "docx", "lxml", "openpyxl", "google.generativeai")
+_IMPORT_PROBE = """
+import json, sys, time
+import streamlit
+t0 = time.perf_counter()
+import modules.ui_tabs
+from modules.ai_client import GeminiClient
+GeminiClient()
+print(json.dumps({"s": time.perf_counter() - t0, "heavy": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+_SUBJECTS = ("Toán", "Tiếng Việt", "Tin học", "Khoa học", "Lịch sử và Địa lí", "Công nghệ")
+_GRADES = ("1", "2", "3", "4", "5")
+
+@dataclass
+class BenchResult:
+    name: str
+    items: int          # số đơn vị xử lý mỗi lần (bài, dòng ma trận, câu, file...)
+    runs: List[float]   # giây mỗi lần
+
+    @property
+    def median_s(self) -> float:
+        return statistics.median(self.runs)
+
+    def record(self, meta: Dict[str, object]) -> Dict[str, object]:
+        return {
+            **meta, "name": self.name, "items": self.items, "repeat": len(self.runs),
+            "min_s": round(min(self.runs), 6), "median_s": round(self.median_s, 6), "max_s": round(max(self.runs), 6),
+            "items_per_s": round(self.items / self.median_s, 2) if self.median_s > 0 else None,
+        }
+
+@dataclass
+class BenchConfig:
+    repeat: int = 5
+    lessons: int = 300       # số bài mỗi Môn/Lớp trong DB tổng hợp
+    matrix_topics: int = 30
+    questions: int = 40
+    concurrency: int = 4
+    latency_s: float = 0.2
+    jitter_s: float = 0.05
+    error_rate: float = 0.0
+    quota_rate: float = 0.0
+
+def _timed(fn: Callable[[], object], repeat: int, setup: Optional[Callable[[], None]] = None) -> List[float]:
+    runs: List[float] = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - t0)
+    return runs
+
+def _curriculum(lessons: int) -> Dict[str, Dict[str, List[Dict[str, str]]]]:
+    return {
+        s: {g: [{"topic": f"Chủ đề {k // 20 + 1}", "lesson": f"Bài {k + 1}: {s} lớp {g}",
+                 "yccd": f"Nêu được nội dung {k + 1} của {s.lower()} lớp {g}; vận dụng vào tình huống đơn giản."}
+                for k in range(lessons)] for g in _GRADES}
+        for s in _SUBJECTS
+    }
+
+def _matrix_xlsx(topics: int) -> BytesIO:
+    rows = []
+    for k in range(topics):
+        row: Dict[str, object] = {"Chủ đề": f"Chủ đề {k + 1}"}
+        for m in (1, 2, 3):
+            row[f"Mức {m} - TN - Số câu"] = (k + m) % 3
+            row[f"Mức {m} - TN - Điểm"] = 0.5 * ((k + m) % 3)
+            row[f"Mức {m} - TL - Số câu"] = (k * m) % 2
+            row[f"Mức {m} - TL - Điểm"] = float((k * m) % 2)
+        rows.append(row)
+    bio = BytesIO()
+    pd.DataFrame(rows).to_excel(bio, index=False)
+    bio.seek(0)
+    bio.name = "ma_tran.xlsx"  # type: ignore[attr-defined]
+    return bio
+
+def _specs(n: int) -> List[QuestionSpec]:
+    return [QuestionSpec(subject="Toán", grade="3", topic=f"Chủ đề {k % 6 + 1}", lesson=f"Bài {k + 1}",
+                         yccd="Thực hiện được phép cộng, trừ trong phạm vi 1000.",
+                         q_type=ALLOWED_TYPES[k % 5], level=ALLOWED_LEVELS[k % 3], points=0.5)
+            for k in range(n)]
+
+def _questions(n: int) -> List[Dict[str, object]]:
+    ai = GeminiClient(backend=MockGenAI(latency_s=0, jitter_s=0, chars_per_s=0), rpm=100_000)
+    res = generate_batch(ai, _specs(n), concurrency=1)
+    return [q for q in res.questions if q is not None]
+
+def measure_import() -> Tuple[float, List[str]]:
+    """(giây import module của app, các thư viện nặng đã bị nạp) — đo trong tiến trình Python mới."""
+    out = subprocess.run([sys.executable, "-W", "ignore", "-c", _IMPORT_PROBE], capture_output=True, text=True,
+                         cwd=Path(__file__).resolve().parent.parent, timeout=120, check=True)
+    res = json.loads(out.stdout.strip().splitlines()[-1])
+    return float(res["s"]), list(res["heavy"])
+
+def bench_cold_import(cfg: BenchConfig, tmp: Path) -> List[BenchResult]:
+    return [BenchResult("cold_import", 1, [measure_import()[0] for _ in range(cfg.repeat)])]
+
+def check_import(repeat: int = 3) -> int:
+    """0 nếu import vừa ngân sách và không nạp thư viện nặng; 1 nếu không."""
+    runs = [measure_import() for _ in range(repeat)]
+    took = statistics.median(r[0] for r in runs)
+    heavy = sorted({m for _, h in runs for m in h})
+    print(f"Import module app: {took * 1000:.0f} ms (ngân sách {IMPORT_BUDGET_S * 1000:.0f} ms)")
+    if heavy:
+        print(f"Thư viện nặng bị nạp lúc khởi động: {', '.join(heavy)}")
+    return 0 if took <= IMPORT_BUDGET_S and not heavy else 1
+
+def bench_db_load(cfg: BenchConfig, tmp: Path) -> List[BenchResult]:
+    src = tmp / "curriculum.json"
+    src.write_text(json.dumps(_curriculum(cfg.lessons), ensure_ascii=False), encoding="utf-8")
+    dst = tmp / "curriculum.ct18"
+    build_store(src, dst)
+    n = len(_SUBJECTS) * len(_GRADES) * cfg.lessons
+
+    def touch(db: CurriculumDB) -> None:
+        for t in db.topics("Toán", "3"):
+            db.lessons("Toán", "3", t)
+
+    def compact() -> None:
+        store = CompactStore(dst)
+        try:
+            touch(CurriculumDB.from_store(store))
+        finally:
+            store.close()
+    return [
+        BenchResult("db_load_json", n, _timed(lambda: touch(CurriculumDB.from_json_file(src)), cfg.repeat)),
+        BenchResult("db_load_ct18", n, _timed(compact, cfg.repeat)),
+    ]
+
+def bench_matrix_parse(cfg: BenchConfig, tmp: Path) -> List[BenchResult]:
+    from . import matrix_parser
+    data = _matrix_xlsx(cfg.matrix_topics)
+
+    def clear() -> None:  # đo đọc file thật, không lấy từ cache theo hash
+        with matrix_parser._CACHE_LOCK:
+            matrix_parser._CACHE.clear()
+
+    def run() -> None:
+        res = parse_matrix_file(data)
+        assert res.ok and res.df is not None, res.message
+        normalize_matrix(res.df)
+    return [BenchResult("matrix_parse", cfg.matrix_topics, _timed(run, cfg.repeat, setup=clear))]
+
+def bench_prompt_build(cfg: BenchConfig, tmp: Path) -> List[BenchResult]:
+    res = parse_matrix_file(_matrix_xlsx(cfg.matrix_topics))
+    norm = normalize_matrix(res.df)  # type: ignore[arg-type]
+    specs = _specs(cfg.questions)
+    ids = list(range(len(specs)))
+
+    def run() -> None:
+        matrix_table(norm)
+        for group in pack_specs(specs, ids):
+            build_batch_prompt([_spec_payload(i, specs[i]) for i in group])
+    return [BenchResult("prompt_build", cfg.questions, _timed(run, cfg.repeat))]
+
+def _mock_client(cfg: BenchConfig) -> Tuple[GeminiClient, MockGenAI]:
+    backend = MockGenAI(latency_s=cfg.latency_s, jitter_s=cfg.jitter_s,
+                        error_rate=cfg.error_rate, quota_rate=cfg.quota_rate)
+    return GeminiClient(backend=backend, rpm=100_000), backend
+
+def bench_generate_parallel(cfg: BenchConfig, tmp: Path) -> List[BenchResult]:
+    ai, _ = _mock_client(cfg)
+    specs = _specs(cfg.questions)
+    prompts = [build_batch_prompt([_spec_payload(0, s)]) for s in specs]
+    out: List[BenchResult] = []
+    for c in sorted({1, cfg.concurrency}):
+        out.append(BenchResult(f"generate_parallel_c{c}", len(prompts),
+                               _timed(lambda: ai.generate_many(prompts, concurrency=c), max(1, cfg.repeat // 2))))
+    return out
+
+def bench_generate_batch(cfg: BenchConfig, tmp: Path) -> List[BenchResult]:
+    ai, _ = _mock_client(cfg)
+    specs = _specs(cfg.questions)
+    return [BenchResult("generate_batch", len(specs),
+                        _timed(lambda: generate_batch(ai, specs, concurrency=cfg.concurrency), cfg.repeat))]
+
+def bench_docx_export(cfg: BenchConfig, tmp: Path) -> List[BenchResult]:
+    qs = _questions(cfg.questions)
+    meta = {"school": "Trường Tiểu học", "title": "ĐỀ KIỂM TRA", "subject": "Toán", "grade": "3", "term": "Cuối kì I"}
+    variants = make_variants(qs, 4, seed=1)
+    return [
+        BenchResult("docx_export", len(qs), _timed(lambda: export_exam_docx(meta, qs), cfg.repeat)),
+        BenchResult("docx_variants_zip", len(variants),
+                    _timed(lambda: export_variants_zip(meta, variants, answer_key="separate"), cfg.repeat)),
+    ]
+
+BENCHES: Dict[str, Callable[[BenchConfig, Path], List[BenchResult]]] = {
+    "cold_import": bench_cold_import,
+    "db_load": bench_db_load,
+    "matrix_parse": bench_matrix_parse,
+    "prompt_build": bench_prompt_build,
+    "generate_parallel": bench_generate_parallel,
+    "generate_batch": bench_generate_batch,
+    "docx_export": bench_docx_export,
+}
+
+def _git_rev() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+                             cwd=Path(__file__).resolve().parent)
+        return out.stdout.strip()
+    except Exception:
+        return ""
+
+def run_benchmarks(cfg: BenchConfig, only: Optional[List[str]] = None) -> List[BenchResult]:
+    results: List[BenchResult] = []
+    with tempfile.TemporaryDirectory(prefix="dekiemtra-bench-") as d:
+        for name, fn in BENCHES.items():
+            if only and name not in only:
+                continue
+            results.extend(fn(cfg, Path(d)))
+    return results
+
+def _previous(path: Path, params: Dict[str, object]) -> Dict[str, float]:
+    """median_s của lần chạy gần nhất (cùng tham số) cho mỗi phép đo."""
+    prev: Dict[str, float] = {}
+    if not path.exists():
+        return prev
+    for line in path.read_text(encoding="utf-8").splitlines():
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            continue
+        if rec.get("params") == params:
+            prev[rec["name"]] = float(rec["median_s"])
+    return prev
+
+def main(argv: Optional[List[str]] = None) -> int:
+    defaults = BenchConfig()
+    ap = argparse.ArgumentParser(prog="python -m modules.benchmark", description="Đo hiệu năng (AI giả lập, không cần mạng).")
+    ap.add_argument("--out", type=Path, default=DEFAULT_OUT, help="file JSONL ghi kết quả (mặc định: %(default)s)")
+    ap.add_argument("--only", default="", help=f"chỉ chạy các phép đo (phân cách dấu phẩy): {', '.join(BENCHES)}")
+    ap.add_argument("--repeat", type=int, default=defaults.repeat)
+    ap.add_argument("--questions", type=int, default=defaults.questions)
+    ap.add_argument("--concurrency", type=int, default=defaults.concurrency)
+    ap.add_argument("--latency", type=float, default=defaults.latency_s, help="độ trễ giả lập mỗi lần gọi AI (giây)")
+    ap.add_argument("--error-rate", type=float, default=defaults.error_rate, help="tỉ lệ lỗi 503 giả lập")
+    ap.add_argument("--quota-rate", type=float, default=defaults.quota_rate, help="tỉ lệ lỗi 429 giả lập")
+    ap.add_argument("--compare", action="store_true", help="so với lần chạy trước cùng tham số trong --out")
+    ap.add_argument("--no-save", action="store_true")
+    ap.add_argument("--check-import", action="store_true", help="chỉ kiểm tra ngân sách thời gian import; mã thoát 1 nếu vượt")
+    args = ap.parse_args(argv)
+    if args.check_import:
+        return check_import()
+
+    cfg = BenchConfig(repeat=max(1, args.repeat), questions=args.questions, concurrency=args.concurrency,
+                      latency_s=args.latency, error_rate=args.error_rate, quota_rate=args.quota_rate)
+    only = [s.strip() for s in args.only.split(",") if s.strip()]
+    unknown = [s for s in only if s not in BENCHES]
+    if unknown:
+        ap.error(f"Không có phép đo: {', '.join(unknown)}")
+    params = asdict(cfg)
+    prev = _previous(args.out, params) if args.compare else {}
+
+    results = run_benchmarks(cfg, only)
+    meta = {"ts": time.strftime("%Y-%m-%dT%H:%M:%S"), "rev": _git_rev(), "python": platform.python_version(),
+            "params": params}
+    records = [r.record(meta) for r in results]
+    for r in records:
+        line = f"{r['name']:<24} median {r['median_s'] * 1000:9.1f} ms   {r['items_per_s'] or 0:10.1f} /s"
+        base = prev.get(str(r["name"]))
+        if base:
+            line += f"   ({(float(r['median_s']) / base - 1) * 100:+.1f}% so với lần trước)"
+        print(line)
+    if not args.no_save:
+        with args.out.open("a", encoding="utf-8") as f:
+            for r in records:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+        print(f"Đã ghi {len(records)} kết quả vào {args.out}.")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import importlib
+import os
 import sys
 from pathlib import Path
-from typing import Optional, Tuple
+from types import ModuleType
+from typing import Any, Optional, Tuple
 
 def ensure_app_path() -> Path:
     """Ensure the folder containing app.py is on sys.path, preventing ModuleNotFoundError."""
@@ -12,6 +15,26 @@ def ensure_app_path() -> Path:
         sys.path.insert(0, str(here))
     return here
 
+class LazyModule:
+    """Module chỉ được import ở lần đầu truy cập thuộc tính (vd. `pd.DataFrame`) — giảm thời gian khởi động app."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._mod: Optional[ModuleType] = None
+
+    def __getattr__(self, attr: str) -> Any:
+        mod = self._mod
+        if mod is None:
+            mod = self._mod = importlib.import_module(self._name)
+        return getattr(mod, attr)
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self._name!r}{' (loaded)' if self._mod is not None else ''}>"
+
+def lazy_import(name: str) -> Any:
+    """`pd = lazy_import("pandas")` thay cho `import pandas as pd` ở đầu file (module nặng, không phải lúc nào cũng cần)."""
+    return LazyModule(name)
+
 def safe_import_genai() -> Tuple[bool, Optional[object], str]:
     """Try import google.generativeai. Return (ok, module, error_message)."""
     try:
@@ -19,3 +42,10 @@ def safe_import_genai() -> Tuple[bool, Optional[object], str]:
         return True, genai, ""
     except Exception as e:
         return False, None, f"Không import được google.generativeai: {e}"
+
+def app_data_dir() -> Path:
+    """Thư mục ghi dữ liệu cục bộ (cache, ...). Đặt DEKIEMTRA_DATA_DIR để đổi vị trí."""
+    base = os.getenv("DEKIEMTRA_DATA_DIR") or str(Path.home() / ".cache" / "dekiemtra")
+    path = Path(base)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
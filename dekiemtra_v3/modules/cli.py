@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""Ra đề hàng loạt không cần giao diện: ma trận (.xlsx/.xls/.csv) hoặc danh sách yêu cầu câu hỏi (JSON) -> file Word.
+
+    python -m modules.cli matrix ma_tran_toan3.xlsx --subject Toán --grade 3 --out de/
+    python -m modules.cli specs cau_hoi.json --variants 4 --answer-key separate
+    python -m modules.cli run ke_hoach.json --out de/ --cache     # nhiều đề (mọi môn/lớp) trong 1 lần chạy
+
+File kế hoạch của `run`: {"defaults": {...}, "exams": [{"matrix": "toan3.xlsx", "subject": "Toán", "grade": "3"},
+{"specs": "tv4.json"}, ...]} (hoặc chỉ mảng "exams"). Mỗi đề nhận các khoá trùng tên tuỳ chọn dòng lệnh:
+school, title, term, sheet, header_row, variants, shuffle_seed, answer_key, name (tên file). Đường dẫn tương đối
+tính từ thư mục của file kế hoạch; "specs" cũng có thể là mảng yêu cầu viết thẳng trong kế hoạch.
+
+API key: GEMINI_API_KEY hoặc --api-key (DEKIEMTRA_AI_BACKEND=mock để chạy thử không cần mạng).
+Đề lỗi không làm dừng các đề sau; yêu cầu chưa sinh được ghi ra `<tên file>_loi.json` để chạy lại bằng lệnh `specs`.
+Với --cache, chạy lại cả kế hoạch sau khi bị ngắt chỉ gọi AI cho phần chưa có kết quả.
+Mã thoát: 0 nếu mọi đề đủ câu, 1 nếu có đề lỗi/thiếu câu, 2 nếu sai tham số hoặc không dùng được AI.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+from dataclasses import asdict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .ai_client import GeminiClient
+from .data_loader import CurriculumDB, load_default_db
+from .matrix_normalizer import NormalizedMatrix
+from .response_cache import default_cache
+from .services import (ANSWER_KEYS, DEFAULT_TITLE, ExamResult, check_exam, exam_file_stem, exam_meta,
+                       generate_from_matrix, generate_from_specs, load_matrix, load_specs, safe_file_name,
+                       specs_from_items, write_exam)
+
+PROGRESS_EVERY_S = 2.0
+DEFAULT_OUT = Path("de_kiem_tra")
+
+# khoá của 1 đề trong file kế hoạch -> đều có tuỳ chọn dòng lệnh cùng tên (trừ matrix/specs/name)
+_EXAM_KEYS = ("matrix", "specs", "subject", "grade", "school", "title", "term", "sheet", "header_row",
+              "variants", "shuffle_seed", "answer_key", "name")
+_OPTION_KEYS = ("subject", "grade", "school", "title", "term", "sheet", "header_row", "variants", "shuffle_seed", "answer_key")
+
+Exam = Dict[str, object]
+
+def _log(msg: str) -> None:
+    print(msg, file=sys.stderr, flush=True)
+
+def _progress(label: str) -> Callable[[int, int], None]:
+    last = [0.0]
+
+    def report(done: int, total: int) -> None:
+        if done >= total or time.monotonic() - last[0] >= PROGRESS_EVERY_S:
+            last[0] = time.monotonic()
+            _log(f"  {label}: {done}/{total} câu")
+    return report
+
+def load_plan(path: Path, defaults: Optional[Exam] = None) -> List[Exam]:
+    """Đọc file kế hoạch; ValueError nếu sai cấu trúc (kiểm tra hết trước khi gọi AI).
+
+    `defaults` (tuỳ chọn dòng lệnh) < "defaults" của kế hoạch < khoá của từng đề.
+    """
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Không đọc được {path}: {e}") from None
+    defaults = dict(defaults or {})
+    if isinstance(data, dict):
+        defaults.update(data.get("defaults") or {})
+        data = data.get("exams")
+    if not isinstance(data, list) or not data:
+        raise ValueError(f"{path}: cần mảng \"exams\" (không rỗng).")
+    base = path.resolve().parent
+    exams: List[Exam] = []
+    for n, raw in enumerate(data, 1):
+        if not isinstance(raw, dict):
+            raise ValueError(f"Đề {n}: phải là object JSON.")
+        exam = {**defaults, **raw}
+        unknown = sorted(set(exam) - set(_EXAM_KEYS))
+        if unknown:
+            raise ValueError(f"Đề {n}: khoá không hợp lệ {', '.join(unknown)}.")
+        for k in ("matrix", "specs"):
+            if isinstance(exam.get(k), str):
+                exam[k] = str(base / str(exam[k]))
+        _check_exam(exam, f"Đề {n}")
+        exams.append(exam)
+    return exams
+
+def _check_exam(exam: Exam, where: str) -> None:
+    if bool(exam.get("matrix")) == bool(exam.get("specs")):
+        raise ValueError(f"{where}: cần đúng 1 trong 2 khoá \"matrix\" hoặc \"specs\".")
+    if exam.get("matrix") and not (exam.get("subject") and exam.get("grade")):
+        raise ValueError(f"{where}: đề từ ma trận cần \"subject\" và \"grade\".")
+    if str(exam.get("answer_key", "include")) not in ANSWER_KEYS:
+        raise ValueError(f"{where}: answer_key phải là một trong {', '.join(ANSWER_KEYS)}.")
+
+def _label(exam: Exam) -> str:
+    for k in ("name", "matrix", "specs"):
+        if isinstance(exam.get(k), str) and exam[k]:
+            return str(exam[k])
+    return f"{exam.get('subject', '')} lớp {exam.get('grade', '')}".strip()
+
+def _generate(ai: GeminiClient, exam: Exam, db: Optional[CurriculumDB], label: str,
+              ai_kwargs: Dict[str, object]) -> Tuple[ExamResult, Optional[NormalizedMatrix]]:
+    if exam.get("matrix"):
+        header_row = int(exam.get("header_row") or 0)  # đánh số từ 1 như ở Tab 1; 0 = tự dò
+        norm = load_matrix(str(exam["matrix"]), sheet=exam.get("sheet") or None,  # type: ignore[arg-type]
+                           header_row=header_row - 1 if header_row else None)
+        _log(f"  {label}: ma trận {len(norm.cells)} ô, {norm.total_questions} câu, {norm.total_points:g} điểm")
+        return generate_from_matrix(ai, norm, str(exam["subject"]), str(exam["grade"]), db=db,
+                                    progress=_progress(label), **ai_kwargs), norm  # type: ignore[arg-type]
+    defaults = {k: exam[k] for k in ("subject", "grade") if exam.get(k)}
+    source = exam["specs"]
+    specs = specs_from_items(source, defaults) if isinstance(source, list) else load_specs(str(source), defaults)
+    return generate_from_specs(ai, specs, progress=_progress(label), **ai_kwargs), None  # type: ignore[arg-type]
+
+def run_exam(ai: GeminiClient, exam: Exam, out_dir: Path, db: Optional[CurriculumDB],
+             ai_kwargs: Dict[str, object]) -> bool:
+    """Sinh + xuất 1 đề; True nếu đủ câu. Lỗi của đề này chỉ được báo, không ném ra ngoài."""
+    label = _label(exam)
+    try:
+        return _run_exam(ai, exam, out_dir, db, ai_kwargs, label)
+    except ValueError as e:  # lỗi dữ liệu đầu vào: thông báo đã đủ rõ
+        _log(f"✗ {label}: {e}")
+    except Exception as e:  # ghi file, xuất Word, tham số sai kiểu... -> bỏ qua đề này, chạy tiếp đề sau
+        _log(f"✗ {label}: {type(e).__name__}: {e}")
+    return False
+
+def _run_exam(ai: GeminiClient, exam: Exam, out_dir: Path, db: Optional[CurriculumDB],
+              ai_kwargs: Dict[str, object], label: str) -> bool:
+    t0 = time.monotonic()
+    res, norm = _generate(ai, exam, db, label, ai_kwargs)
+    if not res.questions:
+        _log(f"✗ {label}: không sinh được câu nào. " + " ".join(dict.fromkeys(res.messages[-3:])))
+        return False
+    first = res.questions[0]
+    subject, grade = str(exam.get("subject") or first.get("subject", "")), str(exam.get("grade") or first.get("grade", ""))
+    stem = safe_file_name(str(exam.get("name") or exam_file_stem(subject, grade)))
+    for it in check_exam(res.questions, norm):
+        _log(f"  ⚠️ {it.message}")
+    meta = exam_meta(subject, grade, school=str(exam.get("school", "")), title=str(exam.get("title") or DEFAULT_TITLE),
+                     term=str(exam.get("term", "")))
+    files = write_exam(out_dir, meta, res.questions, stem=stem, variants=int(exam.get("variants") or 1),  # type: ignore[arg-type]
+                       seed=int(exam.get("shuffle_seed", 2024)), answer_key=str(exam.get("answer_key", "include")))  # type: ignore[arg-type]
+    if res.failed:
+        failed_path = out_dir / f"{stem}_loi.json"
+        failed_path.write_text(json.dumps([asdict(s) for s in res.failed], ensure_ascii=False, indent=1), encoding="utf-8")
+        files.append(failed_path)
+        for msg in dict.fromkeys(res.messages[-3:]):
+            _log(f"  {msg}")
+    mark = "✓" if res.ok else "✗"
+    missing = f", thiếu {len(res.failed)} câu" if res.failed else ""
+    _log(f"{mark} {label}: {len(res.questions)} câu{missing}, {res.calls} lần gọi AI, {time.monotonic() - t0:.1f} s"
+         f" -> {', '.join(str(p) for p in files)}")
+    return res.ok
+
+def _load_db() -> Optional[CurriculumDB]:
+    try:
+        return load_default_db()
+    except (OSError, ValueError) as e:
+        _log(f"Không đọc được DB CT2018 ({e}); sinh theo ma trận không kèm gợi ý Bài/YCCĐ.")
+        return None
+
+def _exam_from_args(args: argparse.Namespace) -> Exam:
+    exam: Exam = {k: getattr(args, k) for k in _OPTION_KEYS if getattr(args, k) is not None}
+    exam[args.cmd] = str(args.source)
+    if args.name:
+        exam["name"] = args.name
+    return exam
+
+def main(argv: Optional[List[str]] = None) -> int:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--out", type=Path, default=DEFAULT_OUT, help="thư mục ghi đề (mặc định: %(default)s)")
+    common.add_argument("--subject", help="Môn (bắt buộc với ma trận; mặc định cho yêu cầu thiếu Môn)")
+    common.add_argument("--grade", help="Lớp (bắt buộc với ma trận; mặc định cho yêu cầu thiếu Lớp)")
+    common.add_argument("--school")
+    common.add_argument("--title", help=f"tiêu đề (mặc định: {DEFAULT_TITLE})")
+    common.add_argument("--term", help="Kì, vd. \"Học kì I\"")
+    common.add_argument("--variants", type=int, help="số mã đề; > 1 -> xuất 1 file ZIP")
+    common.add_argument("--shuffle-seed", type=int, help="seed trộn mã đề (mặc định 2024)")
+    common.add_argument("--answer-key", choices=ANSWER_KEYS, help="đáp án: kèm cuối đề / file riêng / không kèm")
+    common.add_argument("--api-key", default=None, help="mặc định: biến môi trường GEMINI_API_KEY")
+    common.add_argument("--concurrency", type=int, default=4, help="số yêu cầu AI chạy song song")
+    common.add_argument("--cache", action="store_true", help="lưu & dùng lại kết quả AI (chạy lại không tốn lượt gọi)")
+    common.add_argument("--ai-seed", type=int, default=0, help="mã biến thể khi dùng --cache; đổi để có đề khác")
+    common.add_argument("--no-db", action="store_true", help="không gợi ý Bài/YCCĐ từ DB CT2018 khi sinh theo ma trận")
+
+    ap = argparse.ArgumentParser(prog="python -m modules.cli", description="Ra đề hàng loạt (không cần giao diện).")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    m = sub.add_parser("matrix", parents=[common], help="1 đề từ file ma trận")
+    m.add_argument("source", type=Path)
+    m.add_argument("--sheet")
+    m.add_argument("--header-row", type=int, help="dòng tiêu đề, đánh số từ 1 (mặc định: tự dò)")
+    m.add_argument("--name", help="tên file đề (mặc định: De_<Môn>_lop<Lớp>)")
+    s = sub.add_parser("specs", parents=[common], help="1 đề từ file JSON các yêu cầu câu hỏi")
+    s.add_argument("source", type=Path)
+    s.add_argument("--name")
+    r = sub.add_parser("run", parents=[common], help="nhiều đề theo file kế hoạch JSON")
+    r.add_argument("source", type=Path)
+    args = ap.parse_args(argv)
+
+    try:
+        if args.cmd == "run":
+            # tuỳ chọn dòng lệnh là mặc định chung, khoá trong kế hoạch được ưu tiên
+            exams = load_plan(args.source, {k: getattr(args, k) for k in _OPTION_KEYS if getattr(args, k, None) is not None})
+        else:
+            args.sheet = getattr(args, "sheet", None)
+            args.header_row = getattr(args, "header_row", None)
+            exams = [_exam_from_args(args)]
+            _check_exam(exams[0], str(args.source))
+    except ValueError as e:
+        ap.error(str(e))
+
+    ai = GeminiClient(api_key=args.api_key)
+    stt = ai.check_api()
+    if not stt.ok:
+        _log(f"AI không dùng được: {stt.message}")
+        return 2
+    db = None if args.no_db or not any(e.get("matrix") for e in exams) else _load_db()
+    ai_kwargs: Dict[str, object] = {"concurrency": max(1, args.concurrency)}
+    if args.cache:
+        ai_kwargs.update(seed=args.ai_seed, cache=default_cache())
+
+    t0 = time.monotonic()
+    ok = 0
+    for n, exam in enumerate(exams, 1):
+        _log(f"[{n}/{len(exams)}] {_label(exam)}")
+        ok += run_exam(ai, exam, args.out, db, ai_kwargs)
+    _log(f"Xong {ok}/{len(exams)} đề trong {time.monotonic() - t0:.0f} s; file ở {args.out}.")
+    return 0 if ok == len(exams) else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
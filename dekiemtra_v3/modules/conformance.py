@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""Đối chiếu đề đang soạn với ma trận: số câu và điểm theo Chủ đề × Mức × Dạng.
+
+Tổng theo ô được cập nhật dần: mỗi lần `sync` chỉ trừ/cộng phần của câu mới thêm, câu đã xoá và câu
+bị sửa Chủ đề/Mức/Dạng/Điểm, không cộng lại cả đề. Kết quả đối chiếu được giữ lại tới khi đề hoặc ma trận đổi.
+"""
+from __future__ import annotations
+
+import functools
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from .matrix_normalizer import MatrixCell, NormalizedMatrix, parse_level, parse_type
+from .text_utils import fold_vi
+from .validators import ValidationIssue, validate_points_total
+
+CellKey = Tuple[str, str, str]       # (chủ đề đã bỏ dấu, mức chuẩn, dạng chuẩn; "" = ma trận không ghi dạng)
+_Raw = Tuple[object, object, object, object]  # (topic, level, type, points) như trong câu hỏi
+_EPS = 1e-6
+
+@functools.lru_cache(maxsize=4096)  # đề lớn lặp lại ít tổ hợp Chủ đề/Mức/Dạng
+def cell_key(topic: object, level: object, q_type: object) -> CellKey:
+    """Khoá so khớp: không phân biệt hoa/thường, dấu; "M2", "Mức 2: Hiểu" cùng 1 mức; "TN" = "Trắc nghiệm"."""
+    lv, ty = str(level or ""), str(q_type or "")
+    return fold_vi(str(topic or "")), parse_level(lv) or lv.strip(), parse_type(ty) or ty.strip()
+
+@dataclass
+class CellTotal:
+    count: int = 0
+    points: float = 0.0
+
+@dataclass
+class CellStatus:
+    """1 dòng đối chiếu: ô ma trận (hoặc nhóm câu ngoài ma trận) với số câu/điểm cần và đã có."""
+    topic: str
+    level: str
+    q_type: str
+    want_count: int
+    have_count: int
+    want_points: float
+    have_points: float
+
+    @property
+    def state(self) -> str:
+        if not self.want_count and not self.want_points:
+            return "ngoài ma trận"
+        if self.have_count < self.want_count:
+            return "thiếu"
+        if self.have_count > self.want_count:
+            return "thừa"
+        if abs(self.have_points - self.want_points) > _EPS and self.want_points:
+            return "lệch điểm"
+        return "đủ"
+
+    @property
+    def ok(self) -> bool:
+        return self.state == "đủ"
+
+class ConformanceTracker:
+    """Tổng số câu/điểm theo ô của 1 danh sách câu hỏi (vd. st.session_state.questions), cập nhật dần."""
+
+    def __init__(self):
+        self._totals: Dict[CellKey, CellTotal] = {}
+        self._labels: Dict[CellKey, Tuple[str, str, str]] = {}
+        # (id câu, lần xuất hiện) -> (giá trị gốc, khoá, điểm, điểm hợp lệ?) đã cộng vào tổng
+        self._contrib: Dict[Tuple[int, int], Tuple[_Raw, CellKey, float, bool]] = {}
+        self.total_count = 0
+        self.total_points = 0.0
+        self.bad_points = 0      # số câu có điểm không phải số (tính 0 điểm)
+        self.version = 0         # tăng mỗi khi tổng thay đổi
+        self._diff_cache: Optional[Tuple[int, NormalizedMatrix, List[CellStatus]]] = None
+
+    def _apply(self, raw: _Raw, key: CellKey, points: float, valid: bool, sign: int) -> None:
+        tot = self._totals.get(key)
+        if tot is None:
+            tot = self._totals[key] = CellTotal()
+            self._labels[key] = (str(raw[0] or ""), key[1], key[2])
+        tot.count += sign
+        tot.points += sign * points
+        if tot.count <= 0:
+            del self._totals[key]
+            del self._labels[key]
+        self.total_count += sign
+        self.total_points += sign * points
+        self.bad_points += 0 if valid else sign
+
+    def sync(self, questions: Sequence[Dict[str, object]]) -> int:
+        """Đưa tổng về đúng `questions`; trả về số câu đã cộng/trừ lại (0 nếu không có gì đổi)."""
+        seen: Set[Tuple[int, int]] = set()
+        changed = 0
+        occurrences: Dict[int, int] = {}
+        for q in questions:
+            n = occurrences[id(q)] = occurrences.get(id(q), -1) + 1  # cùng 1 dict thêm 2 lần -> 2 câu
+            ident = (id(q), n)
+            seen.add(ident)
+            raw: _Raw = (q.get("topic"), q.get("level"), q.get("type"), q.get("points"))
+            old = self._contrib.get(ident)
+            if old is not None and old[0] == raw:
+                continue
+            if old is not None:
+                self._apply(*old, sign=-1)
+            try:
+                points, valid = float(raw[3]), True  # type: ignore[arg-type]
+            except (TypeError, ValueError):
+                points, valid = 0.0, False
+            new = (raw, cell_key(raw[0], raw[1], raw[2]), points, valid)
+            self._apply(*new, sign=1)
+            self._contrib[ident] = new
+            changed += 1
+        for ident in [k for k in self._contrib if k not in seen]:
+            self._apply(*self._contrib.pop(ident), sign=-1)
+            changed += 1
+        if changed:
+            self.version += 1
+            if not self._contrib:
+                self.total_points = 0.0  # bỏ sai số cộng/trừ số thực khi đề trống
+        return changed
+
+    def totals(self) -> Dict[CellKey, CellTotal]:
+        return {k: CellTotal(v.count, round(v.points, 6)) for k, v in self._totals.items()}
+
+    def points_issues(self, expected_total: float = 10.0) -> List[ValidationIssue]:
+        return validate_points_total(round(self.total_points, 6), expected_total, self.bad_points)
+
+    def diff(self, norm: NormalizedMatrix) -> List[CellStatus]:
+        """Đối chiếu với ma trận, theo thứ tự ô của ma trận; câu không thuộc ô nào xếp cuối.
+
+        Ô không ghi dạng nhận mọi dạng câu cùng Chủ đề × Mức còn lại sau khi đã chia cho các ô có ghi dạng.
+        """
+        if self._diff_cache is not None and self._diff_cache[0] == self.version and self._diff_cache[1] is norm:
+            return self._diff_cache[2]
+        want: Dict[CellKey, List[object]] = {}
+        for c in norm.cells:
+            key = cell_key(c.topic, c.level, c.q_type)
+            w = want.setdefault(key, [c.topic, c.level, c.q_type, 0, 0.0])
+            w[3] = int(w[3]) + c.count  # type: ignore[call-overload]
+            w[4] = float(w[4]) + c.points  # type: ignore[arg-type]
+        have = {k: CellTotal(v.count, v.points) for k, v in self._totals.items()}
+        got: Dict[CellKey, CellTotal] = {}
+        for key in want:
+            if key[2]:
+                got[key] = have.pop(key, CellTotal())
+        for key in want:
+            if not key[2]:
+                acc = CellTotal()
+                for k in [k for k in have if k[:2] == key[:2]]:
+                    t = have.pop(k)
+                    acc.count += t.count
+                    acc.points += t.points
+                got[key] = acc
+        rows = [CellStatus(str(w[0]), str(w[1]), str(w[2]), int(w[3]), got[k].count,  # type: ignore[call-overload]
+                           round(float(w[4]), 6), round(got[k].points, 6)) for k, w in want.items()]  # type: ignore[arg-type]
+        for k, t in have.items():
+            topic, level, q_type = self._labels[k]
+            rows.append(CellStatus(topic, level, q_type, 0, t.count, 0.0, round(t.points, 6)))
+        self._diff_cache = (self.version, norm, rows)
+        return rows
+
+def conformance_issues(rows: Sequence[CellStatus]) -> List[ValidationIssue]:
+    """Cảnh báo ngắn gọn cho các ô chưa khớp ma trận."""
+    out: List[ValidationIssue] = []
+    for r in rows:
+        if r.ok:
+            continue
+        where = f"{r.topic} · {r.level}" + (f" · {r.q_type}" if r.q_type else "")
+        if r.state == "ngoài ma trận":
+            out.append(ValidationIssue("warning", f"{where}: {r.have_count} câu không thuộc ô nào của ma trận."))
+        elif r.state == "lệch điểm":
+            out.append(ValidationIssue("warning", f"{where}: {r.have_points:g} điểm, ma trận cần {r.want_points:g} điểm."))
+        else:
+            out.append(ValidationIssue("warning", f"{where}: {r.state} — có {r.have_count}/{r.want_count} câu."))
+    return out
+
+def missing_matrix(rows: Sequence[CellStatus]) -> NormalizedMatrix:
+    """Ma trận chỉ gồm phần còn thiếu của mỗi ô (số câu và điểm còn lại) — để sinh bù thay vì sinh lại cả đề."""
+    cells: List[MatrixCell] = []
+    for r in rows:
+        if r.state != "thiếu":
+            continue
+        left = max(r.want_points - r.have_points, 0.0)
+        cells.append(MatrixCell(r.topic, r.level, r.q_type, r.want_count - r.have_count, round(left, 6)))
+    return NormalizedMatrix(cells=cells, layout="long")
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""Định dạng nhị phân gọn cho DB CT2018 (đọc qua mmap, nạp lười từng Môn/Lớp).
+
+Bố cục file (little-endian):
+    header   : magic(8s) n_strings n_slices strings_off slices_off records_off (5×u32)
+    strings  : offsets u32[n_strings + 1] + blob UTF-8 (mỗi chuỗi chỉ lưu 1 lần)
+    slices   : n_slices × (subject, grade, rec_start, rec_count) — u32; grade = NO_GRADE: Môn chưa có lớp nào
+    records  : n_records × (topic, lesson, yccd) — chỉ số chuỗi u32
+
+Tạo file từ JSON:
+    python -m modules.curriculum_store build data/curriculum_ct2018.json data/curriculum_ct2018.ct18
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import mmap
+import struct
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+MAGIC = b"CT18DB02"
+_OLD_MAGICS = (b"CT18DB01",)  # bản cũ: không ghi Môn chưa có lớp nào (build lại để khớp JSON)
+NO_GRADE = 0xFFFFFFFF
+_HEADER = struct.Struct("<8s5I")
+_SLICE = struct.Struct("<4I")
+_RECORD = struct.Struct("<3I")
+_FIELDS = ("topic", "lesson", "yccd")
+
+def build_store(src: Path, dst: Path) -> Tuple[int, int]:
+    """Chuyển JSON data[subject][grade] = [{topic, lesson, yccd}] sang file nhị phân.
+
+    Trả về (số slice, số bản ghi).
+    """
+    data = json.loads(src.read_text(encoding="utf-8"))
+    strings: List[str] = []
+    index: Dict[str, int] = {}
+
+    def intern(s: str) -> int:
+        i = index.get(s)
+        if i is None:
+            i = index[s] = len(strings)
+            strings.append(s)
+        return i
+
+    slices = array("I")
+    records = array("I")
+    for subject in sorted(data.keys()):
+        by_grade = data[subject] or {}
+        if not by_grade:
+            slices.extend((intern(subject), NO_GRADE, 0, 0))  # vẫn có trong danh mục như khi đọc JSON
+        for grade in sorted(by_grade.keys(), key=lambda x: int(x)):
+            start = len(records) // 3
+            for it in by_grade[grade] or []:
+                for f in _FIELDS:
+                    records.append(intern((it.get(f) or "").strip()))
+            slices.extend((intern(subject), intern(grade), start, len(records) // 3 - start))
+
+    blob = bytearray()
+    offsets = array("I", [0])
+    for s in strings:
+        blob += s.encode("utf-8")
+        offsets.append(len(blob))
+
+    strings_off = _HEADER.size
+    slices_off = strings_off + len(offsets) * 4 + len(blob)
+    records_off = slices_off + len(slices) * 4
+    header = _HEADER.pack(MAGIC, len(strings), len(slices) // 4, strings_off, slices_off, records_off)
+
+    if struct.pack("=I", 1) != struct.pack("<I", 1):
+        for arr in (offsets, slices, records):
+            arr.byteswap()
+    tmp = dst.with_suffix(dst.suffix + ".tmp")
+    with tmp.open("wb") as fh:
+        fh.write(header)
+        fh.write(offsets.tobytes())
+        fh.write(blob)
+        fh.write(slices.tobytes())
+        fh.write(records.tobytes())
+    tmp.replace(dst)
+    return len(slices) // 4, len(records) // 3
+
+class CompactStore:
+    """Đọc file nhị phân qua mmap; chuỗi chỉ được giải mã khi slice tương ứng được yêu cầu."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        with path.open("rb") as fh:
+            self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_strings, n_slices, strings_off, slices_off, records_off = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC and magic not in _OLD_MAGICS:
+            raise ValueError(f"File không đúng định dạng CT18: {path}")
+        self._n_strings = n_strings
+        self._strings_off = strings_off
+        self._blob_off = strings_off + (n_strings + 1) * 4
+        self._records_off = records_off
+        self._cache: Dict[int, str] = {}
+        # bảng slice rất nhỏ -> đọc ngay để có danh mục Môn/Lớp
+        self._slices: Dict[Tuple[str, str], Tuple[int, int]] = {}
+        self._catalog: Dict[str, List[str]] = {}
+        for i in range(n_slices):
+            s_idx, g_idx, start, count = _SLICE.unpack_from(self._mm, slices_off + i * _SLICE.size)
+            subject = self._string(s_idx)
+            grades = self._catalog.setdefault(subject, [])
+            if g_idx == NO_GRADE:
+                continue
+            grade = self._string(g_idx)
+            self._slices[(subject, grade)] = (start, count)
+            grades.append(grade)
+
+    def _string(self, i: int) -> str:
+        s = self._cache.get(i)
+        if s is None:
+            a, b = struct.unpack_from("<2I", self._mm, self._strings_off + i * 4)
+            s = self._cache[i] = self._mm[self._blob_off + a:self._blob_off + b].decode("utf-8")
+        return s
+
+    def catalog(self) -> Dict[str, List[str]]:
+        return {k: list(v) for k, v in self._catalog.items()}
+
+    def load_slice(self, subject: str, grade: str) -> List[Dict[str, str]]:
+        hit = self._slices.get((subject, grade))
+        if hit is None:
+            return []
+        start, count = hit
+        out: List[Dict[str, str]] = []
+        base = self._records_off + start * _RECORD.size
+        for k in range(count):
+            t, l, y = _RECORD.unpack_from(self._mm, base + k * _RECORD.size)
+            out.append({"topic": self._string(t), "lesson": self._string(l), "yccd": self._string(y)})
+        return out
+
+    def close(self) -> None:
+        self._mm.close()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m modules.curriculum_store", description="Công cụ DB CT2018 dạng nhị phân.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="Chuyển curriculum JSON sang file .ct18")
+    b.add_argument("src", type=Path)
+    b.add_argument("dst", type=Path, nargs="?")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "build":
+        dst = args.dst or args.src.with_suffix(".ct18")
+        n_slices, n_records = build_store(args.src, dst)
+        print(f"Đã tạo {dst} ({n_slices} Môn/Lớp, {n_records} bài, {dst.stat().st_size} bytes).")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
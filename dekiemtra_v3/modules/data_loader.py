@@ -2,9 +2,14 @@
 from __future__ import annotations
 
 import json
+import threading
+import weakref
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
+
+from . import metrics
+from .curriculum_store import CompactStore
 
 @dataclass
 class LessonItem:
@@ -12,56 +17,131 @@ class LessonItem:
     lesson: str
     yccd: str
 
+class _SliceIndex:
+    """Chỉ mục của một cặp (Môn, Lớp): chủ đề có thứ tự, bài theo chủ đề, YCCĐ theo bài."""
+
+    __slots__ = ("topics", "all_lessons", "lessons", "yccd")
+
+    def __init__(self, items: List[Dict[str, str]]):
+        self.topics: List[str] = []
+        self.all_lessons: List[LessonItem] = []
+        self.lessons: Dict[str, List[LessonItem]] = {}
+        self.yccd: Dict[Tuple[str, str], str] = {}
+        for it in items:
+            li = LessonItem(
+                topic=(it.get("topic") or "").strip(),
+                lesson=(it.get("lesson") or "").strip(),
+                yccd=(it.get("yccd") or "").strip(),
+            )
+            self.all_lessons.append(li)
+            if li.topic and li.topic not in self.lessons:
+                self.topics.append(li.topic)
+            self.lessons.setdefault(li.topic, []).append(li)
+            # giữ YCCĐ của bài xuất hiện đầu tiên (như find_yccd cũ)
+            self.yccd.setdefault((li.topic, li.lesson), li.yccd)
+
 class CurriculumDB:
-    """DB CT2018 (từ file DOCX bạn cung cấp) — dùng cho Tab 2."""
+    """DB CT2018 (từ file DOCX bạn cung cấp) — dùng cho Tab 2.
+
+    Chỉ mục của từng (Môn, Lớp) được dựng một lần ở lần truy cập đầu tiên, nên
+    các selectbox nối tầng ở Tab 2 chỉ còn là tra dict. Khi nạp từ file .ct18
+    (xem `curriculum_store`), chỉ những Môn/Lớp được chọn mới được giải mã.
+    """
 
-    def __init__(self, data: Dict[str, Dict[str, List[Dict[str, str]]]]):
-        # data[subject][grade] = list of {topic, lesson, yccd}
+    def __init__(self, grades: Dict[str, List[str]], slice_loader: Callable[[str, str], List[Dict[str, str]]],
+                 data: Optional[Dict[str, Dict[str, List[Dict[str, str]]]]] = None):
+        """`grades[subject]` = các lớp có dữ liệu (có thể rỗng); `slice_loader(subject, grade)` trả về các bài.
+
+        Dùng `from_dict` / `from_json_file` / `from_store` thay vì gọi trực tiếp.
+        """
+        # data[subject][grade] = list of {topic, lesson, yccd}; None khi dữ liệu nằm trong file .ct18
         self.data = data
+        self._subjects: List[str] = sorted(grades.keys())
+        self._grades: Dict[str, List[str]] = {s: sorted(g, key=lambda x: int(x)) for s, g in grades.items()}
+        self._loader = slice_loader
+        self._slices: Dict[Tuple[str, str], _SliceIndex] = {}
+
+    def _slice(self, subject: str, grade: str) -> _SliceIndex:
+        idx = self._slices.get((subject, grade))
+        if idx is None:
+            with metrics.span("db.slice", subject=subject, grade=grade):
+                idx = self._slices.setdefault((subject, grade), _SliceIndex(self._loader(subject, grade)))
+        return idx
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Dict[str, List[Dict[str, str]]]]) -> "CurriculumDB":
+        return cls({subject: list((by_grade or {}).keys()) for subject, by_grade in data.items()},
+                   lambda subject, grade: (data.get(subject) or {}).get(grade) or [], data)
+
+    @classmethod
+    def from_store(cls, store: CompactStore) -> "CurriculumDB":
+        """Không giữ bản dict đầy đủ; mmap của `store` được đóng khi không còn ai giữ DB này."""
+        db = cls(store.catalog(), store.load_slice)
+        weakref.finalize(db, store.close)
+        return db
 
     @classmethod
     def from_json_file(cls, path: Path) -> "CurriculumDB":
-        obj = json.loads(path.read_text(encoding="utf-8"))
-        return cls(obj)
+        return cls.from_dict(json.loads(path.read_text(encoding="utf-8")))
 
     def subjects(self) -> List[str]:
-        return sorted(self.data.keys())
+        return list(self._subjects)
 
     def grades(self, subject: str) -> List[str]:
-        return sorted(self.data.get(subject, {}).keys(), key=lambda x: int(x))
+        return list(self._grades.get(subject, []))
 
     def topics(self, subject: str, grade: str) -> List[str]:
-        items = self.data.get(subject, {}).get(grade, [])
-        topics = []
-        seen = set()
-        for it in items:
-            t = (it.get("topic") or "").strip()
-            if t and t not in seen:
-                seen.add(t)
-                topics.append(t)
-        return topics
+        if grade not in self._grades.get(subject, ()):
+            return []
+        return list(self._slice(subject, grade).topics)
 
     def lessons(self, subject: str, grade: str, topic: Optional[str] = None) -> List[LessonItem]:
-        items = self.data.get(subject, {}).get(grade, [])
-        out: List[LessonItem] = []
-        for it in items:
-            if topic and (it.get("topic") or "").strip() != topic:
-                continue
-            out.append(LessonItem(
-                topic=(it.get("topic") or "").strip(),
-                lesson=(it.get("lesson") or "").strip(),
-                yccd=(it.get("yccd") or "").strip(),
-            ))
-        return out
+        if grade not in self._grades.get(subject, ()):
+            return []
+        idx = self._slice(subject, grade)
+        if not topic:
+            return list(idx.all_lessons)
+        return list(idx.lessons.get(topic, []))
 
     def find_yccd(self, subject: str, grade: str, topic: str, lesson: str) -> str:
-        for it in self.lessons(subject, grade, topic):
-            if it.lesson == lesson:
-                return it.yccd
-        return ""
+        if grade not in self._grades.get(subject, ()):
+            return ""
+        return self._slice(subject, grade).yccd.get((topic, lesson), "")
 
-def load_default_db() -> CurriculumDB:
+# Cache dùng chung trong tiến trình: path -> (mtime_ns, db).
+# Mọi phiên Streamlit dùng chung 1 bản; tự nạp lại khi file dữ liệu thay đổi. Bản cũ (.ct18) đóng mmap khi
+# phiên cuối cùng còn giữ nó bỏ đi — đóng ngay lúc thay có thể làm hỏng lượt chạy đang dùng dở.
+_DB_CACHE: Dict[Path, Tuple[int, CurriculumDB]] = {}
+_DB_LOCK = threading.Lock()
+
+def load_db_cached(path: Path) -> CurriculumDB:
+    """Nạp CurriculumDB (.json hoặc .ct18) một lần cho cả tiến trình; hết hạn theo mtime của file."""
+    path = path.resolve()
+    mtime = path.stat().st_mtime_ns
+    hit = _DB_CACHE.get(path)
+    if hit is not None and hit[0] == mtime:
+        metrics.incr("db.cache_hit")
+        return hit[1]
+    with _DB_LOCK:
+        hit = _DB_CACHE.get(path)
+        if hit is not None and hit[0] == mtime:
+            return hit[1]
+        with metrics.span("db.load", format=path.suffix.lstrip(".")):
+            if path.suffix == ".ct18":
+                db = CurriculumDB.from_store(CompactStore(path))
+            else:
+                db = CurriculumDB.from_json_file(path)
+        _DB_CACHE[path] = (mtime, db)
+        return db
+
+def default_db_path() -> Path:
+    """Ưu tiên file .ct18 đã biên dịch nếu nó không cũ hơn file JSON."""
     here = Path(__file__).resolve().parent.parent
-    data_path = here / "data" / "curriculum_ct2018.json"
-    return CurriculumDB.from_json_file(data_path)
+    json_path = here / "data" / "curriculum_ct2018.json"
+    compact = json_path.with_suffix(".ct18")
+    if compact.exists() and (not json_path.exists() or compact.stat().st_mtime_ns >= json_path.stat().st_mtime_ns):
+        return compact
+    return json_path
 
+def load_default_db() -> CurriculumDB:
+    return load_db_cached(default_db_path())
@@ -1,15 +1,34 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import re
+import threading
+import zipfile
+from collections import OrderedDict
 from io import BytesIO
-from typing import Dict, List
+from typing import Dict, List, Optional, Sequence, Tuple
+from xml.sax.saxutils import escape
 
-from docx import Document
-from docx.shared import Pt
-from docx.enum.text import WD_ALIGN_PARAGRAPH
+from . import metrics
+
+# python-docx (kèm lxml) được nhập trong hàm: chỉ tốn thời gian khi xuất Word lần đầu, không phải lúc khởi động app
+
+# Template (tiêu đề + style) đã dựng sẵn, theo meta; dùng lại cho mọi lần xuất/mọi mã đề
+TEMPLATE_CACHE_SIZE = 32
+_TEMPLATES: "OrderedDict[Tuple[str, ...], Tuple[bytes, Dict[str, str]]]" = OrderedDict()
+_TEMPLATES_LOCK = threading.Lock()
+
+_META_KEYS = ("school", "title", "subtitle", "subject", "grade", "term")
+_XML_INVALID = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+def _build_template(meta: Dict[str, str]) -> Tuple[bytes, Dict[str, str]]:
+    """Dựng phần đầu đề + các style câu hỏi một lần; trả về (bytes docx, tên style -> style_id)."""
+    from docx import Document
+    from docx.enum.style import WD_STYLE_TYPE
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.shared import Pt
 
-def export_exam_docx(meta: Dict[str, str], questions: List[Dict[str, object]], include_answer_key: bool = True) -> bytes:
-    """Xuất docx: KHÔNG tạo 'thang điểm + nhận xét' (theo yêu cầu)."""
     doc = Document()
 
     title = meta.get("title","ĐỀ KIỂM TRA")
@@ -19,14 +38,16 @@ def export_exam_docx(meta: Dict[str, str], questions: List[Dict[str, object]], i
     grade = meta.get("grade","")
     term = meta.get("term","")
 
-    p = doc.add_paragraph(school)
+    # add_run luôn trả về run (kể cả chữ rỗng) -> không lỗi khi chưa nhập tên trường / tiêu đề
+    p = doc.add_paragraph()
     p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    p.runs[0].font.size = Pt(12)
+    p.add_run(school).font.size = Pt(12)
 
-    p = doc.add_paragraph(title)
+    p = doc.add_paragraph()
     p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    p.runs[0].bold = True
-    p.runs[0].font.size = Pt(16)
+    r = p.add_run(title)
+    r.bold = True
+    r.font.size = Pt(16)
 
     if subtitle.strip():
         p = doc.add_paragraph(subtitle)
@@ -37,27 +58,114 @@ def export_exam_docx(meta: Dict[str, str], questions: List[Dict[str, object]], i
         p = doc.add_paragraph(info)
         p.alignment = WD_ALIGN_PARAGRAPH.CENTER
 
-    doc.add_paragraph("")
+    # style dùng chung cho khối câu hỏi -> không phải định dạng từng run khi xuất
+    styles: Dict[str, str] = {}
+    for name, bold, center in (("ExamQuestionHeader", True, False), ("ExamBody", False, False),
+                               ("ExamVariant", True, True), ("ExamKeyTitle", True, False)):
+        st = doc.styles.add_style(name, WD_STYLE_TYPE.PARAGRAPH)
+        st.base_style = doc.styles["Normal"]
+        st.font.bold = bold
+        if center:
+            st.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        styles[name] = st.style_id
+
+    bio = BytesIO()
+    doc.save(bio)
+    return bio.getvalue(), styles
+
+def _template(meta: Dict[str, str]) -> Tuple[bytes, Dict[str, str]]:
+    key = tuple(str(meta.get(k, "")) for k in _META_KEYS)
+    with _TEMPLATES_LOCK:
+        hit = _TEMPLATES.get(key)
+        if hit is not None:
+            _TEMPLATES.move_to_end(key)
+            metrics.incr("docx.template_hit")
+            return hit
+    with metrics.span("docx.template"):
+        built = _build_template(meta)
+    with _TEMPLATES_LOCK:
+        _TEMPLATES[key] = built
+        while len(_TEMPLATES) > TEMPLATE_CACHE_SIZE:
+            _TEMPLATES.popitem(last=False)
+    return built
+
+def _para(style_id: str, text: str, page_break_before: bool = False) -> str:
+    runs = []
+    if page_break_before:
+        runs.append('<w:r><w:br w:type="page"/></w:r>')
+    lines = _XML_INVALID.sub("", text).split("\n")
+    for k, line in enumerate(lines):
+        if k:
+            runs.append("<w:r><w:br/></w:r>")
+        runs.append(f'<w:r><w:t xml:space="preserve">{escape(line)}</w:t></w:r>')
+    return f'<w:p><w:pPr><w:pStyle w:val="{style_id}"/></w:pPr>{"".join(runs)}</w:p>'
+
+def _body_xml(styles: Dict[str, str], questions: Sequence[Dict[str, object]], include_answer_key: bool,
+              label: str = "", include_questions: bool = True) -> str:
+    from docx.oxml.ns import nsdecls
+
+    parts: List[str] = []
+    if label:
+        parts.append(_para(styles["ExamVariant"], f"Mã đề: {label}"))
+    parts.append(_para(styles["ExamBody"], ""))
 
     # Câu hỏi
-    for i, q in enumerate(questions, start=1):
+    for i, q in enumerate(questions if include_questions else [], start=1):
         points = q.get("points","")
         level = q.get("level","")
         content = str(q.get("content","")).strip()
         header = f"Câu {i} ({points} đ) - {level}:" if points else f"Câu {i} - {level}:"
-        doc.add_paragraph(header).runs[0].bold = True
-        doc.add_paragraph(content)
+        parts.append(_para(styles["ExamQuestionHeader"], header))
+        parts.append(_para(styles["ExamBody"], content))
 
     if include_answer_key:
-        doc.add_page_break()
-        doc.add_paragraph("ĐÁP ÁN / GỢI Ý").runs[0].bold = True
+        parts.append(_para(styles["ExamKeyTitle"], "ĐÁP ÁN / GỢI Ý", page_break_before=include_questions))
         for i, q in enumerate(questions, start=1):
             ans = str(q.get("answer","")).strip()
             if not ans:
                 # nếu nội dung có dòng "Đáp án:" thì giữ nguyên (GV tự xử lý)
                 continue
-            doc.add_paragraph(f"Câu {i}: {ans}")
+            parts.append(_para(styles["ExamBody"], f"Câu {i}: {ans}"))
+    return f'<w:body {nsdecls("w")}>{"".join(parts)}</w:body>'
 
+def _render(meta: Dict[str, str], questions: Sequence[Dict[str, object]], include_answer_key: bool,
+            label: str = "", include_questions: bool = True) -> bytes:
+    from docx import Document
+    from docx.oxml import parse_xml
+
+    template, styles = _template(meta)
+    doc = Document(BytesIO(template))
+    body = doc.element.body
+    anchor = body.sectPr  # chèn trước sectPr để giữ thiết lập trang
+    # dựng toàn bộ khối câu hỏi bằng 1 lần parse XML thay vì add_paragraph từng dòng
+    for el in list(parse_xml(_body_xml(styles, questions, include_answer_key, label, include_questions))):
+        if anchor is not None:
+            anchor.addprevious(el)
+        else:
+            body.append(el)
     bio = BytesIO()
     doc.save(bio)
     return bio.getvalue()
+
+def export_exam_docx(meta: Dict[str, str], questions: List[Dict[str, object]], include_answer_key: bool = True,
+                     include_questions: bool = True) -> bytes:
+    """Xuất docx: KHÔNG tạo 'thang điểm + nhận xét' (theo yêu cầu). `include_questions=False` -> chỉ trang đáp án."""
+    with metrics.span("docx.export", questions=len(questions)):
+        return _render(meta, questions, include_answer_key, include_questions=include_questions)
+
+def export_variants_zip(meta: Dict[str, str], variants: Sequence[Tuple[str, List[Dict[str, object]]]],
+                        answer_key: str = "include", file_prefix: str = "De") -> bytes:
+    """Xuất nhiều mã đề vào 1 file ZIP (dùng chung template).
+
+    `answer_key`: "include" (đáp án cuối mỗi đề) | "separate" (thêm file đáp án riêng) | "none".
+    """
+    bio = BytesIO()
+    with metrics.span("docx.variants_zip", variants=len(variants)), \
+            zipfile.ZipFile(bio, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for label, questions in variants:
+            name = f"{file_prefix}_{label}" if label else file_prefix
+            zf.writestr(f"{name}.docx", _render(meta, questions, answer_key == "include", label))
+            if answer_key == "separate":
+                key_meta = {**meta, "subtitle": "ĐÁP ÁN"}
+                zf.writestr(f"{name}_dap_an.docx", _render(key_meta, questions, True, label, include_questions=False))
+    return bio.getvalue()
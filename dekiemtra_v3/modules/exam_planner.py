@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Lập kế hoạch sinh đề: mỗi ô ma trận (Chủ đề × Mức × Dạng) thành một việc sinh câu hỏi riêng."""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from .ai_client import GeminiClient
+from .batch_gen import QuestionSpec, generate_batch
+from .data_loader import CurriculumDB
+from .matrix_normalizer import MatrixCell, NormalizedMatrix, normalize_matrix
+from .matrix_parser import MatrixParseResult, parse_matrix_file
+from .response_cache import ResponseCache
+from .similarity import DuplicateIndex
+from .validators import ALLOWED_LEVELS
+
+# Ma trận không ghi dạng câu -> chọn theo mức
+_DEFAULT_TYPE_BY_LEVEL = {
+    ALLOWED_LEVELS[0]: "Trắc nghiệm (4 lựa chọn)",
+    ALLOWED_LEVELS[1]: "Trắc nghiệm (4 lựa chọn)",
+    ALLOWED_LEVELS[2]: "Tự luận",
+}
+_MAX_YCCD_HINTS = 3
+
+@dataclass
+class GenerationJob:
+    cell: MatrixCell
+    specs: List[QuestionSpec]
+
+@dataclass
+class PlanResult:
+    questions: List[Dict[str, object]] = field(default_factory=list)
+    failed_jobs: List[GenerationJob] = field(default_factory=list)
+    calls: int = 0
+    messages: List[str] = field(default_factory=list)
+
+def _topic_context(db: Optional[CurriculumDB], subject: str, grade: str, topic: str) -> Tuple[str, str]:
+    """(bài, YCCĐ) gợi ý từ DB CT2018 nếu chủ đề của ma trận trùng chủ đề trong DB."""
+    if db is None:
+        return topic, ""
+    items = db.lessons(subject, grade, topic)
+    if not items:
+        return topic, ""
+    hints = items[:_MAX_YCCD_HINTS]
+    return ", ".join(it.lesson for it in hints), "; ".join(it.yccd for it in hints if it.yccd)
+
+def plan_jobs(norm: NormalizedMatrix, subject: str, grade: str,
+              db: Optional[CurriculumDB] = None) -> List[GenerationJob]:
+    """Mỗi ô có số câu > 0 thành 1 việc; điểm của ô chia đều cho các câu."""
+    jobs: List[GenerationJob] = []
+    for cell in norm.cells:
+        if cell.count <= 0:
+            continue
+        lesson, yccd = _topic_context(db, subject, grade, cell.topic)
+        q_type = cell.q_type or _DEFAULT_TYPE_BY_LEVEL.get(cell.level, "Tự luận")
+        points = round(cell.points / cell.count, 2) if cell.points else 1.0
+        spec = QuestionSpec(subject=subject, grade=grade, topic=cell.topic, lesson=lesson, yccd=yccd,
+                            q_type=q_type, level=cell.level, points=points)
+        jobs.append(GenerationJob(cell=cell, specs=[spec] * cell.count))
+    return jobs
+
+def plan_from_file(uploaded_file, subject: str, grade: str,
+                   db: Optional[CurriculumDB] = None) -> Tuple[MatrixParseResult, List[GenerationJob]]:
+    res = parse_matrix_file(uploaded_file)
+    if not res.ok or res.df is None:
+        return res, []
+    return res, plan_jobs(normalize_matrix(res.df), subject, grade, db)
+
+def run_plan(ai: GeminiClient, jobs: List[GenerationJob], seed: Optional[int] = None,
+             cache: Optional[ResponseCache] = None, concurrency: int = 4, max_retries: int = 1,
+             avoid: Sequence[DuplicateIndex] = (),
+             progress: Optional[Callable[[int, int], None]] = None) -> PlanResult:
+    """Chạy song song các việc; câu hỏi trả về theo thứ tự ma trận, việc lỗi chỉ ảnh hưởng ô của nó."""
+    specs: List[QuestionSpec] = []
+    owner: List[int] = []
+    for j, job in enumerate(jobs):
+        specs.extend(job.specs)
+        owner.extend([j] * len(job.specs))
+    batch = generate_batch(ai, specs, max_retries=max_retries, seed=seed, cache=cache,
+                           concurrency=concurrency, group_keys=owner, avoid=avoid, progress=progress)
+    # việc lỗi chỉ giữ lại các câu chưa sinh được để bấm chạy lại
+    left: Dict[int, List[QuestionSpec]] = {}
+    for i in batch.failed:
+        left.setdefault(owner[i], []).append(specs[i])
+    return PlanResult(
+        questions=[q for q in batch.questions if q is not None],
+        failed_jobs=[GenerationJob(cell=jobs[j].cell, specs=left[j]) for j in sorted(left)],
+        calls=batch.calls,
+        messages=batch.messages,
+    )
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Các việc sinh AI chạy nền qua `job_queue`: đề từ ma trận (văn bản), sinh hàng loạt, sinh theo ô ma trận.
+
+Tham số mỗi việc là dict JSON (ghi vào bảng việc) nên việc bị gián đoạn có thể chạy lại nguyên trạng.
+"""
+from __future__ import annotations
+
+import time
+from dataclasses import asdict
+from typing import Callable, Dict, List, Optional, Sequence
+
+from .ai_client import GeminiClient
+from .batch_gen import QuestionSpec, generate_batch
+from .exam_planner import GenerationJob, run_plan
+from .job_queue import JobCancelled, JobContext, JobFn
+from .matrix_normalizer import MatrixCell
+from .question_bank import default_bank
+from .response_cache import default_cache
+from .similarity import DuplicateIndex, index_questions
+
+REPORT_EVERY_S = 0.5
+EXPECTED_EXAM_CHARS = 6000  # chỉ để ước lượng thanh tiến độ khi sinh đề dạng văn bản
+
+def specs_to_payload(specs: Sequence[QuestionSpec]) -> List[Dict[str, object]]:
+    return [asdict(s) for s in specs]
+
+def specs_from_payload(items: Sequence[Dict[str, object]]) -> List[QuestionSpec]:
+    return [QuestionSpec(**it) for it in items]  # type: ignore[arg-type]
+
+def jobs_to_payload(jobs: Sequence[GenerationJob]) -> List[Dict[str, object]]:
+    return [{"cell": asdict(j.cell), "specs": specs_to_payload(j.specs)} for j in jobs]
+
+def jobs_from_payload(items: Sequence[Dict[str, object]]) -> List[GenerationJob]:
+    return [GenerationJob(cell=MatrixCell(**it["cell"]), specs=specs_from_payload(it["specs"]))  # type: ignore[arg-type]
+            for it in items]
+
+def ai_payload(seed: Optional[int], use_cache: bool, concurrency: int = 4) -> Dict[str, object]:
+    """Phần tham số AI chung của mọi việc (không chứa API key)."""
+    return {"seed": seed, "use_cache": use_cache, "concurrency": concurrency}
+
+def _ai_kwargs(payload: Dict[str, object]) -> Dict[str, object]:
+    if not payload.get("use_cache"):
+        return {}
+    return {"seed": payload.get("seed"), "cache": default_cache()}
+
+def _avoid(payload: Dict[str, object]) -> List[DuplicateIndex]:
+    texts = payload.get("avoid_texts") or []
+    return [index_questions([{"content": t} for t in texts]), default_bank().duplicate_index()]  # type: ignore[union-attr]
+
+def _progress(ctx: JobContext) -> Callable[[int, int], None]:
+    return lambda done, total: ctx.report(done / max(total, 1), f"{done}/{total} câu")
+
+def exam_text_task(ai: GeminiClient) -> JobFn:
+    """payload: prompt + ai_payload. Kết quả: {"text", "model"}; phần đã nhận được ghi dần vào kết quả tạm."""
+    def run(ctx: JobContext, payload: Dict[str, object]) -> Dict[str, object]:
+        stream = ai.generate_stream(str(payload["prompt"]), **_ai_kwargs(payload))
+        last = 0.0
+        try:
+            for _ in stream:
+                if time.monotonic() - last >= REPORT_EVERY_S:
+                    last = time.monotonic()
+                    ctx.report(min(0.95, len(stream.text) / EXPECTED_EXAM_CHARS), "Đang sinh đề...", {"text": stream.text})
+        except JobCancelled:
+            stream.cancel()
+            raise
+        stt = stream.status
+        if stt is None or not stt.ok:
+            ctx.report(message=None, partial={"text": stream.text})
+            raise RuntimeError(stt.message if stt is not None else "Không nhận được kết quả.")
+        return {"text": stt.message, "model": stt.used_model, "cached": stt.cached}
+    return run
+
+def batch_task(ai: GeminiClient) -> JobFn:
+    """payload: specs + avoid_texts + ai_payload. Kết quả: câu đã sinh + các yêu cầu còn lỗi."""
+    def run(ctx: JobContext, payload: Dict[str, object]) -> Dict[str, object]:
+        specs = specs_from_payload(payload["specs"])  # type: ignore[arg-type]
+        res = generate_batch(ai, specs, concurrency=int(payload.get("concurrency", 4)),  # type: ignore[arg-type]
+                             avoid=_avoid(payload), progress=_progress(ctx), **_ai_kwargs(payload))
+        return {
+            "questions": [q for q in res.questions if q is not None],
+            "failed_specs": specs_to_payload([specs[i] for i in res.failed]),
+            "calls": res.calls, "duplicates": res.duplicates, "messages": res.messages,
+        }
+    return run
+
+def plan_task(ai: GeminiClient) -> JobFn:
+    """payload: jobs (ô ma trận + yêu cầu) + avoid_texts + ai_payload. Kết quả: câu đã sinh + các ô còn thiếu."""
+    def run(ctx: JobContext, payload: Dict[str, object]) -> Dict[str, object]:
+        jobs = jobs_from_payload(payload["jobs"])  # type: ignore[arg-type]
+        res = run_plan(ai, jobs, concurrency=int(payload.get("concurrency", 4)),  # type: ignore[arg-type]
+                       avoid=_avoid(payload), progress=_progress(ctx), **_ai_kwargs(payload))
+        return {
+            "questions": res.questions, "failed_jobs": jobs_to_payload(res.failed_jobs),
+            "calls": res.calls, "messages": res.messages,
+        }
+    return run
+
+# kind -> hàm dựng việc từ client của phiên hiện tại (dùng khi nộp mới và khi chạy lại việc bị gián đoạn)
+TASKS: Dict[str, Callable[[GeminiClient], JobFn]] = {
+    "exam_text": exam_text_task,
+    "batch": batch_task,
+    "plan": plan_task,
+}
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""Hàng đợi việc nền (luồng + bảng SQLite): sinh AI lâu không chặn giao diện, tải lại trang vẫn nhận được kết quả.
+
+Mỗi việc thuộc về 1 `owner` (mã người dùng giữ trên URL). Trạng thái, tiến độ, phần kết quả tạm
+và kết quả cuối được ghi xuống đĩa; giao diện chỉ cần đọc lại theo chu kỳ.
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Set
+
+from . import metrics
+from .bootstrap import app_data_dir
+
+DEFAULT_WORKERS = 2
+KEEP_FINISHED_S = 7 * 24 * 3600
+ACTIVE_STATES = ("queued", "running")
+
+@dataclass
+class JobInfo:
+    id: str
+    owner: str
+    kind: str
+    title: str
+    status: str  # queued | running | done | failed | cancelled | interrupted
+    progress: float
+    message: str
+    payload: Dict[str, object]
+    result: Optional[Dict[str, object]]
+    collected: bool
+    created: float
+    updated: float
+
+    @property
+    def active(self) -> bool:
+        return self.status in ACTIVE_STATES
+
+class JobCancelled(Exception):
+    pass
+
+class JobContext:
+    """Truyền cho hàm chạy việc: báo tiến độ / kết quả tạm và kiểm tra yêu cầu huỷ."""
+
+    def __init__(self, queue: "JobQueue", job_id: str):
+        self.queue = queue
+        self.job_id = job_id
+
+    @property
+    def cancelled(self) -> bool:
+        return self.queue._is_cancelled(self.job_id)
+
+    def report(self, progress: Optional[float] = None, message: Optional[str] = None,
+               partial: Optional[Dict[str, object]] = None) -> None:
+        """Ghi tiến độ (0..1); ném JobCancelled nếu người dùng đã bấm huỷ."""
+        self.queue._update(self.job_id, progress=progress, message=message, result=partial)
+        if self.cancelled:
+            raise JobCancelled()
+
+JobFn = Callable[[JobContext, Dict[str, object]], Dict[str, object]]
+
+_COLS = "id, owner, kind, title, status, progress, message, payload, result, collected, created, updated"
+
+class JobQueue:
+    def __init__(self, path: Path, workers: int = DEFAULT_WORKERS):
+        self.path = path
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dekiemtra-job")
+        self._cancel: Set[str] = set()
+        self._lock = threading.Lock()
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                title TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress REAL NOT NULL DEFAULT 0,
+                message TEXT NOT NULL DEFAULT '',
+                payload TEXT NOT NULL,
+                result TEXT,
+                collected INTEGER NOT NULL DEFAULT 0,
+                pid INTEGER NOT NULL,
+                created REAL NOT NULL,
+                updated REAL NOT NULL)""")
+            con.execute("CREATE INDEX IF NOT EXISTS ix_jobs_owner ON jobs(owner, created)")
+            # việc của tiến trình cũ (server khởi động lại) không còn luồng nào chạy
+            con.execute(
+                "UPDATE jobs SET status='interrupted', message='Máy chủ khởi động lại khi đang chạy.', updated=? "
+                f"WHERE status IN ({', '.join('?' * len(ACTIVE_STATES))}) AND pid != ?",
+                (time.time(), *ACTIVE_STATES, os.getpid()),
+            )
+            con.execute("DELETE FROM jobs WHERE status NOT IN ('queued', 'running') AND updated < ?",
+                        (time.time() - KEEP_FINISHED_S,))
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        con = sqlite3.connect(str(self.path), timeout=10)
+        try:
+            with con:  # commit / rollback
+                yield con
+        finally:
+            con.close()
+
+    def submit(self, owner: str, kind: str, title: str, payload: Dict[str, object], fn: JobFn) -> str:
+        """Ghi việc vào bảng rồi đưa `fn(ctx, payload)` vào pool; `fn` trả về dict kết quả (JSON được)."""
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._connect() as con:
+            con.execute(
+                "INSERT INTO jobs(id, owner, kind, title, status, payload, pid, created, updated) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, owner, kind, title, json.dumps(payload, ensure_ascii=False), os.getpid(), now, now),
+            )
+        self._pool.submit(self._run, job_id, kind, payload, fn, metrics.current())
+        return job_id
+
+    def _run(self, job_id: str, kind: str, payload: Dict[str, object], fn: JobFn,
+             rec: Optional[metrics.Recorder] = None) -> None:
+        # số liệu của việc nền vẫn tính cho phiên đã nộp việc
+        with metrics.use(rec), metrics.span(f"job.{kind}") as sp:
+            self._run_job(job_id, payload, fn, sp)
+
+    def _run_job(self, job_id: str, payload: Dict[str, object], fn: JobFn, sp: Dict[str, object]) -> None:
+        if self._is_cancelled(job_id):
+            self._update(job_id, status="cancelled", message="Đã huỷ trước khi chạy.")
+            return
+        self._update(job_id, status="running")
+        ctx = JobContext(self, job_id)
+        try:
+            result = fn(ctx, payload)
+        except JobCancelled:
+            sp["cancelled"] = True
+            self._update(job_id, status="cancelled", message="Đã huỷ; giữ lại phần đã có.")
+        except Exception as e:  # lỗi của 1 việc không làm chết luồng nền
+            sp["ok"] = False
+            self._update(job_id, status="failed", message=f"Lỗi: {e}")
+        else:
+            self._update(job_id, status="done", progress=1.0, result=result)
+        finally:
+            with self._lock:
+                self._cancel.discard(job_id)
+
+    def _update(self, job_id: str, status: Optional[str] = None, progress: Optional[float] = None,
+                message: Optional[str] = None, result: Optional[Dict[str, object]] = None) -> None:
+        sets, args = ["updated = ?"], [time.time()]
+        for col, val in (("status", status), ("progress", progress), ("message", message)):
+            if val is not None:
+                sets.append(f"{col} = ?")
+                args.append(val)
+        if result is not None:
+            sets.append("result = ?")
+            args.append(json.dumps(result, ensure_ascii=False))
+        with self._connect() as con:
+            con.execute(f"UPDATE jobs SET {', '.join(sets)} WHERE id = ?", (*args, job_id))
+
+    def _is_cancelled(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._cancel
+
+    @staticmethod
+    def _info(row: tuple) -> JobInfo:
+        return JobInfo(
+            id=row[0], owner=row[1], kind=row[2], title=row[3], status=row[4], progress=float(row[5]),
+            message=row[6], payload=json.loads(row[7]), result=json.loads(row[8]) if row[8] else None,
+            collected=bool(row[9]), created=row[10], updated=row[11],
+        )
+
+    def get(self, job_id: str) -> Optional[JobInfo]:
+        with self._connect() as con:
+            row = con.execute(f"SELECT {_COLS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._info(row) if row else None
+
+    def list(self, owner: str, limit: int = 20) -> List[JobInfo]:
+        """Việc của 1 người dùng, mới nhất trước."""
+        with self._connect() as con:
+            rows = con.execute(f"SELECT {_COLS} FROM jobs WHERE owner = ? ORDER BY created DESC LIMIT ?",
+                               (owner, int(limit))).fetchall()
+        return [self._info(r) for r in rows]
+
+    def cancel(self, job_id: str) -> None:
+        with self._lock:
+            self._cancel.add(job_id)
+
+    def mark_collected(self, job_id: str) -> bool:
+        """Nhận kết quả việc (nguyên tử): True nếu lần gọi này nhận được, False nếu đã có tab/lượt chạy khác nhận trước."""
+        with self._connect() as con:
+            cur = con.execute("UPDATE jobs SET collected = 1 WHERE id = ? AND collected = 0", (job_id,))
+            return cur.rowcount == 1
+
+    def delete(self, job_id: str) -> None:
+        with self._connect() as con:
+            con.execute("DELETE FROM jobs WHERE id = ? AND status NOT IN ('queued', 'running')", (job_id,))
+
+_DEFAULT: Optional[JobQueue] = None
+_DEFAULT_LOCK = threading.Lock()
+
+def default_queue() -> JobQueue:
+    """Hàng đợi dùng chung trong tiến trình (mọi phiên Streamlit), đặt trong app_data_dir()."""
+    global _DEFAULT
+    with _DEFAULT_LOCK:
+        if _DEFAULT is None:
+            _DEFAULT = JobQueue(app_data_dir() / "jobs.sqlite3")
+        return _DEFAULT
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""Chuẩn hoá ma trận TT27 (Chủ đề × Mức × Dạng → Số câu, Điểm) thành bảng gọn cho prompt."""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from .ai_client import estimate_tokens
+from .bootstrap import lazy_import
+from .text_utils import fold_vi
+from .validators import ALLOWED_LEVELS
+
+if TYPE_CHECKING:
+    import pandas as pd
+else:
+    pd = lazy_import("pandas")  # nhập khi đọc ma trận lần đầu, không phải lúc khởi động app
+
+DEFAULT_MATRIX_TOKEN_BUDGET = 3000
+
+@dataclass
+class MatrixCell:
+    topic: str
+    level: str    # một trong ALLOWED_LEVELS
+    q_type: str   # một trong ALLOWED_TYPES, hoặc "" nếu ma trận không ghi dạng
+    count: int
+    points: float
+
+@dataclass
+class NormalizedMatrix:
+    cells: List[MatrixCell] = field(default_factory=list)
+    layout: str = "raw"         # "long" | "wide" | "raw" (không nhận ra cấu trúc)
+    raw_rows: List[str] = field(default_factory=list)  # chỉ dùng khi layout == "raw"
+
+    @property
+    def total_questions(self) -> int:
+        return sum(c.count for c in self.cells)
+
+    @property
+    def total_points(self) -> float:
+        return sum(c.points for c in self.cells)
+
+_LEVEL_WORDS = (("van dung", 3), ("hieu", 2), ("biet", 1))
+_TYPE_RULES: Tuple[Tuple[str, str], ...] = (
+    (r"\btn\b|trac nghiem|lua chon", "Trắc nghiệm (4 lựa chọn)"),
+    (r"dung ?/ ?sai|dung sai", "Đúng/Sai"),
+    (r"ghep|noi cot", "Ghép nối (Nối cột)"),
+    (r"dien|hoan thanh", "Điền khuyết (Hoàn thành câu)"),
+    (r"thuc hanh", "Thực hành trên máy tính"),
+    (r"\btl\b|tu luan", "Tự luận"),
+)
+_TOPIC_HINTS = ("chu de", "mach", "noi dung", "bai", "kien thuc")
+_TOTAL_ROW = re.compile(r"^(tong|cong|ti le|ty le|so cau|so diem)\b")
+
+def parse_level(text: str) -> Optional[str]:
+    t = fold_vi(text)
+    m = re.search(r"\bmuc\s*([123])\b|\bm([123])\b", t)
+    if m:
+        return ALLOWED_LEVELS[int(m.group(1) or m.group(2)) - 1]
+    for word, k in _LEVEL_WORDS:
+        if word in t:
+            return ALLOWED_LEVELS[k - 1]
+    return None
+
+def parse_type(text: str) -> str:
+    t = fold_vi(text)
+    for pattern, name in _TYPE_RULES:
+        if re.search(pattern, t):
+            return name
+    return ""
+
+def _number(v: object) -> Optional[float]:
+    if v is None or (isinstance(v, float) and pd.isna(v)):
+        return None
+    if isinstance(v, (int, float)):
+        return float(v)
+    m = re.search(r"\d+(?:[.,]\d+)?", str(v))
+    return float(m.group(0).replace(",", ".")) if m else None
+
+def _find_col(cols: List[str], *hints: str) -> Optional[str]:
+    # gợi ý đứng trước được ưu tiên ("so cau" trước "cau")
+    for h in hints:
+        for c in cols:
+            if h in fold_vi(c):
+                return c
+    return None
+
+def _clean(df: pd.DataFrame) -> pd.DataFrame:
+    return df.dropna(how="all").dropna(axis=1, how="all").reset_index(drop=True)
+
+def _topic_col(df: pd.DataFrame, exclude: List[str]) -> Optional[str]:
+    cols = [c for c in df.columns if c not in exclude]
+    hinted = _find_col(cols, *_TOPIC_HINTS)
+    if hinted is not None:
+        return hinted
+    for c in cols:  # cột chữ đầu tiên
+        vals = df[c].dropna()
+        if len(vals) and (vals.map(lambda v: _number(v) is None)).mean() > 0.5:
+            return c
+    return None
+
+def _topics(df: pd.DataFrame, col: str) -> pd.Series:
+    # ô gộp (merged) trong Excel chỉ có giá trị ở dòng đầu -> điền xuống
+    return df[col].ffill().map(lambda v: "" if pd.isna(v) else str(v).strip())
+
+def _aggregate(cells: List[MatrixCell]) -> List[MatrixCell]:
+    acc: Dict[Tuple[str, str, str], MatrixCell] = {}
+    for c in cells:
+        k = (c.topic, c.level, c.q_type)
+        if k in acc:
+            acc[k].count += c.count
+            acc[k].points += c.points
+        else:
+            acc[k] = MatrixCell(c.topic, c.level, c.q_type, c.count, c.points)
+    return [c for c in acc.values() if c.count > 0 or c.points > 0]
+
+def _normalize_long(df: pd.DataFrame) -> Optional[List[MatrixCell]]:
+    cols = list(df.columns)
+    # cột "Mức độ" chứa giá trị Mức 1/2/3; cột "Mức 1 ..." là dạng ngang -> không tính
+    level_col = _find_col([c for c in cols if parse_level(c) is None], "muc")
+    count_col = _find_col([c for c in cols if c != level_col], "so cau", "cau")
+    if level_col is None or count_col is None:
+        return None
+    points_col = _find_col([c for c in cols if c != count_col], "diem")
+    type_col = _find_col(cols, "dang", "hinh thuc", "loai")
+    topic_col = _topic_col(df, [level_col, count_col, points_col or "", type_col or ""])
+    if topic_col is None:
+        return None
+    topics = _topics(df, topic_col)
+    cells: List[MatrixCell] = []
+    for i, row in df.iterrows():
+        topic = topics[i]
+        level = parse_level(str(row[level_col]))
+        if not topic or level is None or _TOTAL_ROW.match(fold_vi(topic)):
+            continue
+        cells.append(MatrixCell(
+            topic=topic,
+            level=level,
+            q_type=parse_type(str(row[type_col])) if type_col else "",
+            count=int(_number(row[count_col]) or 0),
+            points=float(_number(row[points_col]) or 0.0) if points_col else 0.0,
+        ))
+    return cells or None
+
+def _normalize_wide(df: pd.DataFrame) -> Optional[List[MatrixCell]]:
+    # cột dạng "Mức 1 - TN - Số câu", "M2 TL điểm", "Biết (số câu)"...
+    spec: Dict[str, Tuple[str, str, str]] = {}
+    for c in df.columns:
+        level = parse_level(str(c))
+        if level is None:
+            continue
+        kind = "points" if "diem" in fold_vi(c) else "count"
+        spec[c] = (level, parse_type(str(c)), kind)
+    if not spec:
+        return None
+    topic_col = _topic_col(df, list(spec))
+    if topic_col is None:
+        return None
+    topics = _topics(df, topic_col)
+    cells: List[MatrixCell] = []
+    for i, row in df.iterrows():
+        topic = topics[i]
+        if not topic or _TOTAL_ROW.match(fold_vi(topic)):
+            continue
+        by_key: Dict[Tuple[str, str], MatrixCell] = {}
+        for c, (level, q_type, kind) in spec.items():
+            v = _number(row[c])
+            if v is None:
+                continue
+            cell = by_key.setdefault((level, q_type), MatrixCell(topic, level, q_type, 0, 0.0))
+            if kind == "points":
+                cell.points += v
+            else:
+                cell.count += int(v)
+        cells.extend(by_key.values())
+    return cells or None
+
+def normalize_matrix(df: pd.DataFrame) -> NormalizedMatrix:
+    """Nhận dạng ma trận dạng dọc (mỗi dòng 1 ô) hoặc dạng ngang (cột theo Mức/Dạng).
+
+    Không nhận ra thì trả layout "raw" với các dòng đã bỏ ô trống (vẫn gọn hơn CSV gốc).
+    """
+    df = _clean(df)
+    df.columns = [str(c).strip() for c in df.columns]
+    cells = _normalize_long(df)
+    if cells:
+        return NormalizedMatrix(_aggregate(cells), "long")
+    cells = _normalize_wide(df)
+    if cells:
+        return NormalizedMatrix(_aggregate(cells), "wide")
+    rows = [" | ".join(df.columns)]
+    for _, row in df.iterrows():
+        vals = [str(v).strip() for v in row.tolist() if not (v is None or (isinstance(v, float) and pd.isna(v))) and str(v).strip()]
+        if vals:
+            rows.append(" | ".join(vals))
+    return NormalizedMatrix(layout="raw", raw_rows=rows)
+
+def _fmt(x: float) -> str:
+    return f"{x:g}"
+
+def matrix_table(norm: NormalizedMatrix, token_budget: int = DEFAULT_MATRIX_TOKEN_BUDGET) -> Tuple[str, int]:
+    """Bảng chuẩn gọn để đưa vào prompt; trả về (bảng, số dòng bị lược do vượt ngân sách token)."""
+    if norm.cells:
+        lines = ["Chủ đề | Mức | Dạng | Số câu | Điểm"]
+        lines += [f"{c.topic} | {c.level.split(':')[0]} | {c.q_type or '-'} | {c.count} | {_fmt(c.points)}" for c in norm.cells]
+        lines.append(f"TỔNG | | | {norm.total_questions} | {_fmt(norm.total_points)}")
+    else:
+        lines = list(norm.raw_rows)
+    out: List[str] = []
+    used = 0
+    for ln in lines:
+        cost = estimate_tokens(ln + "\n")
+        if out and used + cost > token_budget:
+            break
+        out.append(ln)
+        used += cost
+    return "\n".join(out), len(lines) - len(out)
@@ -1,10 +1,26 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from io import BytesIO
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
 
-import pandas as pd
+from . import metrics
+from .bootstrap import lazy_import
+
+if TYPE_CHECKING:
+    import pandas as pd
+else:
+    pd = lazy_import("pandas")  # nhập khi đọc ma trận lần đầu, không phải lúc khởi động app
+
+# Số file ma trận giữ trong cache (dùng chung mọi phiên; cùng file -> cùng DataFrame)
+PARSE_CACHE_SIZE = 16
+_MAX_HEADER_ROWS = 3
+_HEADER_SCAN_ROWS = 15
 
 @dataclass
 class MatrixParseResult:
@@ -12,29 +28,217 @@ class MatrixParseResult:
     message: str
     df: Optional[pd.DataFrame] = None
     summary: Optional[Dict[str, object]] = None
+    sheets: List[str] = field(default_factory=list)
+
+_CACHE: "OrderedDict[Tuple[object, ...], MatrixParseResult]" = OrderedDict()
+_SHEETS: "OrderedDict[str, List[str]]" = OrderedDict()  # sha256 nội dung -> tên sheet
+_CACHE_LOCK = threading.Lock()
+
+def _read_source(uploaded_file: Union[str, Path, object]) -> Tuple[str, bytes]:
+    """Chấp nhận UploadedFile của Streamlit, file-like có .name, hoặc đường dẫn."""
+    if isinstance(uploaded_file, (str, Path)):
+        p = Path(uploaded_file)
+        return p.name.lower(), p.read_bytes()
+    name = str(getattr(uploaded_file, "name", "")).lower()
+    if hasattr(uploaded_file, "getvalue"):
+        return name, uploaded_file.getvalue()  # type: ignore[attr-defined]
+    data = uploaded_file.read()  # type: ignore[attr-defined]
+    if hasattr(uploaded_file, "seek"):
+        uploaded_file.seek(0)  # type: ignore[attr-defined]
+    return name, data
+
+def _has_calamine() -> bool:
+    try:
+        import python_calamine  # noqa: F401  # type: ignore
+        return True
+    except Exception:
+        return False
+
+def list_sheets(uploaded_file) -> List[str]:
+    """Tên các sheet (chỉ .xlsx); đọc nhẹ, không nạp dữ liệu.
+
+    Cache theo hash nội dung file như parse_matrix_file: Tab 1 gọi lại mỗi lần chạy lại mà không mở lại workbook.
+    """
+    try:
+        name, data = _read_source(uploaded_file)
+        if not name.endswith(".xlsx"):
+            return []
+        return _sheet_names(data, hashlib.sha256(data).hexdigest())
+    except Exception:
+        return []
+
+def _sheet_names(data: bytes, digest: str) -> List[str]:
+    """Tên sheet của file .xlsx `data` (sha256 = `digest`), cache theo hash."""
+    with _CACHE_LOCK:
+        hit = _SHEETS.get(digest)
+        if hit is not None:
+            _SHEETS.move_to_end(digest)
+            return list(hit)
+    import openpyxl
+    wb = openpyxl.load_workbook(BytesIO(data), read_only=True)
+    try:
+        sheets = list(wb.sheetnames)
+    finally:
+        wb.close()
+    with _CACHE_LOCK:
+        _SHEETS[digest] = sheets
+        while len(_SHEETS) > PARSE_CACHE_SIZE:
+            _SHEETS.popitem(last=False)
+    return list(sheets)
+
+def _read_xlsx_rows(data: bytes, sheet: Optional[str], engine: str) -> List[List[object]]:
+    if engine == "calamine" or (engine == "auto" and _has_calamine()):
+        raw = pd.read_excel(BytesIO(data), sheet_name=sheet or 0, header=None, engine="calamine")
+        return raw.where(raw.notna(), None).values.tolist()
+    # openpyxl chế độ read-only + values_only: đọc luồng, không dựng đối tượng ô/định dạng
+    import openpyxl
+    wb = openpyxl.load_workbook(BytesIO(data), read_only=True, data_only=True)
+    try:
+        ws = wb[sheet] if sheet else wb.worksheets[0]
+        return [list(r) for r in ws.iter_rows(values_only=True)]
+    finally:
+        wb.close()
 
-def parse_matrix_file(uploaded_file) -> MatrixParseResult:
+def _read_raw(name: str, data: bytes, sheet: Optional[str], engine: str) -> pd.DataFrame:
+    if name.endswith(".xlsx"):
+        rows = _read_xlsx_rows(data, sheet, engine)
+        width = max((len(r) for r in rows), default=0)
+        return pd.DataFrame([r + [None] * (width - len(r)) for r in rows])
+    if name.endswith(".xls"):
+        return pd.read_excel(BytesIO(data), sheet_name=sheet or 0, header=None)
+    return pd.read_csv(BytesIO(data), header=None, dtype=object)
+
+def _is_empty(v: object) -> bool:
+    return v is None or (isinstance(v, float) and pd.isna(v)) or (isinstance(v, str) and not v.strip())
+
+def _is_number(v: object) -> bool:
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return True
+    try:
+        float(str(v).replace(",", "."))
+        return True
+    except ValueError:
+        return False
+
+def _text_row(row: List[object]) -> bool:
+    vals = [v for v in row if not _is_empty(v)]
+    return len(vals) >= 2 and sum(not _is_number(v) for v in vals) >= 0.6 * len(vals)
+
+def detect_header_rows(raw: pd.DataFrame) -> Tuple[int, int]:
+    """Tìm (dòng bắt đầu tiêu đề, số dòng tiêu đề) — ma trận TT27 thường có 2-3 dòng tiêu đề gộp ô.
+
+    Dòng tiêu đề phụ nhận ra khi nó vẫn là dòng chữ và ô đầu trống (do gộp dọc với dòng trên).
+    """
+    rows = raw.head(_HEADER_SCAN_ROWS).values.tolist()
+    start = next((i for i, r in enumerate(rows) if _text_row(r)), 0)
+    n = 1
+    while start + n < len(rows) and n < _MAX_HEADER_ROWS:
+        nxt = rows[start + n]
+        if not (_text_row(nxt) and _is_empty(nxt[0])):
+            break
+        n += 1
+    return start, n
+
+def _header_names(header: List[List[object]]) -> List[str]:
+    width = len(header[0]) if header else 0
+    filled: List[List[str]] = []
+    for r, row in enumerate(header):
+        vals = ["" if _is_empty(v) else str(v).strip() for v in row]
+        if r < len(header) - 1:
+            # ô gộp ngang ở dòng trên chỉ có giá trị ở ô đầu -> điền sang phải
+            for c in range(1, width):
+                if not vals[c]:
+                    vals[c] = vals[c - 1]
+        filled.append(vals)
+    names: List[str] = []
+    seen: Dict[str, int] = {}
+    for c in range(width):
+        parts: List[str] = []
+        for r in range(len(filled)):
+            v = filled[r][c]
+            if v and v not in parts:
+                parts.append(v)
+        name = " ".join(parts) or f"Cột {c + 1}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name} ({seen[name]})"
+        else:
+            seen[name] = 1
+        names.append(name)
+    return names
+
+def downcast_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Cột số -> kiểu số nhỏ nhất; cột chữ lặp nhiều -> category (giảm bộ nhớ mỗi phiên)."""
+    out = {}
+    for c in df.columns:
+        s = df[c]
+        nonnull = s.dropna()
+        textual = pd.api.types.is_object_dtype(s) or pd.api.types.is_string_dtype(s)
+        if textual and len(nonnull) and nonnull.map(_is_number).all():
+            s = pd.to_numeric(s.map(lambda v: v if _is_empty(v) else str(v).replace(",", ".")), errors="coerce")
+        if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+            if len(s.dropna()) and (s.dropna() % 1 == 0).all():
+                s = pd.to_numeric(s, downcast="integer") if not s.isna().any() else s.astype("Int32")
+            else:
+                s = pd.to_numeric(s, downcast="float")
+        elif textual and len(nonnull) and nonnull.nunique() <= 0.5 * len(s):
+            s = s.astype("category")
+        out[c] = s
+    return pd.DataFrame(out)
+
+def _parse(name: str, data: bytes, digest: str, sheet: Optional[str], header_row: Optional[int],
+           engine: str) -> MatrixParseResult:
+    raw = _read_raw(name, data, sheet, engine)
+    if header_row is None:
+        start, n_header = detect_header_rows(raw)
+    else:
+        start, n_header = header_row, 1
+    names = _header_names(raw.iloc[start:start + n_header].values.tolist())
+    df = raw.iloc[start + n_header:].reset_index(drop=True)
+    df.columns = names
+    df = df.dropna(how="all").reset_index(drop=True)
+    df = downcast_frame(df)
+    # summary nhẹ
+    summary = {
+        "rows": int(df.shape[0]),
+        "cols": int(df.shape[1]),
+        "columns": df.columns.tolist(),
+        "header_rows": n_header,
+        "memory_bytes": int(df.memory_usage(deep=True).sum()),
+    }
+    return MatrixParseResult(True, "Đã đọc ma trận.", df=df, summary=summary,
+                             sheets=_sheet_names(data, digest) if name.endswith(".xlsx") else [])
+
+def parse_matrix_file(uploaded_file, sheet: Optional[str] = None, header_row: Optional[int] = None,
+                      engine: str = "auto") -> MatrixParseResult:
     """Đọc ma trận từ Excel; trả về DF + summary.
     Chú ý: Tab1 chỉ cần 'có thể xem đẹp' + kiểm tra nhanh.
+
+    Kết quả được cache theo hash nội dung file (+ sheet/header/engine): tải lại cùng file là tức thì.
+    DataFrame trong kết quả được dùng chung -> chỉ đọc, đừng sửa tại chỗ.
+    `header_row=None` -> tự dò (kể cả tiêu đề nhiều dòng); `engine`: "auto" | "calamine" | "openpyxl".
     """
     try:
         if uploaded_file is None:
             return MatrixParseResult(False, "Chưa tải file ma trận.")
-        name = uploaded_file.name.lower()
-        if name.endswith(".xlsx") or name.endswith(".xls"):
-            df = pd.read_excel(uploaded_file)
-        elif name.endswith(".csv"):
-            df = pd.read_csv(uploaded_file)
-        else:
+        name, data = _read_source(uploaded_file)
+        if not (name.endswith(".xlsx") or name.endswith(".xls") or name.endswith(".csv")):
             return MatrixParseResult(False, "Hiện Tab 1 hỗ trợ .xlsx/.xls/.csv. Nếu bạn dùng Word, hãy chuyển bảng sang Excel.")
-        # chuẩn hóa cột
-        df.columns = [str(c).strip() for c in df.columns]
-        # summary nhẹ
-        summary = {
-            "rows": int(df.shape[0]),
-            "cols": int(df.shape[1]),
-            "columns": df.columns.tolist(),
-        }
-        return MatrixParseResult(True, "Đã đọc ma trận.", df=df, summary=summary)
+        digest = hashlib.sha256(data).hexdigest()
+        key = (digest, Path(name).suffix, sheet, header_row, engine)
+        with _CACHE_LOCK:
+            hit = _CACHE.get(key)
+            if hit is not None:
+                _CACHE.move_to_end(key)
+                metrics.incr("matrix.cache_hit")
+                return hit
+        with metrics.span("matrix.parse", bytes=len(data), format=Path(name).suffix.lstrip(".")) as sp:
+            res = _parse(name, data, digest, sheet, header_row, engine)
+            sp["rows"] = res.summary["rows"] if res.summary else 0
+        with _CACHE_LOCK:
+            _CACHE[key] = res
+            while len(_CACHE) > PARSE_CACHE_SIZE:
+                _CACHE.popitem(last=False)
+        return res
     except Exception as e:
         return MatrixParseResult(False, f"Lỗi đọc ma trận: {e}")
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""Đo thời gian (span) và bộ đếm nhẹ cho các bước nóng: gọi AI, nạp DB, đọc ma trận, xuất DOCX, các tab.
+
+Mỗi span/bộ đếm ghi vào bộ ghi chung của tiến trình và vào bộ ghi "hiện tại" (của phiên người dùng,
+đặt bằng `use(recorder)`). Luồng con không tự kế thừa bộ ghi hiện tại: nơi tạo luồng lấy `current()`
+rồi `use(...)` lại trong luồng con.
+
+Đặt `DEKIEMTRA_METRICS_FILE=<đường dẫn>` để ghi mọi span (JSON lines) ra file khi chạy thật.
+"""
+from __future__ import annotations
+
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Deque, Dict, Iterator, List, Optional, TypeVar
+
+MAX_SPANS = 500          # span gần nhất giữ lại để xem/xuất
+MAX_SAMPLES = 200        # số lần đo gần nhất mỗi tên, để tính p50/p95
+
+F = TypeVar("F", bound=Callable[..., object])
+
+class _Stat:
+    __slots__ = ("count", "errors", "total_ms", "max_ms", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples: Deque[float] = deque(maxlen=MAX_SAMPLES)
+
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(q * len(s)))]
+
+class Recorder:
+    """Bộ ghi an toàn đa luồng: tổng hợp theo tên span + danh sách span gần nhất + bộ đếm."""
+
+    def __init__(self, max_spans: int = MAX_SPANS):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _Stat] = {}
+        self._counters: Dict[str, float] = {}
+        self._spans: Deque[Dict[str, object]] = deque(maxlen=max_spans)
+        self.started = time.time()
+
+    def add_span(self, rec: Dict[str, object]) -> None:
+        ms = float(rec["ms"])  # type: ignore[arg-type]
+        with self._lock:
+            st = self._stats.get(str(rec["name"]))
+            if st is None:
+                st = self._stats[str(rec["name"])] = _Stat()
+            st.count += 1
+            st.errors += 0 if rec.get("ok", True) else 1
+            st.total_ms += ms
+            st.max_ms = max(st.max_ms, ms)
+            st.samples.append(ms)
+            self._spans.append(rec)
+
+    def incr(self, name: str, n: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def summary(self) -> List[Dict[str, object]]:
+        """Mỗi tên span 1 dòng, tổng thời gian lớn nhất trước."""
+        with self._lock:
+            items = [(name, st.count, st.errors, st.total_ms, st.max_ms, list(st.samples)) for name, st in self._stats.items()]
+        rows = [{
+            "name": name, "count": count, "errors": errors, "total_ms": round(total, 1),
+            "avg_ms": round(total / count, 1) if count else 0.0,
+            "p50_ms": round(_pct(samples, 0.5), 1), "p95_ms": round(_pct(samples, 0.95), 1), "max_ms": round(mx, 1),
+        } for name, count, errors, total, mx, samples in items]
+        return sorted(rows, key=lambda r: -float(r["total_ms"]))  # type: ignore[arg-type]
+
+    def counters(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(sorted(self._counters.items()))
+
+    def recent(self, n: int = 50) -> List[Dict[str, object]]:
+        with self._lock:
+            return list(self._spans)[-n:][::-1]
+
+    def to_jsonl(self) -> str:
+        """Các span gần nhất + 1 dòng bộ đếm, mỗi dòng 1 JSON."""
+        lines = [json.dumps({"type": "span", **r}, ensure_ascii=False) for r in self.recent(MAX_SPANS)[::-1]]
+        lines.append(json.dumps({"type": "counters", "ts": round(time.time(), 3), **self.counters()}, ensure_ascii=False))
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+            self._counters.clear()
+            self._spans.clear()
+            self.started = time.time()
+
+PROCESS = Recorder(max_spans=2000)
+_current: ContextVar[Optional[Recorder]] = ContextVar("dekiemtra_metrics", default=None)
+_parent: ContextVar[Optional[str]] = ContextVar("dekiemtra_span", default=None)
+_file_lock = threading.Lock()
+
+def current() -> Optional[Recorder]:
+    return _current.get()
+
+@contextmanager
+def use(rec: Optional[Recorder]) -> Iterator[None]:
+    """Đặt bộ ghi của phiên cho luồng/ngữ cảnh hiện tại (None -> chỉ ghi vào PROCESS)."""
+    token = _current.set(rec)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+def _targets() -> List[Recorder]:
+    rec = _current.get()
+    return [PROCESS] if rec is None or rec is PROCESS else [PROCESS, rec]
+
+def _write_file(rec: Dict[str, object]) -> None:
+    path = os.getenv("DEKIEMTRA_METRICS_FILE")
+    if not path:
+        return
+    try:
+        with _file_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"type": "span", **rec}, ensure_ascii=False) + "\n")
+    except OSError:
+        pass  # ghi số liệu không được làm hỏng thao tác chính
+
+def record(name: str, ms: float, ok: bool = True, **attrs: object) -> None:
+    """Ghi 1 span đã tự đo (vd. trong generator, nơi không bọc được bằng `span`)."""
+    rec: Dict[str, object] = {"name": name, "ms": round(ms, 2), "ts": round(time.time(), 3), "ok": ok}
+    parent = _parent.get()
+    if parent:
+        rec["parent"] = parent
+    rec.update(attrs)
+    for r in _targets():
+        r.add_span(rec)
+    _write_file(rec)
+
+@contextmanager
+def span(name: str, **attrs: object) -> Iterator[Dict[str, object]]:
+    """Đo thời gian khối lệnh; thêm thuộc tính trong khối qua dict trả về (vd. `s["model"] = m`)."""
+    info: Dict[str, object] = dict(attrs)
+    token = _parent.set(name)
+    ok = True
+    t0 = time.perf_counter()
+    try:
+        yield info
+    except Exception:  # rerun/stop của Streamlit là BaseException -> không tính là lỗi
+        ok = False
+        raise
+    finally:
+        _parent.reset(token)
+        ok = ok and info.pop("ok", True) is not False
+        record(name, (time.perf_counter() - t0) * 1000, ok, **info)
+
+def timed(name: str) -> Callable[[F], F]:
+    """Decorator: cả hàm là 1 span."""
+    def deco(fn: F) -> F:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper  # type: ignore[return-value]
+    return deco
+
+def incr(name: str, n: float = 1) -> None:
+    for r in _targets():
+        r.incr(name, n)
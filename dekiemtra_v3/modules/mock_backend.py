@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""Backend giả lập google.generativeai để chạy app/benchmark không cần mạng và API key.
+
+Nhận dạng 3 loại prompt của app (1 câu, lô câu JSON, đề từ ma trận) và trả về văn bản đúng định dạng
+mà app đọc được. Độ trễ, tốc độ sinh và tỉ lệ lỗi 429/503 chỉnh được để đo hiệu năng và thử đường lỗi.
+Dùng trong app: đặt `DEKIEMTRA_AI_BACKEND=mock` (tuỳ chọn `DEKIEMTRA_MOCK_LATENCY_S`, `DEKIEMTRA_MOCK_ERROR_RATE`).
+"""
+from __future__ import annotations
+
+import json
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .ai_client import DEFAULT_MODELS
+
+_WORDS = (
+    "bông hoa", "con mèo", "quả cam", "dòng sông", "ngôi trường", "cánh đồng", "chiếc lá", "bạn Lan",
+    "bạn Nam", "cô giáo", "mùa xuân", "cây bàng", "bầu trời", "quyển vở", "chú chim", "ông mặt trời",
+    "khu vườn", "con đường", "chiếc thuyền", "ngọn núi", "bà nội", "lớp học", "sân chơi", "cơn mưa",
+)
+_VERBS = ("có", "mua", "thấy", "đếm được", "trồng", "mang đến", "chia đều", "xếp thành")
+
+_SINGLE = re.compile(r"Dạng:\s*(.+?);\s*Mức:\s*(.+?);\s*Điểm:\s*([\d.,]+)")
+_TOPIC = re.compile(r"Chủ đề:\s*(.+)")
+_SEED = re.compile(r"\[seed:(\d+)\]\s*$")
+
+class ResourceExhausted(Exception):
+    """Giống lỗi 429 của google.api_core (client nhận theo tên lớp/code)."""
+    code = 429
+
+class ServiceUnavailable(Exception):
+    code = 503
+
+@dataclass
+class MockStats:
+    calls: int = 0
+    errors: int = 0
+    output_chars: int = 0
+    calls_by_key: Dict[str, int] = field(default_factory=dict)  # API key của client đã phục vụ mỗi lần gọi
+
+@dataclass(frozen=True)
+class MockClient:
+    """Thay cho client của 1 API key (GenerativeServiceClient / ModelServiceClient)."""
+    api_key: str = ""
+
+class _Response:
+    def __init__(self, text: str):
+        self.text = text
+
+class MockModel:
+    def __init__(self, backend: "MockGenAI", name: str):
+        self.backend = backend
+        self.model_name = name
+        self._client: Optional[MockClient] = None
+
+    def generate_content(self, prompt: str, generation_config: Optional[Dict[str, object]] = None,
+                         request_options: Optional[Dict[str, object]] = None, stream: bool = False):
+        b = self.backend
+        if self._client is None:
+            self._client = b.default_client  # như google.generativeai: chưa gắn client thì lấy client mặc định 1 lần
+        with b._lock:
+            b.stats.calls_by_key[self._client.api_key] = b.stats.calls_by_key.get(self._client.api_key, 0) + 1
+        rng = b._rng_for(prompt, self.model_name)
+        b._fail_maybe(rng, self.model_name)
+        text = b.respond(prompt, rng)
+        if stream:
+            return self._stream(text, rng)
+        time.sleep(b._delay(rng, len(text)))
+        return _Response(text)
+
+    def _stream(self, text: str, rng: random.Random) -> Iterator[_Response]:
+        b = self.backend
+        time.sleep(b._delay(rng, 0))  # thời gian tới đoạn đầu tiên
+        step = max(1, b.chunk_chars)
+        for k in range(0, len(text), step):
+            piece = text[k:k + step]
+            time.sleep(len(piece) / b.chars_per_s if b.chars_per_s > 0 else 0.0)
+            yield _Response(piece)
+
+class MockGenAI:
+    """Thay cho module google.generativeai (configure / list_models / GenerativeModel)."""
+
+    offline = True
+
+    def __init__(self, latency_s: float = 0.2, jitter_s: float = 0.1, chars_per_s: float = 2000.0,
+                 error_rate: float = 0.0, quota_rate: float = 0.0, malformed_rate: float = 0.0,
+                 chunk_chars: int = 80, models: Optional[Sequence[str]] = None,
+                 failing_models: Sequence[str] = (), seed: int = 0):
+        """`error_rate` -> 503, `quota_rate` -> 429 (theo từng lần gọi); `malformed_rate` -> lô câu trả về JSON hỏng.
+
+        `failing_models`: các model luôn lỗi 503 (để thử circuit breaker / chuyển model).
+        Cùng prompt (kể cả [seed:N]) + cùng `seed` -> cùng nội dung, như gọi lại có cache.
+        """
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.chars_per_s = chars_per_s
+        self.error_rate = error_rate
+        self.quota_rate = quota_rate
+        self.malformed_rate = malformed_rate
+        self.chunk_chars = chunk_chars
+        self.models = list(models or DEFAULT_MODELS)
+        self.failing_models = set(failing_models)
+        self.seed = seed
+        self.stats = MockStats()
+        self._lock = threading.Lock()
+        self._calls_rng = random.Random(seed)  # lỗi ngẫu nhiên theo lần gọi, không theo prompt
+        self.default_client = MockClient()
+
+    @classmethod
+    def from_env(cls) -> "MockGenAI":
+        return cls(latency_s=float(os.getenv("DEKIEMTRA_MOCK_LATENCY_S", "0.5")),
+                   error_rate=float(os.getenv("DEKIEMTRA_MOCK_ERROR_RATE", "0")))
+
+    # --- giao diện giống google.generativeai ---
+    def configure(self, api_key: str = "", **_kwargs) -> None:
+        self.default_client = MockClient(api_key)
+
+    def key_clients(self, api_key: str) -> Tuple[MockClient, MockClient]:
+        client = MockClient(api_key)
+        return client, client
+
+    def list_models(self, client: Optional[MockClient] = None) -> List[object]:
+        return [SimpleNamespace(name=f"models/{m}", supported_generation_methods=["generateContent"]) for m in self.models]
+
+    def GenerativeModel(self, model_name: str, **_kwargs) -> MockModel:
+        return MockModel(self, model_name)
+
+    # --- giả lập ---
+    def _rng_for(self, prompt: str, model: str) -> random.Random:
+        return random.Random(zlib.crc32(f"{self.seed}|{model}|{prompt}".encode("utf-8")))
+
+    def _delay(self, rng: random.Random, n_chars: int) -> float:
+        gen = n_chars / self.chars_per_s if self.chars_per_s > 0 else 0.0
+        return max(0.0, self.latency_s + rng.uniform(0, self.jitter_s) + gen)
+
+    def _fail_maybe(self, rng: random.Random, model: str) -> None:
+        with self._lock:
+            self.stats.calls += 1
+            roll = self._calls_rng.random()
+            fail: Optional[Exception] = None
+            if model in self.failing_models or roll < self.error_rate:
+                fail = ServiceUnavailable(f"503 mock: {model} tạm thời không phản hồi")
+            elif roll < self.error_rate + self.quota_rate:
+                fail = ResourceExhausted(f"429 mock: hết quota {model}")
+            if fail is not None:
+                self.stats.errors += 1
+        if fail is not None:
+            time.sleep(min(self.latency_s, 0.05))
+            raise fail
+
+    def respond(self, prompt: str, rng: random.Random) -> str:
+        body = _SEED.sub("", prompt).rstrip()
+        if "YÊU CẦU:\n[" in body:
+            text = self._batch(body, rng)
+        elif "MA TRẬN:" in body:
+            text = self._exam(body, rng)
+        else:
+            m = _SINGLE.search(body)
+            if m:
+                topic = _TOPIC.search(body)
+                content, answer = _question(m.group(1), topic.group(1).strip() if topic else "", rng)
+                text = f"{content}\nĐáp án: {answer}"
+            else:
+                text = "Đã nhận yêu cầu. " + _sentence(rng)
+        with self._lock:
+            self.stats.output_chars += len(text)
+        return text
+
+    def _batch(self, body: str, rng: random.Random) -> str:
+        raw = body[body.index("YÊU CẦU:\n[") + len("YÊU CẦU:\n"):]
+        try:
+            items = json.loads(raw[:raw.rindex("]") + 1])
+        except ValueError:
+            items = []
+        out = []
+        for it in items:
+            content, answer = _question(str(it.get("dang", "")), str(it.get("chu_de", "")), rng)
+            out.append({"id": it.get("id"), "content": content, "answer": answer})
+        text = "```json\n" + json.dumps(out, ensure_ascii=False, indent=1) + "\n```"
+        if rng.random() < self.malformed_rate:
+            text = text[: len(text) // 2]  # bị cắt giữa chừng như khi hết max_output_tokens
+        return text
+
+    def _exam(self, body: str, rng: random.Random) -> str:
+        table = body[body.index("MA TRẬN:") + len("MA TRẬN:"):].strip().splitlines()
+        n = max(4, min(20, len(table)))
+        blocks = []
+        for k in range(1, n + 1):
+            level = rng.choice(("Mức 1", "Mức 2", "Mức 3"))
+            q_type = "Trắc nghiệm" if level != "Mức 3" else "Tự luận"
+            content, answer = _question(q_type, "", rng)
+            blocks.append(f"Câu {k} (0.5 đ) - {level}: {content}\nĐáp án: {answer}")
+        return "\n\n".join(blocks)
+
+def _sentence(rng: random.Random, n: int = 3) -> str:
+    parts = [f"{rng.choice(_WORDS)} {rng.choice(_VERBS)} {rng.randint(2, 99)} {rng.choice(_WORDS)}" for _ in range(n)]
+    text = ", ".join(parts)
+    return text[:1].upper() + text[1:]
+
+def _question(q_type: str, topic: str, rng: random.Random) -> Tuple[str, str]:
+    """(nội dung, đáp án) đúng định dạng của dạng câu."""
+    head = f"[{topic}] " if topic else ""
+    if q_type.startswith("Trắc nghiệm"):
+        base = rng.randint(10, 90)
+        opts = rng.sample(range(base - 5, base + 6), 4)
+        lines = [f"{head}{_sentence(rng)}. Hỏi kết quả là bao nhiêu?"]
+        lines += [f"{lab}. {v}" for lab, v in zip("ABCD", opts)]
+        return "\n".join(lines), rng.choice("ABCD")
+    if q_type.startswith("Đúng/Sai"):
+        labels = "abcd"
+        lines = [f"{head}Đọc đoạn sau: {_sentence(rng)}. Ghi Đ (đúng) hoặc S (sai):"]
+        lines += [f"{lab}) {_sentence(rng, 1)}." for lab in labels]
+        return "\n".join(lines), ", ".join(f"{lab}-{rng.choice('ĐS')}" for lab in labels)
+    if q_type.startswith("Ghép nối"):
+        right = list("abc")
+        rng.shuffle(right)
+        lines = [f"{head}Nối mỗi ý ở cột A với ý phù hợp ở cột B.", "Cột A"]
+        lines += [f"{k}. {_sentence(rng, 1)}" for k in (1, 2, 3)]
+        lines += ["Cột B"] + [f"{lab}. {_sentence(rng, 1)}" for lab in "abc"]
+        return "\n".join(lines), ", ".join(f"{k}-{lab}" for k, lab in zip((1, 2, 3), right))
+    if q_type.startswith("Điền khuyết"):
+        word = rng.choice(_WORDS)
+        return f"{head}{_sentence(rng, 2)}, còn ........ thì {rng.choice(_VERBS)} {rng.randint(2, 99)}.", word
+    return f"{head}{_sentence(rng)}. Em hãy trình bày cách làm.", f"Gợi ý: {_sentence(rng, 1)}."
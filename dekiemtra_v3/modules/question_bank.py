@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Ngân hàng câu hỏi cục bộ (SQLite): lưu câu đã duyệt để dùng lại thay vì sinh lại bằng AI."""
+from __future__ import annotations
+
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .bootstrap import app_data_dir
+from .similarity import SHINGLE_VERSION, DuplicateIndex, sig_from_bytes, sig_to_bytes, signature
+
+QUESTION_FIELDS = ("subject", "grade", "topic", "lesson", "yccd", "type", "level", "points", "content", "answer")
+
+@dataclass
+class BankHit:
+    id: int
+    question: Dict[str, object]
+    used_count: int = 0
+
+def content_hash(q: Dict[str, object]) -> str:
+    text = re.sub(r"\s+", " ", str(q.get("content", ""))).strip().lower()
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _fts_query(text: str) -> str:
+    # mỗi từ thành 1 cụm "..."* (AND), tránh lỗi cú pháp MATCH khi GV gõ dấu câu
+    words = re.findall(r"\w+", text, flags=re.U)
+    return " ".join(f'"{w}"*' for w in words)
+
+class QuestionBank:
+    """Lưu đúng schema câu hỏi của app; chỉ mục theo Môn/Lớp/Chủ đề/Mức và tìm toàn văn (FTS5) trên nội dung."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("""CREATE TABLE IF NOT EXISTS questions (
+                id INTEGER PRIMARY KEY,
+                subject TEXT, grade TEXT, topic TEXT, lesson TEXT, yccd TEXT,
+                type TEXT, level TEXT, points REAL, content TEXT NOT NULL, answer TEXT,
+                content_hash TEXT NOT NULL UNIQUE,
+                created REAL NOT NULL,
+                used_count INTEGER NOT NULL DEFAULT 0,
+                minhash BLOB)""")
+            if "minhash" not in {r[1] for r in con.execute("PRAGMA table_info(questions)")}:
+                con.execute("ALTER TABLE questions ADD COLUMN minhash BLOB")  # ngân hàng tạo trước khi có chống trùng
+            if con.execute("PRAGMA user_version").fetchone()[0] < SHINGLE_VERSION:
+                # chữ ký cũ tính theo cách tách khác -> bỏ, duplicate_index sẽ tính lại
+                con.execute("UPDATE questions SET minhash = NULL")
+                con.execute(f"PRAGMA user_version = {SHINGLE_VERSION}")
+            con.execute("CREATE INDEX IF NOT EXISTS ix_q_sgtl ON questions(subject, grade, topic, level)")
+            con.execute("CREATE INDEX IF NOT EXISTS ix_q_type ON questions(type)")
+            self.fts = self._init_fts(con)
+        self._dup: Optional[DuplicateIndex] = None
+
+    @staticmethod
+    def _init_fts(con: sqlite3.Connection) -> bool:
+        """Bảng FTS5 (bỏ dấu khi so khớp) đồng bộ bằng trigger; SQLite không có FTS5 thì dùng LIKE."""
+        try:
+            con.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(
+                content, answer, lesson, content='questions', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2')""")
+        except sqlite3.OperationalError:
+            return False
+        con.executescript("""
+            CREATE TRIGGER IF NOT EXISTS questions_ai AFTER INSERT ON questions BEGIN
+                INSERT INTO questions_fts(rowid, content, answer, lesson) VALUES (new.id, new.content, new.answer, new.lesson);
+            END;
+            CREATE TRIGGER IF NOT EXISTS questions_ad AFTER DELETE ON questions BEGIN
+                INSERT INTO questions_fts(questions_fts, rowid, content, answer, lesson) VALUES ('delete', old.id, old.content, old.answer, old.lesson);
+            END;
+            CREATE TRIGGER IF NOT EXISTS questions_au AFTER UPDATE OF content, answer, lesson ON questions BEGIN
+                INSERT INTO questions_fts(questions_fts, rowid, content, answer, lesson) VALUES ('delete', old.id, old.content, old.answer, old.lesson);
+                INSERT INTO questions_fts(rowid, content, answer, lesson) VALUES (new.id, new.content, new.answer, new.lesson);
+            END;""")
+        return True
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        con = sqlite3.connect(str(self.path), timeout=10)
+        try:
+            with con:  # commit / rollback
+                yield con
+        finally:
+            con.close()
+
+    def add_many(self, questions: Iterable[Dict[str, object]]) -> int:
+        """Thêm câu hỏi; câu trùng nội dung (đã có trong ngân hàng) bị bỏ qua. Trả về số câu mới."""
+        rows: List[Tuple[object, ...]] = []
+        now = time.time()
+        for q in questions:
+            if not str(q.get("content", "")).strip():
+                continue
+            vals = [q.get(f, "") for f in QUESTION_FIELDS]
+            vals[QUESTION_FIELDS.index("points")] = float(q.get("points", 0) or 0)
+            sig = signature(str(q.get("content", "")))
+            rows.append((*vals, content_hash(q), now, sig_to_bytes(sig) if sig else None))
+        if not rows:
+            return 0
+        with self._lock, self._connect() as con:
+            before, last_id = con.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM questions").fetchone()
+            con.executemany(
+                f"INSERT OR IGNORE INTO questions({', '.join(QUESTION_FIELDS)}, content_hash, created, minhash) "
+                f"VALUES ({', '.join('?' * (len(QUESTION_FIELDS) + 3))})",
+                rows,
+            )
+            if self._dup is not None:
+                for qid, blob in con.execute("SELECT id, minhash FROM questions WHERE id > ?", (last_id,)):
+                    if blob:
+                        self._dup.add(qid, sig=sig_from_bytes(blob))
+            return int(con.execute("SELECT COUNT(*) FROM questions").fetchone()[0] - before)
+
+    def duplicate_index(self) -> DuplicateIndex:
+        """Chỉ mục gần trùng (khoá = id câu) của cả ngân hàng; dựng 1 lần từ chữ ký đã lưu, sau đó cập nhật dần."""
+        with self._lock:
+            if self._dup is not None:
+                return self._dup
+            idx = DuplicateIndex()
+            missing: List[Tuple[bytes, int]] = []
+            with self._connect() as con:
+                for qid, content, blob in con.execute("SELECT id, content, minhash FROM questions"):
+                    sig = sig_from_bytes(blob) if blob else None
+                    if sig is None:
+                        sig = signature(content)
+                        if sig is not None:
+                            missing.append((sig_to_bytes(sig), qid))
+                    if sig is not None:
+                        idx.add(qid, sig=sig)
+                if missing:
+                    con.executemany("UPDATE questions SET minhash = ? WHERE id = ?", missing)
+            self._dup = idx
+            return idx
+
+    def get(self, qid: int) -> Optional[Dict[str, object]]:
+        with self._connect() as con:
+            row = con.execute(f"SELECT {', '.join(QUESTION_FIELDS)} FROM questions WHERE id = ?", (int(qid),)).fetchone()
+        return dict(zip(QUESTION_FIELDS, row)) if row else None
+
+    def search(self, subject: Optional[str] = None, grade: Optional[str] = None, topic: Optional[str] = None,
+               level: Optional[str] = None, q_type: Optional[str] = None, text: str = "",
+               limit: int = 50) -> List[BankHit]:
+        where: List[str] = []
+        args: List[object] = []
+        for col, val in (("subject", subject), ("grade", grade), ("topic", topic), ("level", level), ("type", q_type)):
+            if val:
+                where.append(f"q.{col} = ?")
+                args.append(val)
+        join = ""
+        if text.strip():
+            if self.fts and _fts_query(text):
+                join = "JOIN questions_fts f ON f.rowid = q.id"
+                where.append("questions_fts MATCH ?")
+                args.append(_fts_query(text))
+            else:
+                where.append("q.content LIKE ?")
+                args.append(f"%{text.strip()}%")
+        sql = (f"SELECT q.id, q.used_count, {', '.join('q.' + f for f in QUESTION_FIELDS)} FROM questions q {join} "
+               f"{'WHERE ' + ' AND '.join(where) if where else ''} ORDER BY q.used_count ASC, q.id DESC LIMIT ?")
+        args.append(int(limit))
+        with self._connect() as con:
+            rows = con.execute(sql, args).fetchall()
+        return [BankHit(id=r[0], used_count=r[1], question=dict(zip(QUESTION_FIELDS, r[2:]))) for r in rows]
+
+    def mark_used(self, ids: Iterable[int]) -> None:
+        with self._lock, self._connect() as con:
+            con.executemany("UPDATE questions SET used_count = used_count + 1 WHERE id = ?", [(int(i),) for i in ids])
+
+    def delete(self, qid: int) -> None:
+        with self._lock, self._connect() as con:
+            con.execute("DELETE FROM questions WHERE id = ?", (int(qid),))
+            if self._dup is not None:
+                self._dup.remove(int(qid))
+
+    def count(self) -> int:
+        with self._connect() as con:
+            return int(con.execute("SELECT COUNT(*) FROM questions").fetchone()[0])
+
+_DEFAULT: Optional[QuestionBank] = None
+_DEFAULT_LOCK = threading.Lock()
+
+def default_bank() -> QuestionBank:
+    """Ngân hàng dùng chung trong tiến trình, đặt trong app_data_dir()."""
+    global _DEFAULT
+    with _DEFAULT_LOCK:
+        if _DEFAULT is None:
+            _DEFAULT = QuestionBank(app_data_dir() / "question_bank.sqlite3")
+        return _DEFAULT
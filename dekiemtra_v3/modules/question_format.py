@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""Tách cấu trúc câu hỏi theo dạng (lựa chọn, mệnh đề, cột nối, chỗ trống) và đáp án từ văn bản AI trả về."""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+MC_LINE = re.compile(r"^\s*([A-D])\s*[\.\):]\s*(.*)$")
+MC_INLINE = re.compile(r"(?:^|\s)([A-D])[\.\)]\s+")
+LOWER_LINE = re.compile(r"^\s*([a-h])\s*[\.\):]\s*(.*)$")
+NUM_LINE = re.compile(r"^\s*(\d+)\s*[\.\):]\s*(.*)$")
+ANSWER_LINE = re.compile(r"^\s*(?:Gợi ý\s+)?(?:đáp án|Gợi ý)\s*:\s*", re.I)
+COL_A = re.compile(r"^\s*Cột\s*A\b", re.I)
+COL_B = re.compile(r"^\s*Cột\s*B\b", re.I)
+BLANK = re.compile(r"\.{4,}|…{2,}|_{3,}")
+
+_MC_ANSWER = re.compile(r"^\s*\(?([A-D])\b")
+_TF_PAIR = re.compile(r"\b([a-h])\s*[-–:)]\s*(Đúng|Sai|Đ|S)\b")
+_MATCH_PAIR = re.compile(r"(\d+)\s*[-–→:]\s*([a-h])\b")
+_NUMBERED_PART = re.compile(r"\(?\d+\)\s*|^\s*\d+\.\s+", re.M)
+
+@dataclass
+class ParsedQuestion:
+    """Kết quả tách 1 câu; `answer` đã chuẩn hoá ('B', 'a-Đ, b-S', '1-b, 2-a', 'từ 1; từ 2')."""
+    stem: str
+    answer: str
+    options: List[Tuple[str, str]] = field(default_factory=list)     # trắc nghiệm (A..D)
+    statements: List[Tuple[str, str]] = field(default_factory=list)  # đúng/sai (a..)
+    left: List[Tuple[str, str]] = field(default_factory=list)        # ghép nối: cột A (1..)
+    right: List[Tuple[str, str]] = field(default_factory=list)       # ghép nối: cột B (a..)
+    blanks: int = 0
+    errors: List[str] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+
+def split_inline_options(lines: List[str]) -> List[str]:
+    """'A. 1   B. 2   C. 3   D. 4' trên 1 dòng -> 4 dòng."""
+    out: List[str] = []
+    for ln in lines:
+        marks = list(MC_INLINE.finditer(ln))
+        if [m.group(1) for m in marks] == ["A", "B", "C", "D"]:
+            head = ln[:marks[0].start()].strip()
+            if head:
+                out.append(head)
+            for k, m in enumerate(marks):
+                end = marks[k + 1].start() if k + 1 < len(marks) else len(ln)
+                out.append(f"{m.group(1)}. {ln[m.end():end].strip()}")
+        else:
+            out.append(ln)
+    return out
+
+def split_answer(content: str) -> Tuple[str, str]:
+    """(nội dung không có dòng đáp án, phần đáp án) — đáp án là từ dòng 'Đáp án:'/'Gợi ý:' đến hết."""
+    lines = content.strip().split("\n")
+    for i, ln in enumerate(lines):
+        if ANSWER_LINE.match(ln):
+            ans = [ANSWER_LINE.sub("", ln, count=1)] + lines[i + 1:]
+            return "\n".join(lines[:i]).strip(), "\n".join(ans).strip()
+    return content.strip(), ""
+
+def _blank_answers(answer: str) -> List[str]:
+    if _NUMBERED_PART.search(answer):
+        parts = _NUMBERED_PART.split(answer)
+    elif ";" in answer or "\n" in answer:
+        parts = re.split(r"[;\n]", answer)
+    else:
+        parts = answer.split(",")
+    return [p.strip(" .;,") for p in parts if p.strip(" .;,")]
+
+def _parse_mc(p: ParsedQuestion, lines: List[str]) -> None:
+    lines = split_inline_options(lines)
+    stem: List[str] = []
+    for ln in lines:
+        m = MC_LINE.match(ln)
+        if m:
+            p.options.append((m.group(1), m.group(2).strip()))
+        elif not p.options:
+            stem.append(ln)
+    p.stem = "\n".join(stem).strip()
+    labels = [k for k, _ in p.options]
+    if labels != ["A", "B", "C", "D"]:
+        p.errors.append(f"Trắc nghiệm cần đúng 4 lựa chọn A, B, C, D (đang có: {', '.join(labels) or 'không có'}).")
+    texts = [t.lower() for _, t in p.options]
+    if any(not t for t in texts):
+        p.errors.append("Có lựa chọn để trống.")
+    elif len(set(texts)) < len(texts):
+        p.errors.append("Có 2 lựa chọn giống nhau.")
+    m = _MC_ANSWER.match(p.answer)
+    if not m or m.group(1) not in labels:
+        p.errors.append("Đáp án trắc nghiệm phải là 1 chữ cái trong các lựa chọn đã có.")
+    else:
+        p.answer = m.group(1)
+
+def _parse_true_false(p: ParsedQuestion, lines: List[str]) -> None:
+    stem: List[str] = []
+    for ln in lines:
+        m = LOWER_LINE.match(ln)
+        if m:
+            p.statements.append((m.group(1), m.group(2).strip()))
+        elif not p.statements:
+            stem.append(ln)
+    p.stem = "\n".join(stem).strip()
+    if len(p.statements) < 2:
+        p.errors.append("Đúng/Sai cần ít nhất 2 mệnh đề a, b, ...")
+    pairs = {k: ("Đ" if v.startswith("Đ") else "S") for k, v in _TF_PAIR.findall(p.answer)}
+    labels = [k for k, _ in p.statements]
+    missing = [k for k in labels if k not in pairs]
+    if missing or set(pairs) - set(labels):
+        p.errors.append(f"Đáp án Đúng/Sai phải ghi Đ/S cho đúng các mệnh đề {', '.join(labels)}.")
+    else:
+        p.answer = ", ".join(f"{k}-{pairs[k]}" for k in labels)
+
+def _parse_matching(p: ParsedQuestion, lines: List[str]) -> None:
+    start_b = next((i for i, ln in enumerate(lines) if COL_B.match(ln)), None)
+    if start_b is None:
+        p.errors.append("Ghép nối cần có 'Cột A' và 'Cột B'.")
+        p.stem = "\n".join(lines).strip()
+        return
+    start_a = next((i for i, ln in enumerate(lines[:start_b]) if COL_A.match(ln)), None)
+    head = lines[:start_a] if start_a is not None else [ln for ln in lines[:start_b] if not NUM_LINE.match(ln)]
+    p.stem = "\n".join(head).strip()
+    for ln in lines[(start_a or 0):start_b]:
+        m = NUM_LINE.match(ln)
+        if m:
+            p.left.append((m.group(1), m.group(2).strip()))
+    for ln in lines[start_b + 1:]:
+        m = LOWER_LINE.match(ln)
+        if m:
+            p.right.append((m.group(1), m.group(2).strip()))
+    if len(p.left) < 2 or len(p.right) < len(p.left):
+        p.errors.append("Ghép nối cần ít nhất 2 ý ở cột A và cột B không ít hơn cột A.")
+    pairs = _MATCH_PAIR.findall(p.answer)
+    left, right = {k for k, _ in p.left}, {k for k, _ in p.right}
+    got = [a for a, _ in pairs]
+    if sorted(got) != sorted(left) or len(set(got)) != len(got) or any(b not in right for _, b in pairs):
+        p.errors.append("Đáp án ghép nối phải nối mỗi ý cột A (1, 2, ...) với đúng 1 ý có trong cột B.")
+    else:
+        p.answer = ", ".join(f"{a}-{b}" for a, b in sorted(pairs, key=lambda ab: int(ab[0])))
+
+def _parse_fill_blank(p: ParsedQuestion, lines: List[str]) -> None:
+    p.stem = "\n".join(lines).strip()
+    p.blanks = len(BLANK.findall(p.stem))
+    if not p.blanks:
+        p.errors.append("Điền khuyết cần chỗ trống dạng '........'.")
+        return
+    parts = [p.answer] if p.blanks == 1 and p.answer else _blank_answers(p.answer)
+    if len(parts) != p.blanks:
+        p.errors.append(f"Có {p.blanks} chỗ trống nhưng đáp án có {len(parts)} ý.")
+    else:
+        p.answer = "; ".join(parts)
+
+def parse_question(q: Dict[str, object]) -> ParsedQuestion:
+    """Tách theo `type` của câu; đáp án lấy từ trường answer, nếu trống thì từ dòng 'Đáp án:' trong nội dung."""
+    content, inline_answer = split_answer(str(q.get("content", "")))
+    answer = ANSWER_LINE.sub("", str(q.get("answer", "") or "").strip(), count=1) or inline_answer
+    p = ParsedQuestion(stem=content, answer=answer)
+    lines = content.split("\n")
+    q_type = str(q.get("type", ""))
+    if q_type.startswith("Trắc nghiệm"):
+        _parse_mc(p, lines)
+    elif q_type.startswith("Đúng/Sai"):
+        _parse_true_false(p, lines)
+    elif q_type.startswith("Ghép nối"):
+        _parse_matching(p, lines)
+    elif q_type.startswith("Điền khuyết"):
+        _parse_fill_blank(p, lines)
+    elif not answer:
+        p.warnings.append("Chưa có gợi ý đáp án.")
+    return p
+
+def normalize_question(q: Dict[str, object]) -> Dict[str, object]:
+    """Bỏ dòng đáp án khỏi nội dung, điền `answer` (đã chuẩn hoá nếu đúng định dạng)."""
+    content, inline_answer = split_answer(str(q.get("content", "")))
+    out = dict(q)
+    out["content"] = content
+    if not str(q.get("answer", "") or "").strip():
+        out["answer"] = inline_answer
+    parsed = parse_question(out)
+    if not parsed.errors:
+        out["answer"] = parsed.answer
+    return out
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+from .bootstrap import app_data_dir
+
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_TTL_S = 30 * 24 * 3600
+
+def normalize_prompt(prompt: str) -> str:
+    """Chuẩn hoá để 2 prompt chỉ khác khoảng trắng/Unicode vẫn trùng khoá."""
+    text = unicodedata.normalize("NFC", prompt)
+    lines = [re.sub(r"[ \t]+", " ", ln).strip() for ln in text.splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+def make_key(prompt: str, model: str, gen_config: Dict[str, object], seed: int) -> str:
+    payload = json.dumps(
+        {"p": normalize_prompt(prompt), "m": model, "c": gen_config, "s": seed},
+        ensure_ascii=False, sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """Cache kết quả AI trên đĩa (SQLite), khoá theo nội dung; xoá theo LRU + TTL + giới hạn dung lượng."""
+
+    def __init__(self, path: Path, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_bytes: int = DEFAULT_MAX_BYTES, ttl_s: float = DEFAULT_TTL_S):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("""CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                text TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL)""")
+            con.execute("CREATE INDEX IF NOT EXISTS ix_responses_last_used ON responses(last_used)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        con = sqlite3.connect(str(self.path), timeout=10)
+        try:
+            with con:  # commit / rollback
+                yield con
+        finally:
+            con.close()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock, self._connect() as con:
+            row = con.execute("SELECT text, created FROM responses WHERE key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl_s:
+                con.execute("DELETE FROM responses WHERE key=?", (key,))
+                return None
+            con.execute("UPDATE responses SET last_used=? WHERE key=?", (now, key))
+            return row[0]
+
+    def put(self, key: str, model: str, text: str) -> None:
+        now = time.time()
+        size = len(text.encode("utf-8"))
+        with self._lock, self._connect() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO responses(key, model, text, size, created, last_used) VALUES (?,?,?,?,?,?)",
+                (key, model, text, size, now, now),
+            )
+            self._evict(con, now)
+
+    def _evict(self, con: sqlite3.Connection, now: float) -> None:
+        con.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_s,))
+        count, total = con.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        # bỏ các mục ít dùng gần đây nhất cho tới khi về dưới giới hạn
+        for key, size in con.execute("SELECT key, size FROM responses ORDER BY last_used ASC").fetchall():
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            con.execute("DELETE FROM responses WHERE key=?", (key,))
+            count -= 1
+            total -= size
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock, self._connect() as con:
+            count, total = con.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"entries": int(count), "bytes": int(total)}
+
+    def clear(self) -> None:
+        with self._lock, self._connect() as con:
+            con.execute("DELETE FROM responses")
+
+_DEFAULT: Optional[ResponseCache] = None
+_DEFAULT_LOCK = threading.Lock()
+
+def default_cache() -> ResponseCache:
+    """Cache dùng chung trong tiến trình, đặt trong app_data_dir()."""
+    global _DEFAULT
+    with _DEFAULT_LOCK:
+        if _DEFAULT is None:
+            _DEFAULT = ResponseCache(app_data_dir() / "ai_responses.sqlite3")
+        return _DEFAULT
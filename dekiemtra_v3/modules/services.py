@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Các bước ra đề không phụ thuộc giao diện: đọc ma trận / danh sách yêu cầu, sinh câu bằng AI, kiểm tra, xuất Word.
+
+Giao diện Streamlit (ui_tabs) và dòng lệnh (`python -m modules.cli`) cùng dùng các hàm ở đây;
+không hàm nào đọc `st.session_state`.
+"""
+from __future__ import annotations
+
+import json
+import re
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from .ai_client import GeminiClient
+from .batch_gen import QuestionSpec, generate_batch
+from .conformance import ConformanceTracker, conformance_issues
+from .data_loader import CurriculumDB
+from .docx_export import export_exam_docx, export_variants_zip
+from .exam_planner import plan_jobs, run_plan
+from .matrix_normalizer import NormalizedMatrix, matrix_table, normalize_matrix
+from .matrix_parser import parse_matrix_file
+from .response_cache import ResponseCache
+from .similarity import DuplicateIndex
+from .validators import ValidationIssue, validate_no_duplicates
+from .variants import make_variants
+
+DEFAULT_TITLE = "ĐỀ KIỂM TRA CUỐI HỌC KÌ"
+ANSWER_KEYS = ("include", "separate", "none")  # xem export_variants_zip
+EXPECTED_TOTAL = 10.0
+
+Question = Dict[str, object]
+
+@dataclass
+class ExamResult:
+    """Kết quả sinh 1 đề: câu đã sinh (theo thứ tự ma trận/danh sách) + các yêu cầu còn lỗi."""
+    questions: List[Question] = field(default_factory=list)
+    failed: List[QuestionSpec] = field(default_factory=list)
+    calls: int = 0
+    messages: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return bool(self.questions) and not self.failed
+
+# --- Prompt (dùng chung cho Tab 1/Tab 2) ---
+def matrix_prompt(norm: NormalizedMatrix, subject: str, grade: str, term: str) -> Tuple[str, int]:
+    """Trả về (prompt sinh cả đề dạng văn bản, số dòng ma trận bị lược do vượt ngân sách token)."""
+    table, omitted = matrix_table(norm)
+    return f"""Đóng vai giáo viên Tiểu học theo CT GDPT 2018 và TT27.
+Hãy tạo đề kiểm tra {term} môn {subject} lớp {grade} dựa trên MA TRẬN bên dưới.
+- Bám sát số câu, mức độ, điểm theo ma trận.
+- Đa dạng dạng câu hỏi: Trắc nghiệm 4 lựa chọn, Đúng/Sai, Ghép nối, Điền khuyết, Tự luận (tuỳ nội dung).
+- Xuất đúng định dạng:
+Câu [n] ([điểm] đ) - [Mức 1/2/3]: ...
+Nếu là trắc nghiệm: A. ...\nB. ...\nC. ...\nD. ...\nĐáp án: ...
+Nếu là đúng/sai: liệt kê mệnh đề a/b/c..., ghi đáp án cuối.
+Nếu là nối cột: Cột A (1..), Cột B (a..), Đáp án: 1-b, ...
+Nếu là điền khuyết: dùng '........' để chừa chỗ trống; Đáp án: ...
+KHÔNG viết lời dẫn dài.
+
+MA TRẬN:
+{table}
+""", omitted
+
+def question_prompt(subject, grade, topic, lesson, yccd, q_type, level, points) -> str:
+    """Prompt sinh 1 câu (nội dung + dòng "Đáp án:")."""
+    return f"""Đóng vai giáo viên Tiểu học theo CT GDPT 2018 và TT27.
+Soạn 1 câu hỏi kiểm tra môn {subject} lớp {grade}.
+- Chủ đề: {topic}
+- Bài/Nội dung: {lesson}
+- YCCĐ: {yccd}
+- Dạng: {q_type}; Mức: {level}; Điểm: {points}
+
+YÊU CẦU ĐỊNH DẠNG:
+- Trắc nghiệm: 4 lựa chọn A/B/C/D mỗi lựa chọn 1 dòng, cuối ghi 'Đáp án: X'
+- Đúng/Sai: viết 3-4 mệnh đề a/b/c..., cuối ghi 'Đáp án: a-Đ, b-S, ...'
+- Ghép nối: Cột A (1..), Cột B (a..), cuối ghi 'Đáp án: 1-b, 2-a,...'
+- Điền khuyết: chừa chỗ trống bằng '........', cuối ghi 'Đáp án: ...'
+- Tự luận: nêu yêu cầu rõ, có gợi ý đáp án ngắn cuối.
+
+CHỈ TRẢ VỀ NỘI DUNG CÂU HỎI + DÒNG ĐÁP ÁN. Không viết lời dẫn.
+"""
+
+# --- Đầu vào ---
+def load_matrix(source: Union[str, Path, object], sheet: Optional[str] = None,
+                header_row: Optional[int] = None) -> NormalizedMatrix:
+    """Đọc + chuẩn hoá ma trận; ValueError (thông báo tiếng Việt) nếu không đọc được hoặc không nhận ra ô nào."""
+    res = parse_matrix_file(source, sheet=sheet, header_row=header_row)
+    if not res.ok or res.df is None:
+        raise ValueError(res.message)
+    norm = normalize_matrix(res.df)
+    if not norm.cells:
+        raise ValueError("Chưa nhận ra cấu trúc Chủ đề × Mức × Số câu × Điểm trong ma trận.")
+    return norm
+
+_SPEC_FIELDS = tuple(f.name for f in fields(QuestionSpec))
+_SPEC_ALIASES = {"type": "q_type"}  # cho phép dùng tên trường như trong câu hỏi đã xuất
+
+def specs_from_items(items: Sequence[Dict[str, object]], defaults: Optional[Dict[str, object]] = None) -> List[QuestionSpec]:
+    """Danh sách dict -> QuestionSpec. `defaults` bổ sung trường thiếu (vd. Môn/Lớp chung của cả file).
+
+    `lesson` thiếu thì lấy theo `topic`; `yccd` thiếu thì để trống; `points` thiếu thì 1 điểm.
+    """
+    specs: List[QuestionSpec] = []
+    for n, raw in enumerate(items, 1):
+        if not isinstance(raw, dict):
+            raise ValueError(f"Yêu cầu {n}: phải là object JSON.")
+        it = {_SPEC_ALIASES.get(k, k): v for k, v in {**(defaults or {}), **raw}.items()}
+        unknown = sorted(set(it) - set(_SPEC_FIELDS))
+        if unknown:
+            raise ValueError(f"Yêu cầu {n}: trường không hợp lệ {', '.join(unknown)}.")
+        it.setdefault("lesson", it.get("topic", ""))
+        it.setdefault("yccd", "")
+        it.setdefault("points", 1.0)
+        missing = [k for k in _SPEC_FIELDS if k != "yccd" and not str(it.get(k, "")).strip()]
+        if missing:
+            raise ValueError(f"Yêu cầu {n}: thiếu {', '.join(missing)}.")
+        try:
+            it["points"] = float(it["points"])  # type: ignore[arg-type]
+        except (TypeError, ValueError):
+            raise ValueError(f"Yêu cầu {n}: điểm không hợp lệ ({it['points']!r}).") from None
+        specs.append(QuestionSpec(**{k: it[k] if k == "points" else str(it[k]) for k in _SPEC_FIELDS}))  # type: ignore[arg-type]
+    return specs
+
+def load_specs(path: Union[str, Path], defaults: Optional[Dict[str, object]] = None) -> List[QuestionSpec]:
+    """File JSON: mảng yêu cầu, hoặc {"defaults": {...}, "questions": [...]}."""
+    try:
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Không đọc được {path}: {e}") from None
+    if isinstance(data, dict):
+        defaults = {**(defaults or {}), **dict(data.get("defaults") or {})}
+        data = data.get("questions")
+    if not isinstance(data, list) or not data:
+        raise ValueError(f"{path}: cần một mảng yêu cầu câu hỏi (không rỗng).")
+    return specs_from_items(data, defaults)
+
+# --- Sinh câu ---
+def generate_from_matrix(ai: GeminiClient, norm: NormalizedMatrix, subject: str, grade: str,
+                         db: Optional[CurriculumDB] = None, seed: Optional[int] = None,
+                         cache: Optional[ResponseCache] = None, concurrency: int = 4,
+                         avoid: Sequence[DuplicateIndex] = (),
+                         progress: Optional[Callable[[int, int], None]] = None) -> ExamResult:
+    """Mỗi ô ma trận thành các câu hỏi có cấu trúc (gợi ý Bài/YCCĐ từ DB nếu có)."""
+    res = run_plan(ai, plan_jobs(norm, subject, grade, db), seed=seed, cache=cache,
+                   concurrency=concurrency, avoid=avoid, progress=progress)
+    return ExamResult(questions=res.questions, failed=[s for j in res.failed_jobs for s in j.specs],
+                      calls=res.calls, messages=res.messages)
+
+def generate_from_specs(ai: GeminiClient, specs: List[QuestionSpec], seed: Optional[int] = None,
+                        cache: Optional[ResponseCache] = None, concurrency: int = 4,
+                        avoid: Sequence[DuplicateIndex] = (),
+                        progress: Optional[Callable[[int, int], None]] = None) -> ExamResult:
+    res = generate_batch(ai, specs, seed=seed, cache=cache, concurrency=concurrency, avoid=avoid, progress=progress)
+    return ExamResult(questions=[q for q in res.questions if q is not None], failed=[specs[i] for i in res.failed],
+                      calls=res.calls, messages=res.messages)
+
+def check_exam(questions: List[Question], norm: Optional[NormalizedMatrix] = None,
+               expected_total: float = EXPECTED_TOTAL) -> List[ValidationIssue]:
+    """Các kiểm tra cả đề trước khi xuất: tổng điểm, câu gần trùng; có ma trận thì đối chiếu từng ô."""
+    tracker = ConformanceTracker()
+    tracker.sync(questions)
+    if norm is None or not norm.cells:
+        return tracker.points_issues(expected_total) + validate_no_duplicates(questions)
+    return (tracker.points_issues(norm.total_points or expected_total) + validate_no_duplicates(questions)
+            + conformance_issues(tracker.diff(norm)))
+
+# --- Xuất ---
+def exam_meta(subject: str, grade: str, school: str = "", title: str = DEFAULT_TITLE, term: str = "",
+              subtitle: str = "") -> Dict[str, str]:
+    return {"school": school, "title": title, "term": term, "subject": subject, "grade": grade, "subtitle": subtitle}
+
+def exam_file_stem(subject: str, grade: str) -> str:
+    return f"De_{subject}_lop{grade}"
+
+def safe_file_name(name: str) -> str:
+    """Bỏ ký tự không dùng được trong tên file (giữ dấu tiếng Việt)."""
+    return re.sub(r"\s+", "_", re.sub(r'[\\/:*?"<>|]+', "-", name.strip())) or "De"
+
+def write_exam(out_dir: Union[str, Path], meta: Dict[str, str], questions: List[Question],
+               stem: Optional[str] = None, variants: int = 1, seed: int = 2024, answer_key: str = "include",
+               shuffle_options: bool = True, keep_first: bool = True) -> List[Path]:
+    """Ghi đề ra `out_dir`: 1 mã đề -> file .docx (+ file đáp án nếu "separate"); nhiều mã đề -> 1 file ZIP.
+
+    Trả về các file đã ghi.
+    """
+    if answer_key not in ANSWER_KEYS:
+        raise ValueError(f"answer_key phải là một trong {', '.join(ANSWER_KEYS)}.")
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    stem = safe_file_name(stem or exam_file_stem(meta.get("subject", ""), meta.get("grade", "")))
+    if variants > 1:
+        path = out / f"{stem}_{variants}_ma.zip"
+        picked = make_variants(questions, variants, seed, keep_first=keep_first, options=shuffle_options)
+        path.write_bytes(export_variants_zip(meta, picked, answer_key=answer_key, file_prefix=stem))
+        return [path]
+    path = out / f"{stem}.docx"
+    path.write_bytes(export_exam_docx(meta, questions, include_answer_key=answer_key == "include"))
+    written = [path]
+    if answer_key == "separate":
+        key_path = out / f"{stem}_dap_an.docx"
+        key_path.write_bytes(export_exam_docx({**meta, "subtitle": "ĐÁP ÁN"}, questions, include_questions=False))
+        written.append(key_path)
+    return written
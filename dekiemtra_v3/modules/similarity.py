@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""Phát hiện câu hỏi gần trùng: chuẩn hoá tiếng Việt -> shingle -> MinHash, tra cứu bằng LSH (băng).
+
+Tra 1 câu chỉ tốn vài phép tra dict (không so với từng câu), nên vẫn nhanh khi ngân hàng có hàng chục nghìn câu.
+"""
+from __future__ import annotations
+
+import random
+import re
+import threading
+import zlib
+from array import array
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Set, Tuple
+
+from .text_utils import fold_vi
+
+NUM_PERM = 64
+BANDS = 16  # 16 băng × 4 hàng: cặp có Jaccard 0.8 gần như chắc chắn thành ứng viên
+DEFAULT_THRESHOLD = 0.8
+SHINGLE_VERSION = 2  # tăng khi đổi cách tách cặp từ -> ngân hàng tính lại chữ ký đã lưu
+
+_PRIME = (1 << 61) - 1
+_MASK = 0xFFFFFFFF
+_rng = random.Random(20180101)  # cố định -> chữ ký lưu trong ngân hàng dùng được qua các lần chạy
+_PERMS: Tuple[Tuple[int, int], ...] = tuple((_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM))
+
+# nhãn lựa chọn ở đầu dòng không mang nội dung, bỏ đi để "A. 5" và "A) 5" giống nhau;
+# chữ số giữ lại làm nội dung ("Tính 3 : 5" không bị cắt)
+_LABELS = re.compile(r"(?im)^\s*[a-h]\s*[\.\)]")
+_ANSWER = re.compile(r"dap an\s*:.*$")
+_WORD = re.compile(r"\w+", re.U)
+
+Signature = Tuple[int, ...]
+
+def shingles(text: str) -> Set[int]:
+    """Tập hash của các cặp từ liên tiếp (tiếng Việt là âm tiết) sau khi bỏ dấu và dòng đáp án."""
+    grams: List[str] = []
+    # tách theo nhãn lựa chọn: cặp từ không vắt qua 2 lựa chọn -> đảo thứ tự A/B/C/D vẫn giống nhau
+    # tách trước khi bỏ dấu: fold_vi gộp xuống dòng, mất mốc đầu dòng của nhãn
+    for part in _LABELS.split(text):
+        words = _WORD.findall(_ANSWER.sub("", fold_vi(part)))
+        grams.extend(words if len(words) < 2 else (f"{a} {b}" for a, b in zip(words, words[1:])))
+    return {zlib.crc32(g.encode("utf-8")) for g in grams}
+
+def signature(text: str) -> Optional[Signature]:
+    """Chữ ký MinHash (NUM_PERM số 32 bit); None nếu câu không có chữ."""
+    hs = shingles(text)
+    if not hs:
+        return None
+    return tuple(min((a * x + b) % _PRIME for x in hs) & _MASK for a, b in _PERMS)
+
+def similarity(a: Signature, b: Signature) -> float:
+    """Ước lượng hệ số Jaccard giữa 2 câu từ chữ ký."""
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+def sig_to_bytes(sig: Signature) -> bytes:
+    return array("I", sig).tobytes()
+
+def sig_from_bytes(data: bytes) -> Optional[Signature]:
+    arr = array("I")
+    arr.frombytes(data)
+    return tuple(arr) if len(arr) == NUM_PERM else None
+
+def question_text(q: Dict[str, object]) -> str:
+    return str(q.get("content", ""))
+
+class DuplicateIndex:
+    """Chỉ mục LSH trong bộ nhớ: khoá (id câu / vị trí trong đề) -> chữ ký MinHash."""
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, bands: int = BANDS):
+        self.threshold = threshold
+        self.rows = NUM_PERM // bands
+        self._sigs: Dict[Hashable, Signature] = {}
+        self._buckets: List[Dict[Tuple[int, ...], Set[Hashable]]] = [{} for _ in range(bands)]
+        self._lock = threading.Lock()
+
+    def _bands(self, sig: Signature) -> Iterable[Tuple[int, Tuple[int, ...]]]:
+        r = self.rows
+        for b in range(len(self._buckets)):
+            yield b, sig[b * r:(b + 1) * r]
+
+    def __len__(self) -> int:
+        return len(self._sigs)
+
+    def add(self, key: Hashable, text: str = "", sig: Optional[Signature] = None) -> Optional[Signature]:
+        sig = sig or signature(text)
+        if sig is None:
+            return None
+        with self._lock:
+            self._remove(key)
+            self._sigs[key] = sig
+            for b, band in self._bands(sig):
+                self._buckets[b].setdefault(band, set()).add(key)
+        return sig
+
+    def _remove(self, key: Hashable) -> None:
+        old = self._sigs.pop(key, None)
+        if old is None:
+            return
+        for b, band in self._bands(old):
+            bucket = self._buckets[b].get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[b][band]
+
+    def remove(self, key: Hashable) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def query(self, text: str = "", sig: Optional[Signature] = None,
+              exclude: Optional[Hashable] = None) -> List[Tuple[Hashable, float]]:
+        """Các câu đã có giống câu này từ ngưỡng trở lên, giống nhất trước."""
+        sig = sig or signature(text)
+        if sig is None:
+            return []
+        with self._lock:
+            cands: Set[Hashable] = set()
+            for b, band in self._bands(sig):
+                cands |= self._buckets[b].get(band, set())
+            cands.discard(exclude)
+            scored = [(k, similarity(sig, self._sigs[k])) for k in cands]
+        hits = [(k, s) for k, s in scored if s >= self.threshold]
+        return sorted(hits, key=lambda ks: -ks[1])
+
+    def best(self, text: str = "", sig: Optional[Signature] = None) -> Optional[Tuple[Hashable, float]]:
+        hits = self.query(text, sig)
+        return hits[0] if hits else None
+
+def index_questions(questions: Sequence[Dict[str, object]], threshold: float = DEFAULT_THRESHOLD) -> DuplicateIndex:
+    """Chỉ mục cho các câu trong đề hiện tại (khoá = vị trí trong danh sách)."""
+    idx = DuplicateIndex(threshold)
+    for i, q in enumerate(questions):
+        idx.add(i, question_text(q))
+    return idx
+
+def find_duplicates(questions: Sequence[Dict[str, object]],
+                    threshold: float = DEFAULT_THRESHOLD) -> List[Tuple[int, int, float]]:
+    """Các cặp (i, j, độ giống) với j < i là câu xuất hiện trước và gần trùng với câu i."""
+    idx = DuplicateIndex(threshold)
+    out: List[Tuple[int, int, float]] = []
+    for i, q in enumerate(questions):
+        sig = signature(question_text(q))
+        if sig is None:
+            continue
+        hit = idx.best(sig=sig)
+        if hit is not None:
+            out.append((i, int(hit[0]), hit[1]))  # type: ignore[call-overload]
+        idx.add(i, sig=sig)
+    return out
+
+def first_duplicate(text: str, indexes: Sequence[DuplicateIndex]) -> Optional[Tuple[int, Hashable, float]]:
+    """(vị trí chỉ mục, khoá, độ giống) của câu trùng đầu tiên tìm thấy, hoặc None."""
+    sig = signature(text)
+    if sig is None:
+        return None
+    for n, idx in enumerate(indexes):
+        hit = idx.best(sig=sig)
+        if hit is not None:
+            return n, hit[0], hit[1]
+    return None
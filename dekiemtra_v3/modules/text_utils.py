@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import re
+import unicodedata
+
+def fold_vi(text: str) -> str:
+    """Chữ thường, bỏ dấu tiếng Việt (kể cả đ -> d), gộp khoảng trắng — để so khớp mềm."""
+    t = unicodedata.normalize("NFD", str(text).lower().replace("đ", "d"))
+    t = "".join(ch for ch in t if unicodedata.category(ch) != "Mn")
+    return re.sub(r"\s+", " ", t).strip()
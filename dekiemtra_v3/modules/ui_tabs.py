@@ -1,15 +1,35 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
-from typing import Dict, List, Optional
+import functools
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
 
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 
-from .ai_client import GeminiClient
+from . import metrics
+from .ai_client import AIStatus, GeminiClient, estimate_tokens
+from .batch_gen import QuestionSpec
+from .bootstrap import lazy_import
+from .conformance import CellStatus, ConformanceTracker, cell_key, missing_matrix
 from .data_loader import CurriculumDB
-from .docx_export import export_exam_docx
-from .matrix_parser import parse_matrix_file
-from .validators import validate_points_sum, validate_question_schema
+from .docx_export import DOCX_MIME, export_exam_docx, export_variants_zip
+from .exam_planner import GenerationJob, plan_jobs
+from .gen_tasks import REPORT_EVERY_S, TASKS, ai_payload, jobs_from_payload, jobs_to_payload, specs_from_payload, specs_to_payload
+from .job_queue import JobInfo, default_queue
+from .matrix_normalizer import NormalizedMatrix, normalize_matrix
+from .matrix_parser import list_sheets, parse_matrix_file
+from .question_bank import BankHit, default_bank
+from .question_format import normalize_question
+from .response_cache import default_cache
+from .services import DEFAULT_TITLE, EXPECTED_TOTAL, exam_file_stem, exam_meta, matrix_prompt, question_prompt
+from .similarity import DuplicateIndex, first_duplicate, index_questions
+from .variants import make_variants
+from .validators import ALLOWED_TYPES, ValidationIssue, validate_no_duplicates, validate_question_format, validate_question_schema
+
+# pandas chỉ cần cho bảng sửa đề (Tab 3) và panel hiệu năng -> không nhập lúc khởi động
+pd = lazy_import("pandas")
 
 QUESTION_TYPES_BASE = [
     "Trắc nghiệm (4 lựa chọn)",
@@ -21,39 +41,255 @@ QUESTION_TYPES_BASE = [
 
 LEVELS = ["Mức 1: Biết", "Mức 2: Hiểu", "Mức 3: Vận dụng"]
 
+CACHE_MODES = ["Dùng lại kết quả đã lưu", "Luôn sinh biến thể mới"]
+
+ANSWER_KEY_MODES = {
+    "Kèm cuối mỗi đề": "include",
+    "File đáp án riêng": "separate",
+    "Không kèm": "none",
+}
+
 def _init_state():
     st.session_state.setdefault("questions", [])
     st.session_state.setdefault("tab1_exam_text", "")
+    st.session_state.setdefault("tab1_job", None)
     st.session_state.setdefault("api_key", "")
     st.session_state.setdefault("ai_enabled", False)
     st.session_state.setdefault("last_ai_status", "")
     st.session_state.setdefault("matrix_df", None)
+    st.session_state.setdefault("matrix_norm", None)
+    st.session_state.setdefault("tab1_failed_jobs", [])
+    st.session_state.setdefault("ai_cache_on", False)
+    st.session_state.setdefault("ai_cache_mode", CACHE_MODES[0])
+    st.session_state.setdefault("ai_seed", 0)
+    st.session_state.setdefault("t2_batch_specs", [])
+    st.session_state.setdefault("ai_concurrency", 4)
+    st.session_state.setdefault("t3_ver", 0)  # tăng sau mỗi lần áp dụng sửa -> bảng/ô sửa nạp lại dữ liệu mới
+    st.session_state.setdefault("flash", [])
+    st.session_state.setdefault("metrics", metrics.Recorder())  # số liệu hiệu năng của phiên (panel gỡ lỗi)
+    st.session_state.setdefault("conformance", ConformanceTracker())  # tổng câu/điểm theo ô ma trận, cập nhật dần
+    if "owner" not in st.session_state:
+        # mã người dùng nằm trên URL (?u=...) -> tải lại trang/mở lại link vẫn thấy các việc nền của mình
+        token = st.query_params.get("u") or uuid.uuid4().hex[:16]
+        st.query_params["u"] = token
+        st.session_state.owner = token
+
+# Mỗi tab và sidebar là 1 fragment: tương tác trong tab chỉ chạy lại tab đó.
+# Khi danh sách câu (dùng chung cho Tab 3) hoặc trạng thái AI thay đổi thì mới chạy lại cả app.
+_TOAST_ICON = {"success": "✅", "info": "ℹ️", "warning": "⚠️"}
+
+def _rerun_app(*notes: Tuple[str, str]):
+    """Chạy lại toàn app; thông báo (loại, nội dung) được giữ lại và hiện dạng toast ở lần chạy sau."""
+    st.session_state.flash.extend(notes)
+    st.rerun()
+
+def _rerun_fragment():
+    """Chạy lại riêng fragment hiện tại; nếu đang trong lượt chạy toàn app thì chạy lại toàn app."""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+def _timed_ui(name: str) -> Callable:
+    """Đo thời gian chạy 1 phần giao diện; mọi span bên trong (AI, đọc ma trận, xuất Word...) tính cho phiên này.
+
+    Đặt dưới @st.fragment: fragment chạy lại riêng thì vẫn được đo.
+    """
+    def deco(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with metrics.use(st.session_state.metrics), metrics.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def show_flash():
+    for kind, msg in st.session_state.flash:
+        st.toast(msg, icon=_TOAST_ICON.get(kind))
+    st.session_state.flash = []
 
 def render_sidebar(ai: GeminiClient):
-    st.sidebar.header("Cấu hình")
-    st.sidebar.caption("Để app không lỗi trước giao diện: nếu thiếu API key, AI sẽ tự tắt và bạn vẫn dùng được phần còn lại.")
-    st.session_state.api_key = st.sidebar.text_input("Gemini API Key (tùy chọn)", type="password", value=st.session_state.api_key)
-    if st.sidebar.button("🔎 Kiểm tra API"):
+    # fragment không được gọi st.sidebar.* -> đặt fragment bên trong khối sidebar
+    with st.sidebar:
+        _sidebar(ai)
+        _jobs_panel(ai)
+
+@st.fragment
+@_timed_ui("ui.sidebar")
+def _sidebar(ai: GeminiClient):
+    st.header("Cấu hình")
+    st.caption("Để app không lỗi trước giao diện: nếu thiếu API key, AI sẽ tự tắt và bạn vẫn dùng được phần còn lại.")
+    st.session_state.api_key = st.text_input("Gemini API Key (tùy chọn)", type="password", value=st.session_state.api_key)
+    if st.button("🔎 Kiểm tra API"):
         ai.api_key = st.session_state.api_key.strip()
-        stt = ai.check_api()
+        stt = ai.check_api(force=True)
+        changed = stt.ok != st.session_state.ai_enabled
         st.session_state.ai_enabled = stt.ok
         st.session_state.last_ai_status = stt.message
+        if changed:
+            _rerun_app()  # các tab đọc ai_enabled để bật/tắt ô "Dùng AI"
     if st.session_state.last_ai_status:
-        (st.sidebar.success if st.session_state.ai_enabled else st.sidebar.warning)(st.session_state.last_ai_status)
+        (st.success if st.session_state.ai_enabled else st.warning)(st.session_state.last_ai_status)
+
+    st.checkbox("💾 Lưu & dùng lại kết quả AI (cache)", key="ai_cache_on")
+    if st.session_state.ai_cache_on:
+        st.radio("Khi gặp yêu cầu đã từng sinh", CACHE_MODES, key="ai_cache_mode")
+        if st.session_state.ai_cache_mode == CACHE_MODES[0]:
+            st.number_input("Mã biến thể (seed)", min_value=0, step=1, key="ai_seed",
+                            help="Cùng yêu cầu + cùng mã -> dùng lại kết quả đã lưu. Đổi mã để có biến thể khác.")
+
+    st.slider("Số yêu cầu AI chạy song song", 1, 8, key="ai_concurrency",
+              help="Dùng khi sinh nhiều câu/nhiều phần cùng lúc. Giảm nếu hay gặp lỗi quota (429).")
+    with st.expander("⏱ Hiệu năng (gỡ lỗi)"):
+        _perf_panel(ai)
+
+_PERF_SCOPES = ("Phiên này", "Toàn máy chủ")
+
+def _perf_panel(ai: GeminiClient):
+    """Thời gian từng bước (span), bộ đếm (cache, thử lại, token) và trạng thái model; tải về dạng JSON lines."""
+    scope = st.radio("Phạm vi", _PERF_SCOPES, horizontal=True, key="perf_scope")
+    rec: metrics.Recorder = st.session_state.metrics if scope == _PERF_SCOPES[0] else metrics.PROCESS
+    rows = rec.summary()
+    if rows:
+        st.dataframe(pd.DataFrame(rows).set_index("name"), use_container_width=True)
+    else:
+        st.caption("Chưa có số liệu.")
+    counters = rec.counters()
+    if counters:
+        st.dataframe(pd.DataFrame({"giá trị": counters}), use_container_width=True)
+    recent = rec.recent(15)
+    if recent:
+        st.caption("Các bước gần nhất")
+        st.dataframe(pd.DataFrame(recent)[["name", "ms", "ok"] + [c for c in ("parent", "model") if any(c in r for r in recent)]],
+                     use_container_width=True, hide_index=True)
+    if st.session_state.ai_enabled:
+        st.caption("Trạng thái model (circuit breaker)")
+        st.dataframe(pd.DataFrame(ai.health()).T[["tier", "state", "failures", "retry_in_s"]], use_container_width=True)
+    c1, c2, c3 = st.columns(3)
+    c1.button("↻", help="Làm mới", key="perf_refresh")
+    c2.download_button("⬇️ JSONL", data=rec.to_jsonl(), file_name="dekiemtra_metrics.jsonl",
+                       mime="application/x-ndjson", key="perf_dl")
+    if c3.button("Xoá", key="perf_reset", disabled=rec is metrics.PROCESS):
+        rec.reset()
+        _rerun_fragment()
+
+JOB_POLL_S = 2.0
+STREAM_POLL_S = REPORT_EVERY_S  # Tab 1 đang sinh đề: làm mới cùng nhịp việc nền ghi phần đã nhận
+_JOB_STATUS = {"queued": "⏳ chờ", "running": "⚙️ đang chạy", "done": "✅ xong", "failed": "❌ lỗi",
+               "cancelled": "⏹ đã huỷ", "interrupted": "⚠️ bị gián đoạn"}
+
+def _submit_job(ai: GeminiClient, kind: str, title: str, payload: Dict[str, object]) -> str:
+    """Đưa việc sinh AI vào hàng đợi nền (kèm tham số AI hiện tại) rồi chạy lại app để bảng việc bắt đầu theo dõi."""
+    ai.api_key = st.session_state.api_key.strip()
+    opts = _ai_options()
+    payload = {**payload, **ai_payload(opts.get("seed"), bool(opts), int(st.session_state.ai_concurrency))}  # type: ignore[arg-type]
+    return default_queue().submit(st.session_state.owner, kind, title, payload, TASKS[kind](ai))
+
+def _avoid_texts() -> List[str]:
+    return [str(q.get("content", "")) for q in st.session_state.questions]
+
+def _collect(job: JobInfo) -> List[Tuple[str, str]]:
+    """Đưa kết quả việc đã xong vào phiên hiện tại (đề văn bản / danh sách câu / danh sách chờ).
+
+    Nhận việc trước rồi mới thêm câu: 2 tab cùng mã người dùng (hoặc 2 lượt làm mới) không thêm trùng 1 kết quả.
+    """
+    if not default_queue().mark_collected(job.id):
+        return []
+    res = job.result or {}
+    notes: List[Tuple[str, str]] = []
+    if job.kind == "exam_text":
+        st.session_state.tab1_exam_text = str(res.get("text", ""))
+        if st.session_state.tab1_job == job.id:
+            st.session_state.tab1_job = None
+        notes.append(("success", f"{job.title}: đã sinh xong ({res.get('model')}{', từ cache' if res.get('cached') else ''})."))
+    else:
+        qs = list(res.get("questions", []))  # type: ignore[arg-type]
+        st.session_state.questions.extend(qs)
+        notes.append(("success", f"{job.title}: đã thêm {len(qs)} câu vào Tab 3 sau {res.get('calls', 0)} lần gọi AI."))
+        if res.get("duplicates"):
+            notes.append(("info", f"{res['duplicates']} câu AI trả về gần trùng câu đã có nên đã được sinh lại."))
+        if job.kind == "batch" and res.get("failed_specs"):
+            st.session_state.t2_batch_specs.extend(specs_from_payload(res["failed_specs"]))  # type: ignore[arg-type]
+            notes.append(("warning", f"{len(res['failed_specs'])} câu chưa sinh được, đã trả lại danh sách chờ."))  # type: ignore[arg-type]
+        if job.kind == "plan" and res.get("failed_jobs"):
+            st.session_state.tab1_failed_jobs = jobs_from_payload(res["failed_jobs"])  # type: ignore[arg-type]
+            notes.append(("warning", f"{len(res['failed_jobs'])} ô ma trận chưa sinh đủ câu; bấm sinh lại ở Tab 1."))  # type: ignore[arg-type]
+        if res.get("failed_specs") or res.get("failed_jobs"):
+            notes.extend(("warning", str(m)) for m in list(res.get("messages", []))[-3:])  # type: ignore[arg-type]
+    return notes
+
+def _jobs_panel(ai: GeminiClient):
+    jobs = default_queue().list(st.session_state.owner, limit=10)
+    if not jobs:
+        return
+    # chỉ tự làm mới khi còn việc đang chạy; nộp việc mới luôn chạy lại cả app nên panel sẽ bật lại
+    poll = JOB_POLL_S if any(j.active for j in jobs) else None
+    st.fragment(run_every=poll)(_jobs_body)(ai)
+
+@_timed_ui("ui.jobs")
+def _jobs_body(ai: GeminiClient):
+    queue = default_queue()
+    st.divider()
+    st.markdown("**🧾 Việc chạy nền**")
+    notes: List[Tuple[str, str]] = []
+    for j in queue.list(st.session_state.owner, limit=10):
+        if j.status == "done" and not j.collected:
+            notes.extend(_collect(j))
+            continue
+        if j.active:
+            st.progress(min(max(j.progress, 0.0), 1.0), text=f"{j.title} — {_JOB_STATUS[j.status]} {j.message}")
+            if st.button("⏹ Huỷ", key=f"job_cancel_{j.id}"):
+                queue.cancel(j.id)
+            continue
+        c1, c2 = st.columns([4, 1])
+        c1.caption(f"{_JOB_STATUS.get(j.status, j.status)} · {j.title}" + (f" — {j.message}" if j.status != "done" else ""))
+        if c2.button("🗑", key=f"job_del_{j.id}", help="Xoá khỏi danh sách"):
+            queue.delete(j.id)
+            _rerun_fragment()
+        if j.status in ("failed", "interrupted", "cancelled") and st.button("🔁 Chạy lại", key=f"job_retry_{j.id}"):
+            ai.api_key = st.session_state.api_key.strip()
+            queue.submit(j.owner, j.kind, j.title, j.payload, TASKS[j.kind](ai))
+            _rerun_app(("info", f"Đã chạy lại: {j.title}"))
+    if notes:
+        _rerun_app(*notes)
+
+def _ai_options() -> Dict[str, object]:
+    """Tham số seed/cache cho ai.generate theo lựa chọn ở sidebar."""
+    if not st.session_state.ai_cache_on:
+        return {}
+    if st.session_state.ai_cache_mode != CACHE_MODES[0]:
+        return {}  # seed ngẫu nhiên -> luôn gọi AI
+    return {"seed": int(st.session_state.ai_seed), "cache": default_cache()}
+
+def _dup_indexes() -> List[DuplicateIndex]:
+    """Câu mới không được gần trùng câu trong đề hiện tại (khoá = vị trí) hoặc trong ngân hàng (khoá = id)."""
+    return [index_questions(st.session_state.questions), default_bank().duplicate_index()]
+
+def _ai_source(stt: AIStatus) -> str:
+    return f"{stt.used_model}, từ cache" if stt.cached else str(stt.used_model)
 
-def tab1_matrix_exam(ai: GeminiClient):
+@st.fragment
+@_timed_ui("ui.tab1")
+def tab1_matrix_exam(ai: GeminiClient, db: Optional[CurriculumDB] = None):
     st.subheader("Tab 1 — Tạo đề từ ma trận")
     st.caption("Mục tiêu: Upload ma trận → xem đẹp + kiểm tra nhanh → (tùy chọn) AI sinh đề.")
     colL, colR = st.columns([1.2, 1])
     with colL:
         up = st.file_uploader("Tải ma trận (.xlsx/.xls/.csv)", type=["xlsx","xls","csv"])
+        sheets = list_sheets(up) if up is not None else []
+        sheet = st.selectbox("Sheet", sheets, key="t1_sheet") if len(sheets) > 1 else None
+        header_row = st.number_input("Dòng tiêu đề (0 = tự dò)", min_value=0, max_value=50, value=0, step=1, key="t1_header",
+                                     help="Ma trận TT27 thường có tiêu đề 2-3 dòng gộp ô; để 0 cho app tự nhận.")
         if st.button("📥 Đọc & hiển thị ma trận", type="primary", use_container_width=True):
-            res = parse_matrix_file(up)
+            res = parse_matrix_file(up, sheet=sheet, header_row=int(header_row) - 1 if header_row else None)
             if not res.ok:
                 st.error(res.message)
                 st.session_state.matrix_df = None
+                st.session_state.matrix_norm = None
             else:
                 st.session_state.matrix_df = res.df
+                st.session_state.matrix_norm = normalize_matrix(res.df)
+                st.session_state.tab1_failed_jobs = []
                 st.success(res.message)
         if st.session_state.matrix_df is not None:
             df = st.session_state.matrix_df
@@ -61,6 +297,16 @@ def tab1_matrix_exam(ai: GeminiClient):
             st.dataframe(df, use_container_width=True, height=360)
             with st.expander("Kiểm tra nhanh (logic)"):
                 st.write({"Số dòng": df.shape[0], "Số cột": df.shape[1], "Tên cột": list(df.columns)})
+                norm: Optional[NormalizedMatrix] = st.session_state.matrix_norm
+                if norm is not None and norm.cells:
+                    st.caption(f"Nhận dạng ma trận ({norm.layout}): {len(norm.cells)} ô, "
+                               f"{norm.total_questions} câu, {norm.total_points:g} điểm.")
+                    st.dataframe(
+                        [{"Chủ đề": c.topic, "Mức": c.level, "Dạng": c.q_type, "Số câu": c.count, "Điểm": c.points} for c in norm.cells],
+                        use_container_width=True, hide_index=True,
+                    )
+                elif norm is not None:
+                    st.caption("Chưa nhận ra cấu trúc Chủ đề × Mức × Số câu × Điểm; AI sẽ nhận bảng đã lược ô trống.")
 
     with colR:
         st.markdown("**Sinh đề (tùy chọn AI):**")
@@ -69,43 +315,76 @@ def tab1_matrix_exam(ai: GeminiClient):
         grade = st.text_input("Lớp", value="")
         term = st.text_input("Kì", value="Cuối học kì")
         use_ai = st.checkbox("Dùng AI để sinh đề", value=st.session_state.ai_enabled)
+        prompt = ""
+        if use_ai and st.session_state.matrix_norm is not None:
+            prompt, omitted = matrix_prompt(st.session_state.matrix_norm, subject, grade, term)
+            st.caption(f"Ước tính prompt: ~{estimate_tokens(prompt)} token.")
+            if omitted:
+                st.warning(f"Ma trận quá dài: {omitted} dòng cuối không được gửi cho AI.")
         if st.button("✨ Sinh đề", use_container_width=True):
             if st.session_state.matrix_df is None:
                 st.error("Bạn cần đọc ma trận trước.")
             else:
                 if use_ai:
-                    ai.api_key = st.session_state.api_key.strip()
-                    prompt = _prompt_from_matrix(st.session_state.matrix_df, subject, grade, term)
-                    stt = ai.generate(prompt)
-                    if stt.ok:
-                        st.session_state.tab1_exam_text = stt.message
-                        st.success(f"Đã sinh đề bằng: {stt.used_model}")
-                    else:
-                        st.error(stt.message)
+                    st.session_state.tab1_job = _submit_job(ai, "exam_text", f"Đề {subject} lớp {grade} từ ma trận",
+                                                            {"prompt": prompt})
+                    _rerun_app(("info", "Đang sinh đề ở chế độ nền; có thể làm việc khác trong lúc chờ."))
                 else:
                     st.session_state.tab1_exam_text = "Chế độ không AI: Tab 1 hiện chỉ hiển thị ma trận. Bạn có thể dùng Tab 2 để soạn câu và Tab 3 để xuất."
-        if st.session_state.tab1_exam_text:
+        if st.session_state.tab1_job:
+            job = default_queue().get(st.session_state.tab1_job)
+            st.fragment(run_every=STREAM_POLL_S if job is not None and job.active else None)(_tab1_job_view)()
+        elif st.session_state.tab1_exam_text:
             st.text_area("Đề (có thể sửa)", value=st.session_state.tab1_exam_text, height=420)
 
-def _prompt_from_matrix(df, subject: str, grade: str, term: str) -> str:
-    # Chỉ gửi 200 dòng đầu để tránh prompt quá dài
-    sample = df.head(200).to_csv(index=False)
-    return f"""Đóng vai giáo viên Tiểu học theo CT GDPT 2018 và TT27.
-Hãy tạo đề kiểm tra {term} môn {subject} lớp {grade} dựa trên MA TRẬN bên dưới (CSV).
-- Bám sát số câu, mức độ, điểm theo ma trận.
-- Đa dạng dạng câu hỏi: Trắc nghiệm 4 lựa chọn, Đúng/Sai, Ghép nối, Điền khuyết, Tự luận (tuỳ nội dung).
-- Xuất đúng định dạng:
-Câu [n] ([điểm] đ) - [Mức 1/2/3]: ...
-Nếu là trắc nghiệm: A. ...\nB. ...\nC. ...\nD. ...\nĐáp án: ...
-Nếu là đúng/sai: liệt kê mệnh đề a/b/c..., ghi đáp án cuối.
-Nếu là nối cột: Cột A (1..), Cột B (a..), Đáp án: 1-b, ...
-Nếu là điền khuyết: dùng '........' để chừa chỗ trống; Đáp án: ...
-KHÔNG viết lời dẫn dài.
-
-MA TRẬN (CSV):
-{sample}
-"""
+        norm: Optional[NormalizedMatrix] = st.session_state.matrix_norm
+        if use_ai and norm is not None and norm.cells:
+            _tab1_plan_exam(ai, db, norm, subject, grade)
 
+def _tab1_plan_exam(ai: GeminiClient, db: Optional[CurriculumDB], norm: NormalizedMatrix, subject: str, grade: str):
+    """Sinh từng ô ma trận thành câu hỏi có cấu trúc, ghi thẳng vào danh sách câu của Tab 3."""
+    st.divider()
+    retry: List[GenerationJob] = st.session_state.tab1_failed_jobs
+    rows = _matrix_rows()
+    # đề ở Tab 3 đã có câu thuộc ma trận -> chỉ sinh bù phần còn thiếu của từng ô
+    partial = rows is not None and any(r.have_count for r in rows if r.want_count)
+    jobs = retry or plan_jobs(missing_matrix(rows) if partial else norm, subject, grade, db)  # type: ignore[arg-type]
+    if not jobs:
+        st.caption("Đề ở Tab 3 đã đủ số câu theo ma trận.")
+        return
+    n_questions = sum(len(j.specs) for j in jobs)
+    label = ("🔁 Sinh lại các ô lỗi" if retry else
+             "🧩 Sinh bù các câu còn thiếu → Tab 3" if partial else "🧩 Sinh theo từng ô ma trận → Tab 3")
+    st.caption(f"{len(jobs)} ô ma trận, {n_questions} câu; các ô chạy song song, ô lỗi không ảnh hưởng ô khác.")
+    if not st.button(label, use_container_width=True):
+        return
+    _submit_job(ai, "plan", f"{n_questions} câu theo ma trận {subject} lớp {grade}",
+                {"jobs": jobs_to_payload(jobs), "avoid_texts": _avoid_texts()})
+    st.session_state.tab1_failed_jobs = []
+    _rerun_app(("info", f"Đang sinh {n_questions} câu ở chế độ nền; theo dõi tiến độ ở Sidebar."))
+
+def _tab1_job_view():
+    """Hiện dần đề khi việc nền đang sinh; Dừng sẽ huỷ việc và giữ phần đã có."""
+    job = default_queue().get(st.session_state.tab1_job) if st.session_state.tab1_job else None
+    if job is None:
+        return
+    text = str((job.result or {}).get("text", ""))
+    if job.active:
+        st.progress(min(max(job.progress, 0.0), 1.0), text=f"{_JOB_STATUS[job.status]} {job.message}")
+        if st.button("⏹ Dừng sinh", key="t1_stop"):
+            default_queue().cancel(job.id)
+        st.text(text)
+        return
+    if job.status != "done":
+        # đã dừng / lỗi: giữ phần đã nhận để GV sửa tiếp
+        if default_queue().mark_collected(job.id):
+            st.session_state.tab1_exam_text = text
+        st.session_state.tab1_job = None
+        _rerun_app(("warning", f"{job.title}: {job.message}"))
+    # xong: bảng việc nền sẽ nhận kết quả và chạy lại app
+
+@st.fragment
+@_timed_ui("ui.tab2")
 def tab2_build_question(ai: GeminiClient, db: CurriculumDB):
     st.subheader("Tab 2 — Soạn từng câu (tự động lấy Chủ đề/Bài/YCCĐ)")
     st.caption("Chọn Lớp/Môn → chọn Chủ đề → chọn Bài/Nội dung → YCCĐ tự đổ ra. GV chỉ cần chọn dạng/mức/điểm và bấm tạo.")
@@ -131,19 +410,45 @@ def tab2_build_question(ai: GeminiClient, db: CurriculumDB):
             q_types.append("Thực hành trên máy tính")
         q_type = st.selectbox("Dạng câu hỏi", q_types, key="t2_type")
         level = st.selectbox("Mức độ", LEVELS, key="t2_level")
+        _matrix_hint(topic, level)
         points = st.number_input("Điểm", min_value=0.25, max_value=10.0, value=1.0, step=0.25, key="t2_points")
         use_ai = st.checkbox("Dùng AI gợi ý nội dung câu hỏi", value=st.session_state.ai_enabled)
 
         if st.button("➕ Thêm câu vào Tab 3", type="primary", use_container_width=True):
             # Tạo nội dung
             content = ""
+            answer = ""
+            notes: List[Tuple[str, str]] = []
             if use_ai:
                 ai.api_key = st.session_state.api_key.strip()
-                prompt = _prompt_one_question(subject, grade, topic, lesson, yccd_input, q_type, level, points)
-                stt = ai.generate(prompt)
-                if stt.ok:
-                    content = stt.message
-                    st.success(f"AI OK ({stt.used_model})")
+                prompt = question_prompt(subject, grade, topic, lesson, yccd_input, q_type, level, points)
+                # câu vận dụng cần model mạnh; câu Biết/Hiểu dùng model nhanh, rẻ
+                opts = {**_ai_options(), "task": "strong" if level == LEVELS[2] else "fast"}
+                indexes = _dup_indexes()
+                dup = None
+                bad: List[ValidationIssue] = []
+                good = None  # (stt, câu) của lần sinh thành công gần nhất, dù còn trùng/sai định dạng
+                for attempt in range(2):
+                    if attempt and "seed" in opts:
+                        opts = {**opts, "seed": int(opts["seed"]) + attempt}  # đổi seed để không lấy lại câu lỗi trong cache
+                    stt = ai.generate(prompt, **opts)
+                    if not stt.ok:
+                        break  # lần sinh lại lỗi (429, hết giờ...) -> giữ câu của lần trước nếu có
+                    # tách dòng "Đáp án:" ra trường answer, kiểm tra định dạng theo dạng câu
+                    parsed = normalize_question({"type": q_type, "content": stt.message})
+                    bad = [i for i in validate_question_format(parsed) if i.level == "error"]
+                    dup = first_duplicate(str(parsed["content"]), indexes)
+                    good = (stt, parsed)
+                    if dup is None and not bad:
+                        break
+                if good is not None:
+                    stt, parsed = good
+                    content, answer = str(parsed["content"]), str(parsed["answer"])
+                    notes.append(("info", f"AI OK ({_ai_source(stt)})"))
+                    if dup is not None:
+                        where = f"câu {int(dup[1]) + 1} trong đề" if dup[0] == 0 else f"câu #{dup[1]} trong ngân hàng"
+                        notes.append(("warning", f"Câu sinh ra gần trùng {where} (giống {dup[2]:.0%}) dù đã sinh lại. Hãy sửa ở Tab 3 nếu cần."))
+                    notes.extend(("warning", f"Định dạng chưa chuẩn: {i.message} Hãy sửa ở Tab 3.") for i in bad)
                 else:
                     st.warning("AI lỗi → chuyển sang chế độ nhập tay. " + stt.message)
             if not content:
@@ -159,35 +464,216 @@ def tab2_build_question(ai: GeminiClient, db: CurriculumDB):
                 "level": level,
                 "points": float(points),
                 "content": content.strip(),
-                "answer": "",  # GV có thể nhập ở Tab 3 nếu muốn
+                "answer": answer,  # tách từ dòng "Đáp án:" của AI; GV có thể sửa ở Tab 3
             }
             issues = validate_question_schema(q)
             fatal = any(i.level == "error" for i in issues)
             if fatal:
+                for kind, msg in notes:
+                    (st.warning if kind == "warning" else st.info)(msg)
                 for i in issues:
                     (st.error if i.level == "error" else st.warning)(i.message)
             else:
                 st.session_state.questions.append(q)
-                st.success(f"Đã thêm: {subject} lớp {grade} — {lesson}")
-
-def _prompt_one_question(subject, grade, topic, lesson, yccd, q_type, level, points) -> str:
-    return f"""Đóng vai giáo viên Tiểu học theo CT GDPT 2018 và TT27.
-Soạn 1 câu hỏi kiểm tra môn {subject} lớp {grade}.
-- Chủ đề: {topic}
-- Bài/Nội dung: {lesson}
-- YCCĐ: {yccd}
-- Dạng: {q_type}; Mức: {level}; Điểm: {points}
-
-YÊU CẦU ĐỊNH DẠNG:
-- Trắc nghiệm: 4 lựa chọn A/B/C/D mỗi lựa chọn 1 dòng, cuối ghi 'Đáp án: X'
-- Đúng/Sai: viết 3-4 mệnh đề a/b/c..., cuối ghi 'Đáp án: a-Đ, b-S, ...'
-- Ghép nối: Cột A (1..), Cột B (a..), cuối ghi 'Đáp án: 1-b, 2-a,...'
-- Điền khuyết: chừa chỗ trống bằng '........', cuối ghi 'Đáp án: ...'
-- Tự luận: nêu yêu cầu rõ, có gợi ý đáp án ngắn cuối.
-
-CHỈ TRẢ VỀ NỘI DUNG CÂU HỎI + DÒNG ĐÁP ÁN. Không viết lời dẫn.
-"""
+                _rerun_app(*notes, ("success", f"Đã thêm: {subject} lớp {grade} — {lesson}"))
+
+        if st.button("🗂️ Đưa vào danh sách sinh hàng loạt", use_container_width=True):
+            st.session_state.t2_batch_specs.append(QuestionSpec(
+                subject=subject, grade=grade, topic=topic, lesson=lesson, yccd=yccd_input,
+                q_type=q_type, level=level, points=float(points),
+            ))
+
+    _tab2_batch(ai)
+    _tab2_bank(subject, grade, topic, level)
+
+def _tab2_batch(ai: GeminiClient):
+    specs: List[QuestionSpec] = st.session_state.t2_batch_specs
+    if not specs:
+        return
+    st.divider()
+    st.markdown(f"**Danh sách chờ sinh hàng loạt ({len(specs)} câu)** — AI soạn nhiều câu trong một lần gọi.")
+    st.dataframe(
+        [{"Bài": s.lesson, "Dạng": s.q_type, "Mức": s.level, "Điểm": s.points} for s in specs],
+        use_container_width=True, hide_index=True,
+    )
+    c1, c2 = st.columns(2)
+    if c2.button("🧹 Xoá danh sách chờ", use_container_width=True):
+        st.session_state.t2_batch_specs = []
+        _rerun_fragment()
+    if c1.button("⚡ Sinh hàng loạt", type="primary", use_container_width=True):
+        if not st.session_state.ai_enabled:
+            st.error("Cần bật AI (Kiểm tra API ở Sidebar) để sinh hàng loạt.")
+            return
+        _submit_job(ai, "batch", f"Sinh hàng loạt {len(specs)} câu",
+                    {"specs": specs_to_payload(specs), "avoid_texts": _avoid_texts()})
+        # câu lỗi sẽ được trả lại danh sách chờ khi việc xong
+        st.session_state.t2_batch_specs = []
+        _rerun_app(("info", f"Đang sinh {len(specs)} câu ở chế độ nền; theo dõi tiến độ ở Sidebar."))
+
+def _tab2_bank(subject: str, grade: str, topic: str, level: str):
+    """Lấy câu đã lưu trong ngân hàng (không tốn lượt gọi AI)."""
+    with st.expander("📚 Chọn từ ngân hàng câu hỏi"):
+        bank = default_bank()
+        c1, c2 = st.columns([2, 1])
+        text = c1.text_input("Tìm trong nội dung (không cần gõ dấu)", value="", key="t2_bank_text")
+        scope = c2.selectbox("Phạm vi", ["Chủ đề + mức đang chọn", "Chủ đề đang chọn", "Cả môn/lớp"], key="t2_bank_scope")
+        hits: List[BankHit] = bank.search(
+            subject=subject, grade=grade,
+            topic=topic if scope != "Cả môn/lớp" else None,
+            level=level if scope == "Chủ đề + mức đang chọn" else None,
+            text=text, limit=50,
+        )
+        st.caption(f"Ngân hàng có {bank.count()} câu; tìm thấy {len(hits)} câu phù hợp (ưu tiên câu ít dùng).")
+        if not hits:
+            return
+        labels = {h.id: f"#{h.id} · {h.question['level']} · {h.question['type']} · {str(h.question['content'])[:80]}" for h in hits}
+        picked = st.multiselect("Chọn câu", list(labels), format_func=lambda i: labels[i], key="t2_bank_pick")
+        if st.button("➕ Thêm câu đã chọn vào Tab 3", disabled=not picked, key="t2_bank_add"):
+            by_id = {h.id: h for h in hits}
+            st.session_state.questions.extend(dict(by_id[i].question) for i in picked)
+            bank.mark_used(picked)
+            _rerun_app(("success", f"Đã thêm {len(picked)} câu từ ngân hàng."))
 
+def _matrix_rows() -> Optional[List[CellStatus]]:
+    """Đối chiếu danh sách câu hiện tại với ma trận đã đọc ở Tab 1 (None nếu chưa có ma trận nhận dạng được)."""
+    tracker: ConformanceTracker = st.session_state.conformance
+    tracker.sync(st.session_state.questions)
+    norm: Optional[NormalizedMatrix] = st.session_state.matrix_norm
+    if norm is None or not norm.cells:
+        return None
+    return tracker.diff(norm)
+
+def _matrix_hint(topic: str, level: str):
+    """Tab 2: ô ma trận ứng với Chủ đề × Mức đang chọn còn cần bao nhiêu câu."""
+    rows = _matrix_rows()
+    if not rows:
+        return
+    key = cell_key(topic, level, "")[:2]
+    for r in rows:
+        if r.want_count and cell_key(r.topic, r.level, "")[:2] == key:
+            st.caption(f"Ma trận{' (' + r.q_type + ')' if r.q_type else ''}: cần {r.want_count} câu / {r.want_points:g} điểm, "
+                       f"đề đã có {r.have_count} câu / {r.have_points:g} điểm.")
+
+_STATE_ICON = {"đủ": "✅", "thiếu": "🔻", "thừa": "🔺", "lệch điểm": "⚖️", "ngoài ma trận": "❔"}
+
+def _tab3_conformance(rows: List[CellStatus]):
+    n_ok = sum(r.ok for r in rows if r.want_count or r.want_points)
+    n_cells = sum(1 for r in rows if r.want_count or r.want_points)
+    with st.expander(f"📐 Đối chiếu ma trận: {n_ok}/{n_cells} ô đủ"):
+        only_bad = st.checkbox("Chỉ hiện ô chưa khớp", value=n_ok < n_cells, key="t3_conf_bad")
+        st.dataframe([{
+            "Trạng thái": f"{_STATE_ICON[r.state]} {r.state}", "Chủ đề": r.topic, "Mức": r.level, "Dạng": r.q_type or "(mọi dạng)",
+            "Số câu": f"{r.have_count}/{r.want_count}", "Điểm": f"{r.have_points:g}/{r.want_points:g}",
+        } for r in rows if not (only_bad and r.ok)], use_container_width=True, hide_index=True)
+        st.caption("Số câu, điểm: đã có/ma trận cần. Ô thiếu có thể sinh bù ở Tab 1.")
+
+_GRID_COLS = {"Điểm": "points", "Dạng": "type", "Mức": "level", "Nội dung": "content", "Đáp án": "answer"}
+
+# Tab 1/Tab 2 đọc số câu và Chủ đề/Mức/Dạng/Điểm (đối chiếu ma trận); sửa nội dung/đáp án chỉ ảnh hưởng Tab 3
+_SHARED_FIELDS = ("topic", "level", "type", "points")
+
+def _shared(q: Dict[str, object]) -> Tuple[object, ...]:
+    return tuple(q.get(f) for f in _SHARED_FIELDS)
+
+def _rerun_after_edit(shared_changed: bool):
+    """Thêm/xoá câu hoặc đổi trường mà tab khác dùng -> chạy lại cả app; chỉ sửa nội dung -> chạy lại Tab 3."""
+    if shared_changed:
+        _rerun_app()
+    else:
+        _rerun_fragment()
+
+def _tab3_grid(qs: List[Dict[str, object]]):
+    """Sửa nhanh cả đề trong 1 bảng; mọi thay đổi (kể cả xoá/thêm dòng) chỉ áp dụng khi bấm nút."""
+    st.markdown("**Chỉnh nhanh (bảng):** sửa trực tiếp trong ô, chọn dòng rồi bấm 🗑 để xoá, cuối cùng bấm *Áp dụng*.")
+    df = pd.DataFrame([{
+        "_i": i,
+        "Bài": str(q.get("lesson", "")),
+        **{col: q.get(field, "") for col, field in _GRID_COLS.items()},
+        "Kiểm tra": "; ".join(it.message for it in validate_question_format(q)),
+    } for i, q in enumerate(qs)])
+    df["Điểm"] = pd.to_numeric(df["Điểm"], errors="coerce")
+    with st.form("t3_grid_form", border=False):
+        edited = st.data_editor(
+            df,
+            key=f"t3_grid_{st.session_state.t3_ver}",
+            num_rows="dynamic",
+            hide_index=True,
+            use_container_width=True,
+            column_order=["Bài", *_GRID_COLS, "Kiểm tra"],
+            column_config={
+                "_i": None,
+                "Bài": st.column_config.TextColumn(disabled=True),
+                "Điểm": st.column_config.NumberColumn(min_value=0.0, max_value=10.0, step=0.25, format="%g"),
+                "Dạng": st.column_config.SelectboxColumn(options=ALLOWED_TYPES),
+                "Mức": st.column_config.SelectboxColumn(options=LEVELS),
+                "Nội dung": st.column_config.TextColumn(width="large"),
+                "Kiểm tra": st.column_config.TextColumn(disabled=True),
+            },
+        )
+        if not st.form_submit_button("✅ Áp dụng thay đổi trong bảng", use_container_width=True):
+            return
+    template = {k: qs[0].get(k, "") for k in ("subject", "grade", "topic", "lesson", "yccd")}
+    before = [_shared(q) for q in qs]
+    new_qs: List[Dict[str, object]] = []
+    for r in edited.to_dict("records"):
+        i = r.get("_i")
+        is_new = i is None or pd.isna(i)
+        # sửa thẳng câu cũ (giữ nguyên đối tượng) -> bộ đối chiếu ma trận chỉ tính lại câu thực sự đổi
+        q = dict(template) if is_new else qs[int(i)]
+        for col, field in _GRID_COLS.items():
+            v = r.get(col)
+            blank = v is None or (isinstance(v, float) and pd.isna(v))
+            if field != "points":
+                q[field] = "" if blank else str(v).strip()
+            elif not blank:
+                q[field] = float(v)  # giữ cả 0 -> kiểm tra tổng điểm sẽ báo
+            elif is_new:
+                q[field] = 1.0
+            # ô điểm bị xoá trống ở câu cũ: giữ điểm cũ
+        if is_new and not q["content"]:
+            continue  # dòng thêm nhưng chưa nhập nội dung
+        new_qs.append(q)
+    shared_changed = len(new_qs) != len(qs) or any(old != _shared(q) for old, q in zip(before, new_qs))
+    st.session_state.questions = new_qs
+    st.session_state.t3_ver += 1
+    _rerun_after_edit(shared_changed)
+
+def _tab3_detail(qs: List[Dict[str, object]]):
+    """Sửa kỹ 1 câu (nội dung nhiều dòng) — chỉ dựng ô sửa cho câu đang chọn."""
+    with st.expander("📝 Sửa chi tiết 1 câu"):
+        idx = st.selectbox("Câu", range(len(qs)), key="t3_pick",
+                           format_func=lambda i: f"Câu {i + 1}: {str(qs[i].get('content', ''))[:70]}")
+        if idx is None or idx >= len(qs):
+            return
+        q = qs[idx]
+        k = f"{st.session_state.t3_ver}_{idx}"
+        st.caption(f"{q.get('subject')} lớp {q.get('grade')} — {q.get('lesson')}")
+        for it in validate_question_format(q):
+            st.caption(f"⚠️ {it.message}")
+        with st.form("t3_detail_form", border=False):
+            c1, c2, c3 = st.columns([1, 2, 2])
+            points = c1.number_input("Điểm", 0.25, 10.0, float(q.get("points", 1.0)), 0.25, key=f"t3_pt_{k}")
+            q_type = c2.text_input("Dạng", value=str(q.get("type", "")), key=f"t3_ty_{k}")
+            level = c3.text_input("Mức", value=str(q.get("level", "")), key=f"t3_lv_{k}")
+            content = st.text_area("Nội dung", value=str(q.get("content", "")), height=200, key=f"t3_ct_{k}")
+            answer = st.text_input("Đáp án (tùy chọn)", value=str(q.get("answer", "")), key=f"t3_an_{k}")
+            b1, b2 = st.columns(2)
+            save = b1.form_submit_button("💾 Lưu câu này", type="primary", use_container_width=True)
+            delete = b2.form_submit_button("🗑️ Xóa câu này", use_container_width=True)
+        if save:
+            before = _shared(q)
+            q.update(points=float(points), type=q_type, level=level, content=content.strip(), answer=answer.strip())
+            shared_changed = _shared(q) != before
+        elif delete:
+            qs.pop(idx)
+            shared_changed = True
+        else:
+            return
+        st.session_state.t3_ver += 1
+        _rerun_after_edit(shared_changed)
+
+@st.fragment
+@_timed_ui("ui.tab3")
 def tab3_review_export():
     st.subheader("Tab 3 — Danh sách câu & Xuất Word")
     qs: List[Dict[str, object]] = st.session_state.questions
@@ -196,28 +682,24 @@ def tab3_review_export():
         st.info("Chưa có câu hỏi nào. Hãy tạo ở Tab 2 hoặc sinh ở Tab 1.")
         return
 
-    # Kiểm tra tổng điểm
-    issues = validate_points_sum(qs, expected_total=10.0)
+    # Kiểm tra tổng điểm (theo ma trận nếu đã đọc ma trận ở Tab 1)
+    rows = _matrix_rows()
+    norm: Optional[NormalizedMatrix] = st.session_state.matrix_norm
+    expected = norm.total_points if rows is not None and norm is not None and norm.total_points else EXPECTED_TOTAL
+    issues = st.session_state.conformance.points_issues(expected) + validate_no_duplicates(qs)
     for it in issues:
         (st.warning if it.level == "warning" else st.error)(it.message)
+    if rows is not None:
+        _tab3_conformance(rows)
 
-    st.markdown("**Chỉnh nhanh:**")
-    for idx, q in enumerate(qs):
-        with st.expander(f"Câu {idx+1}: {q.get('subject')} lớp {q.get('grade')} — {q.get('lesson')}", expanded=False):
-            q["points"] = st.number_input("Điểm", 0.25, 10.0, float(q.get("points",1.0)), 0.25, key=f"t3_pt_{idx}")
-            q["type"] = st.text_input("Dạng", value=str(q.get("type","")), key=f"t3_ty_{idx}")
-            q["level"] = st.text_input("Mức", value=str(q.get("level","")), key=f"t3_lv_{idx}")
-            q["content"] = st.text_area("Nội dung", value=str(q.get("content","")), height=140, key=f"t3_ct_{idx}")
-            q["answer"] = st.text_input("Đáp án (tùy chọn)", value=str(q.get("answer","")), key=f"t3_an_{idx}")
-            if st.button("🗑️ Xóa câu này", key=f"t3_del_{idx}"):
-                st.session_state.questions.pop(idx)
-                st.rerun()
+    _tab3_grid(qs)
+    _tab3_detail(qs)
 
     st.divider()
     col1, col2 = st.columns(2)
     with col1:
         school = st.text_input("Trường", value="")
-        title = st.text_input("Tiêu đề", value="ĐỀ KIỂM TRA CUỐI HỌC KÌ")
+        title = st.text_input("Tiêu đề", value=DEFAULT_TITLE)
         term = st.text_input("Kì", value="Học kì I")
     with col2:
         subject = st.text_input("Môn (hiển thị)", value=str(qs[0].get("subject","")))
@@ -225,13 +707,24 @@ def tab3_review_export():
         include_ans = st.checkbox("Kèm trang đáp án", value=True)
 
     if st.button("📄 Xuất Word", type="primary", use_container_width=True):
-        meta = {
-            "school": school,
-            "title": title,
-            "term": term,
-            "subject": subject,
-            "grade": grade,
-            "subtitle": "",
-        }
-        data = export_exam_docx(meta, qs, include_answer_key=include_ans)
-        st.download_button("Tải file .docx", data, file_name=f"De_{subject}_lop{grade}.docx", mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+        data = export_exam_docx(exam_meta(subject, grade, school, title, term), qs, include_answer_key=include_ans)
+        st.download_button("Tải file .docx", data, file_name=f"{exam_file_stem(subject, grade)}.docx", mime=DOCX_MIME)
+
+    if st.button("💾 Lưu các câu vào ngân hàng", use_container_width=True, help="Lưu câu đã duyệt để lần sau chọn lại ở Tab 2 thay vì sinh bằng AI."):
+        added = default_bank().add_many(qs)
+        st.success(f"Đã lưu {added} câu mới ({len(qs) - added} câu đã có sẵn trong ngân hàng).")
+
+    with st.expander("📦 Xuất nhiều mã đề (ZIP)"):
+        c1, c2, c3 = st.columns(3)
+        n_variants = c1.number_input("Số mã đề", min_value=1, max_value=26, value=4, step=1, key="t3_nvar")
+        seed = c2.number_input("Seed trộn đề", min_value=0, value=2024, step=1, key="t3_seed",
+                               help="Cùng seed -> cùng cách trộn ở mỗi mã đề (xuất lại được y hệt).")
+        key_mode = c3.selectbox("Đáp án", list(ANSWER_KEY_MODES), key="t3_keymode")
+        shuffle_opts = st.checkbox("Đảo cả lựa chọn A/B/C/D, cột B (nối cột), mệnh đề Đúng/Sai", value=True, key="t3_shuffle_opts")
+        keep_first = st.checkbox("Mã đề A giữ nguyên đề gốc", value=True, key="t3_keep_first")
+        if st.button("📦 Tạo file ZIP", use_container_width=True):
+            stem = exam_file_stem(subject, grade)
+            variants = make_variants(qs, int(n_variants), int(seed), keep_first=keep_first, options=shuffle_opts)
+            data = export_variants_zip(exam_meta(subject, grade, school, title, term), variants,
+                                       answer_key=ANSWER_KEY_MODES[key_mode], file_prefix=stem)
+            st.download_button("Tải file .zip", data, file_name=f"{stem}_{int(n_variants)}_ma.zip", mime="application/zip")
@@ -4,6 +4,9 @@ from __future__ import annotations
 from dataclasses import dataclass
 from typing import Dict, List, Optional, Tuple
 
+from .question_format import parse_question
+from .similarity import find_duplicates
+
 ALLOWED_LEVELS = ["Mức 1: Biết", "Mức 2: Hiểu", "Mức 3: Vận dụng"]
 ALLOWED_TYPES = [
     "Trắc nghiệm (4 lựa chọn)",
@@ -19,18 +22,26 @@ class ValidationIssue:
     level: str  # "error" | "warning"
     message: str
 
-def validate_points_sum(questions: List[Dict[str, object]], expected_total: float = 10.0) -> List[ValidationIssue]:
-    s = 0.0
-    for q in questions:
-        try:
-            s += float(q.get("points", 0.0))
-        except Exception:
-            return [ValidationIssue("error", "Có câu hỏi có điểm không hợp lệ (không phải số).")]
+def validate_points_total(total: float, expected_total: float = 10.0, invalid: int = 0) -> List[ValidationIssue]:
+    """Kiểm tra tổng điểm đã cộng sẵn (xem ConformanceTracker); `invalid` = số câu có điểm không phải số."""
+    if invalid:
+        return [ValidationIssue("error", "Có câu hỏi có điểm không hợp lệ (không phải số).")]
     # tránh lỗi float
-    if abs(s - expected_total) > 1e-6:
-        return [ValidationIssue("warning", f"Tổng điểm hiện tại = {s:g}, chưa bằng {expected_total:g}. Bạn có thể điều chỉnh trước khi xuất.")]
+    if abs(total - expected_total) > 1e-6:
+        return [ValidationIssue("warning", f"Tổng điểm hiện tại = {total:g}, chưa bằng {expected_total:g}. Bạn có thể điều chỉnh trước khi xuất.")]
     return []
 
+def validate_no_duplicates(questions: List[Dict[str, object]]) -> List[ValidationIssue]:
+    return [
+        ValidationIssue("warning", f"Câu {i + 1} gần trùng câu {j + 1} (giống {score:.0%}). Nên sửa hoặc xoá bớt.")
+        for i, j, score in find_duplicates(questions)
+    ]
+
+def validate_question_format(q: Dict[str, object]) -> List[ValidationIssue]:
+    """Kiểm tra cấu trúc theo dạng câu (đủ 4 lựa chọn, đáp án có trong lựa chọn, số chỗ trống = số ý đáp án...)."""
+    p = parse_question(q)
+    return [ValidationIssue("error", m) for m in p.errors] + [ValidationIssue("warning", m) for m in p.warnings]
+
 def validate_question_schema(q: Dict[str, object]) -> List[ValidationIssue]:
     issues: List[ValidationIssue] = []
     if not str(q.get("content","")).strip():
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Tạo nhiều mã đề từ 1 đề: đảo câu, đảo lựa chọn A/B/C/D, đảo cột B (nối cột), đảo mệnh đề Đúng/Sai.
+
+Không gọi AI; cùng seed luôn cho cùng kết quả. Dòng "Đáp án" (trong nội dung và trường answer)
+được đánh lại theo thứ tự mới.
+"""
+from __future__ import annotations
+
+import random
+import re
+from typing import Callable, Dict, List, Tuple
+
+from .question_format import COL_B as _COL_B
+from .question_format import LOWER_LINE as _LOWER_LINE
+from .question_format import MC_LINE as _MC_LINE
+from .question_format import split_inline_options
+
+_ANSWER_LINE = re.compile(r"^\s*Đáp án\s*:", re.I)
+
+Question = Dict[str, object]
+
+def _labels(first: str, n: int) -> List[str]:
+    return [chr(ord(first) + i) for i in range(n)]
+
+def _shuffle_block(lines: List[str], idx: List[int], pattern: "re.Pattern[str]", rng: random.Random,
+                   first: str) -> Dict[str, str]:
+    """Đảo các dòng có nhãn tại vị trí idx, gán lại nhãn theo thứ tự; trả về ánh xạ nhãn cũ -> nhãn mới."""
+    items = []
+    for i in idx:
+        m = pattern.match(lines[i])
+        assert m is not None
+        items.append((m.group(1), m.group(2)))
+    order = list(range(len(items)))
+    rng.shuffle(order)
+    new_labels = _labels(first, len(items))
+    mapping: Dict[str, str] = {}
+    for pos, k in enumerate(order):
+        old, text = items[k]
+        mapping[old] = new_labels[pos]
+        sep = "." if first.isupper() else ")"
+        lines[idx[pos]] = f"{new_labels[pos]}{sep} {text}"
+    return mapping
+
+def _remap_mc(ans: str, mapping: Dict[str, str]) -> str:
+    return re.sub(r"^(\s*(?:(?i:Đáp án)\s*:\s*)?)([A-D])\b", lambda m: m.group(1) + mapping.get(m.group(2), m.group(2)), ans)
+
+def _remap_pairs(ans: str, mapping: Dict[str, str]) -> str:
+    # "1-b, 2-a" (nối cột)
+    return re.sub(r"(\d+\s*[-–→]\s*)([a-h])\b", lambda m: m.group(1) + mapping.get(m.group(2), m.group(2)), ans)
+
+def _remap_truefalse(ans: str, mapping: Dict[str, str]) -> str:
+    # "a-Đ, b-S" -> đổi nhãn rồi sắp lại theo nhãn mới
+    pairs = re.findall(r"\b([a-h])\s*[-–:]\s*(Đúng|Sai|Đ|S)\b", ans)
+    if not pairs:
+        return ans
+    prefix = "Đáp án: " if _ANSWER_LINE.match(ans) else ""
+    remapped = sorted((mapping.get(k, k), v) for k, v in pairs)
+    return prefix + ", ".join(f"{k}-{v}" for k, v in remapped)
+
+def _apply(q: Question, lines: List[str], remap: Callable[[str, Dict[str, str]], str],
+           mapping: Dict[str, str]) -> Question:
+    lines = [remap(ln, mapping) if _ANSWER_LINE.match(ln) else ln for ln in lines]
+    out = dict(q)
+    out["content"] = "\n".join(lines)
+    if str(q.get("answer", "")).strip():
+        out["answer"] = remap(str(q["answer"]), mapping)
+    return out
+
+def shuffle_options(q: Question, rng: random.Random) -> Question:
+    """Đảo phần lựa chọn của 1 câu theo dạng câu; câu không nhận ra cấu trúc được giữ nguyên."""
+    q_type = str(q.get("type", ""))
+    lines = str(q.get("content", "")).split("\n")
+
+    if q_type.startswith("Trắc nghiệm"):
+        lines = split_inline_options(lines)
+        idx = [i for i, ln in enumerate(lines) if _MC_LINE.match(ln)]
+        if [_MC_LINE.match(lines[i]).group(1) for i in idx] != ["A", "B", "C", "D"]:  # type: ignore[union-attr]
+            return dict(q)
+        return _apply(q, lines, _remap_mc, _shuffle_block(lines, idx, _MC_LINE, rng, "A"))
+
+    if q_type.startswith("Ghép nối"):
+        start = next((i for i, ln in enumerate(lines) if _COL_B.match(ln)), None)
+        if start is None:
+            return dict(q)
+        idx: List[int] = []
+        for i in range(start + 1, len(lines)):
+            if _ANSWER_LINE.match(lines[i]):
+                break
+            if _LOWER_LINE.match(lines[i]):
+                idx.append(i)
+        if len(idx) < 2:
+            return dict(q)
+        return _apply(q, lines, _remap_pairs, _shuffle_block(lines, idx, _LOWER_LINE, rng, "a"))
+
+    if q_type.startswith("Đúng/Sai"):
+        idx = [i for i, ln in enumerate(lines) if _LOWER_LINE.match(ln) and not _ANSWER_LINE.match(ln)]
+        if len(idx) < 2:
+            return dict(q)
+        return _apply(q, lines, _remap_truefalse, _shuffle_block(lines, idx, _LOWER_LINE, rng, "a"))
+
+    return dict(q)
+
+def make_variant(questions: List[Question], seed: object, shuffle_questions: bool = True,
+                 options: bool = True) -> List[Question]:
+    rng = random.Random(str(seed))
+    out = [shuffle_options(q, rng) if options else dict(q) for q in questions]
+    if shuffle_questions:
+        rng.shuffle(out)
+    return out
+
+def make_variants(questions: List[Question], n: int, seed: int, keep_first: bool = True,
+                  shuffle_questions: bool = True, options: bool = True) -> List[Tuple[str, List[Question]]]:
+    """n mã đề A, B, C...; mỗi mã có seed riêng (seed:nhãn) nên thêm mã đề không làm đổi các mã cũ.
+
+    `keep_first=True` -> mã A giữ nguyên đề gốc.
+    """
+    out: List[Tuple[str, List[Question]]] = []
+    for label in _labels("A", n):
+        if keep_first and label == "A":
+            out.append((label, [dict(q) for q in questions]))
+        else:
+            out.append((label, make_variant(questions, f"{seed}:{label}", shuffle_questions, options)))
+    return out
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from modules.mock_backend import MockGenAI
+
+@pytest.fixture()
+def mock_ai() -> MockGenAI:
+    """Backend giả lập nhanh, không lỗi ngẫu nhiên (test tự bật lỗi khi cần)."""
+    return MockGenAI(latency_s=0.0, jitter_s=0.0, chars_per_s=0.0)
+
+@pytest.fixture(autouse=True)
+def _data_dir(tmp_path, monkeypatch):
+    # cache/ngân hàng/hàng đợi mặc định ghi vào thư mục tạm của từng test
+    monkeypatch.setenv("DEKIEMTRA_DATA_DIR", str(tmp_path / "data"))
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+from modules.ai_client import GeminiClient
+from modules.mock_backend import MockGenAI
+
+def _mock(**kw) -> MockGenAI:
+    return MockGenAI(**{"latency_s": 0.01, "jitter_s": 0.0, "chars_per_s": 0.0, **kw})
+
+def test_two_keys_concurrently_never_share_a_client():
+    mock = _mock()
+    mock.configure(api_key="X")  # client mặc định "toàn cục" của key khác: handle không được dùng tới
+    clients = {k: GeminiClient(api_key=k, backend=mock) for k in ("key-A", "key-B")}
+    results = {}
+
+    def run(key: str) -> None:
+        results[key] = clients[key].generate_many([f"{key} câu {i}" for i in range(12)], concurrency=6)
+
+    threads = [threading.Thread(target=run, args=(k,)) for k in clients]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert all(r.ok for rs in results.values() for r in rs)
+    assert mock.stats.calls_by_key == {"key-A": 12, "key-B": 12}
+    for key, client in clients.items():
+        sess = client._session()
+        assert sess.handles and all(h._client.api_key == key for h in sess.handles.values())
+    assert clients["key-A"]._session().client is not clients["key-B"]._session().client
+
+def test_hedged_loser_stops_and_returns_its_rate_limit_slot():
+    mock = _mock(latency_s=0.3)
+    ai = GeminiClient(api_key="k", backend=mock, rpm=2)  # 2 lượt/phút: hồi lượt không đáng kể trong lúc thử
+    res = ai._generate_hedged("Soạn 1 câu hỏi", hedge_after_s=0.05, task="fast")
+    assert res.ok and res.used_model == ai.route("Soạn 1 câu hỏi", task="fast")[0]
+    time.sleep(0.5)  # nhánh thua trả kết quả sau khi đã huỷ
+    assert mock.stats.calls == 2
+    assert ai._session().limiter.tokens >= 0.9
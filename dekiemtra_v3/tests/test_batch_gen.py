@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import json
+import re
+from typing import List
+
+from modules.ai_client import GeminiClient
+from modules.batch_gen import QuestionSpec, generate_batch
+from modules.mock_backend import MockGenAI
+from modules.response_cache import ResponseCache
+
+_SEED = re.compile(r"\s*\[seed:\d+\]\s*$")
+
+def _specs(n: int) -> List[QuestionSpec]:
+    types = ("Trắc nghiệm (4 lựa chọn)", "Đúng/Sai", "Tự luận", "Điền khuyết (Hoàn thành câu)")
+    return [QuestionSpec("Toán", "3", f"Chủ đề {i}", f"Bài {i}", "", types[i % len(types)], "Mức 1: Biết", 1.0)
+            for i in range(n)]
+
+def _ids(prompt: str) -> List[int]:
+    body = _SEED.sub("", prompt)
+    raw = body[body.index("YÊU CẦU:\n") + len("YÊU CẦU:\n"):]
+    return sorted(int(it["id"]) for it in json.loads(raw[:raw.rindex("]") + 1]))
+
+class _DropOnFirstCall(MockGenAI):
+    """Lần gọi đầu bỏ một số câu khỏi mảng JSON trả về, như khi model trả thiếu."""
+
+    def __init__(self, drop, **kw):
+        super().__init__(**kw)
+        self.drop = set(drop)
+        self.prompts: List[str] = []
+
+    def respond(self, prompt: str, rng) -> str:
+        text = super().respond(prompt, rng)
+        with self._lock:
+            first = not self.prompts
+            self.prompts.append(prompt)
+        if not first:
+            return text
+        items = json.loads(text[text.index("["):text.rindex("]") + 1])
+        return json.dumps([it for it in items if it["id"] not in self.drop], ensure_ascii=False)
+
+def test_retry_asks_only_for_the_failed_items():
+    mock = _DropOnFirstCall({1, 3}, latency_s=0.0, jitter_s=0.0, chars_per_s=0.0)
+    ai = GeminiClient(api_key="batch-retry", backend=mock)
+    res = generate_batch(ai, _specs(5), max_retries=1)
+
+    assert [_ids(p) for p in mock.prompts] == [[0, 1, 2, 3, 4], [1, 3]]
+    assert res.failed == [] and res.calls == 2
+    assert all(q is not None for q in res.questions)
+    assert [q["topic"] for q in res.questions] == [f"Chủ đề {i}" for i in range(5)]
+
+def test_items_still_missing_after_the_last_retry_are_reported():
+    mock = _DropOnFirstCall({2}, latency_s=0.0, jitter_s=0.0, chars_per_s=0.0)
+    res = generate_batch(GeminiClient(api_key="batch-noretry", backend=mock), _specs(3), max_retries=0)
+    assert res.failed == [2] and res.questions[2] is None and res.questions[0] is not None
+
+def test_cache_hit_vs_forced_fresh(mock_ai, tmp_path):
+    ai = GeminiClient(api_key="batch-cache", backend=mock_ai)
+    cache = ResponseCache(tmp_path / "cache.sqlite3")
+    specs = _specs(4)
+
+    first = generate_batch(ai, specs, seed=7, cache=cache)
+    calls = mock_ai.stats.calls
+    again = generate_batch(ai, specs, seed=7, cache=cache)
+    assert again.calls == 0 and mock_ai.stats.calls == calls  # lấy từ cache, không gọi AI
+    assert again.questions == first.questions
+
+    fresh = generate_batch(ai, specs, seed=None, cache=cache)  # "không dùng cache": luôn gọi lại
+    assert fresh.calls == 1 and mock_ai.stats.calls == calls + 1
+
+    other_seed = generate_batch(ai, specs, seed=8, cache=cache)
+    assert other_seed.calls == 1 and other_seed.questions != first.questions
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from modules.conformance import ConformanceTracker, cell_key, missing_matrix
+from modules.matrix_normalizer import MatrixCell, NormalizedMatrix
+
+NORM = NormalizedMatrix(cells=[
+    MatrixCell("Số học", "Mức 1: Biết", "Trắc nghiệm (4 lựa chọn)", 2, 2.0),
+    MatrixCell("Hình học", "Mức 2: Hiểu", "", 1, 3.0),
+], layout="long")
+
+def _q(topic: str, level: str, q_type: str, points: float):
+    return {"topic": topic, "level": level, "type": q_type, "points": points, "content": "..."}
+
+def test_cell_key_folds_spelling_variants():
+    assert cell_key("Số học", "M1", "TN") == cell_key("so hoc", "Mức 1: Biết", "Trắc nghiệm (4 lựa chọn)")
+
+def test_totals_follow_an_edited_cell():
+    qs = [_q("Số học", "Mức 1", "TN", 1.0), _q("Số học", "M1", "Trắc nghiệm", 1.0), _q("Hình học", "Mức 2", "Tự luận", 3.0)]
+    tr = ConformanceTracker()
+    assert tr.sync(qs) == 3
+    assert [r.state for r in tr.diff(NORM)] == ["đủ", "đủ"]
+    assert tr.points_issues(NORM.total_points) == []
+
+    qs[1]["level"] = "Mức 2"  # sửa 1 ô trong bảng: chỉ câu đó được tính lại
+    assert tr.sync(qs) == 1
+    rows = tr.diff(NORM)
+    assert [(r.state, r.have_count) for r in rows] == [("thiếu", 1), ("đủ", 1), ("ngoài ma trận", 1)]
+    assert tr.total_count == 3 and tr.total_points == 5.0
+
+    qs[1]["points"] = "abc"  # điểm không phải số: tính 0 điểm và bị báo
+    tr.sync(qs)
+    assert tr.bad_points == 1 and tr.total_points == 4.0 and any(i.level == "error" for i in tr.points_issues(4.0))
+
+    del qs[1]
+    assert tr.sync(qs) == 1 and tr.bad_points == 0 and tr.total_points == 4.0
+    assert tr.sync(qs) == 0
+
+def test_missing_matrix_asks_only_for_the_gap():
+    tr = ConformanceTracker()
+    tr.sync([_q("Số học", "Mức 1", "TN", 1.0)])
+    gap = missing_matrix(tr.diff(NORM))
+    assert [(c.topic, c.count, c.points) for c in gap.cells] == [("Số học", 1, 1.0), ("Hình học", 1, 3.0)]
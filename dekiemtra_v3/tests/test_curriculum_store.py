@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import gc
+import json
+import os
+
+import pytest
+
+from modules.curriculum_store import CompactStore, build_store
+from modules.data_loader import CurriculumDB, load_db_cached
+
+DATA = {
+    "Toán": {
+        "3": [
+            {"topic": "Số và phép tính", "lesson": "Phép chia", "yccd": "Chia số có 2 chữ số"},
+            {"topic": "Số và phép tính", "lesson": "Phép nhân", "yccd": "Nhân nhẩm"},
+            {"topic": "Hình học", "lesson": "Góc vuông", "yccd": ""},
+        ],
+        "10": [{"topic": "Đo lường", "lesson": "Ki-lô-gam", "yccd": "Đổi đơn vị"}],
+    },
+    "Tiếng Việt": {},  # Môn chưa có lớp nào vẫn phải có trong danh mục
+    "Khoa học": {"4": []},
+}
+
+@pytest.fixture()
+def both(tmp_path):
+    src = tmp_path / "ct.json"
+    src.write_text(json.dumps(DATA, ensure_ascii=False), encoding="utf-8")
+    dst = tmp_path / "ct.ct18"
+    build_store(src, dst)
+    store = CompactStore(dst)
+    yield CurriculumDB.from_json_file(src), CurriculumDB.from_store(store)
+    store.close()
+
+def test_json_and_ct18_give_the_same_lookups(both):
+    from_json, from_ct18 = both
+    assert from_json.subjects() == from_ct18.subjects() == ["Khoa học", "Tiếng Việt", "Toán"]
+    for subject in from_json.subjects():
+        assert from_json.grades(subject) == from_ct18.grades(subject)
+        for grade in from_json.grades(subject):
+            assert from_json.topics(subject, grade) == from_ct18.topics(subject, grade)
+            assert from_json.lessons(subject, grade) == from_ct18.lessons(subject, grade)
+            for it in from_json.lessons(subject, grade):
+                assert from_json.lessons(subject, grade, it.topic) == from_ct18.lessons(subject, grade, it.topic)
+                assert (from_json.find_yccd(subject, grade, it.topic, it.lesson)
+                        == from_ct18.find_yccd(subject, grade, it.topic, it.lesson))
+    assert from_json.grades("Toán") == ["3", "10"]
+    assert from_ct18.find_yccd("Toán", "3", "Số và phép tính", "Phép nhân") == "Nhân nhẩm"
+    assert from_ct18.topics("Tiếng Việt", "3") == [] and from_ct18.find_yccd("Sử", "3", "x", "y") == ""
+
+def test_reloading_a_changed_ct18_closes_the_old_mapping(tmp_path):
+    src = tmp_path / "ct.json"
+    src.write_text(json.dumps(DATA, ensure_ascii=False), encoding="utf-8")
+    dst = tmp_path / "ct.ct18"
+    build_store(src, dst)
+    old = load_db_cached(dst)
+    mm = old._loader.__self__._mm
+    st = dst.stat()
+    build_store(src, dst)
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    new = load_db_cached(dst)
+    assert new is not old and not mm.closed  # phiên còn giữ bản cũ thì chưa đóng
+    del old
+    gc.collect()
+    assert mm.closed
+    assert new.topics("Toán", "3") == ["Số và phép tính", "Hình học"]
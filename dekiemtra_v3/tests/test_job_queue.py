@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+
+from modules.job_queue import JobQueue
+
+def _wait(queue: JobQueue, job_id: str, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job is not None and not job.active:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"việc {job_id} chưa xong sau {timeout}s")
+
+@pytest.fixture()
+def queue(tmp_path) -> JobQueue:
+    return JobQueue(tmp_path / "jobs.sqlite3")
+
+def test_done_job_is_collected_exactly_once(queue):
+    job_id = queue.submit("gv1", "batch", "Lô 1", {"n": 2}, lambda ctx, p: {"questions": list(range(p["n"]))})
+    job = _wait(queue, job_id)
+    assert (job.status, job.progress, job.result) == ("done", 1.0, {"questions": [0, 1]})
+    assert [queue.mark_collected(job_id) for _ in range(3)] == [True, False, False]
+    assert queue.get(job_id).collected
+    assert [j.id for j in queue.list("gv1")] == [job_id] and queue.list("gv2") == []
+
+def test_partial_result_and_cancel(queue):
+    started = threading.Event()
+
+    def run(ctx, payload):
+        ctx.report(0.5, "Đang sinh đề...", {"text": "Câu 1"})
+        started.set()
+        while True:
+            ctx.report()
+            time.sleep(0.01)
+
+    job_id = queue.submit("gv1", "exam_text", "Đề", {}, run)
+    assert started.wait(5)
+    assert queue.get(job_id).result == {"text": "Câu 1"}
+    queue.cancel(job_id)
+    job = _wait(queue, job_id)
+    assert job.status == "cancelled" and job.result == {"text": "Câu 1"}
+
+def test_failed_job_keeps_the_error_and_can_be_deleted(queue):
+    job_id = queue.submit("gv1", "batch", "Lỗi", {}, lambda ctx, p: 1 / 0)
+    job = _wait(queue, job_id)
+    assert job.status == "failed" and "division by zero" in job.message
+    queue.delete(job_id)
+    assert queue.get(job_id) is None
+
+def test_jobs_of_a_dead_process_are_marked_interrupted(tmp_path):
+    path = tmp_path / "jobs.sqlite3"
+    first = JobQueue(path)
+    gate = threading.Event()
+    job_id = first.submit("gv1", "batch", "Dở dang", {}, lambda ctx, p: gate.wait(5) and {})
+    with first._connect() as con:
+        con.execute("UPDATE jobs SET pid = -1 WHERE id = ?", (job_id,))  # như việc của tiến trình cũ
+    assert JobQueue(path).get(job_id).status == "interrupted"
+    gate.set()
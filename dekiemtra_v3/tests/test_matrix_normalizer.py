@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import pandas as pd
+
+from modules.matrix_normalizer import matrix_table, normalize_matrix, parse_level, parse_type
+
+def test_long_layout_normalizes_levels_types_and_skips_total_row():
+    df = pd.DataFrame({
+        "Chủ đề": ["Số học", "Số học", "Hình học", "Tổng"],
+        "Mức": ["M1", "Mức 2", "Biết", ""],
+        "Dạng": ["TN", "Tự luận", "Đúng/Sai", ""],
+        "Số câu": [2, 1, 1, 4],
+        "Điểm": [2, 3, 1, 6],
+    })
+    norm = normalize_matrix(df)
+    assert norm.layout == "long"
+    assert [(c.topic, c.level, c.q_type, c.count, c.points) for c in norm.cells] == [
+        ("Số học", "Mức 1: Biết", "Trắc nghiệm (4 lựa chọn)", 2, 2.0),
+        ("Số học", "Mức 2: Hiểu", "Tự luận", 1, 3.0),
+        ("Hình học", "Mức 1: Biết", "Đúng/Sai", 1, 1.0),
+    ]
+    assert norm.total_questions == 4 and norm.total_points == 6.0
+
+def test_wide_layout_reads_level_columns():
+    df = pd.DataFrame({
+        "Mạch kiến thức": ["Số học", "Đo lường"],
+        "Mức 1 - Số câu": [3, 1],
+        "Mức 1 - Điểm": [1.5, 0.5],
+        "Mức 3 TL - Số câu": [1, None],
+        "Mức 3 TL - Điểm": [2, None],
+    })
+    norm = normalize_matrix(df)
+    assert norm.layout == "wide"
+    assert {(c.topic, c.level, c.q_type, c.count, c.points) for c in norm.cells} == {
+        ("Số học", "Mức 1: Biết", "", 3, 1.5),
+        ("Số học", "Mức 3: Vận dụng", "Tự luận", 1, 2.0),
+        ("Đo lường", "Mức 1: Biết", "", 1, 0.5),
+    }
+
+def test_unrecognized_sheet_falls_back_to_raw_rows():
+    norm = normalize_matrix(pd.DataFrame({"Ghi chú": ["Đề gồm 2 phần", None]}))
+    assert norm.layout == "raw" and not norm.cells and norm.raw_rows == ["Ghi chú", "Đề gồm 2 phần"]
+
+def test_parsers_and_table_budget():
+    assert parse_level("m2") == "Mức 2: Hiểu" and parse_level("Ghi chú") is None
+    assert parse_type("TN") == "Trắc nghiệm (4 lựa chọn)" and parse_type("???") == ""
+    df = pd.DataFrame({"Chủ đề": [f"Chủ đề số {i}" for i in range(200)], "Mức": ["M1"] * 200,
+                       "Số câu": [1] * 200, "Điểm": [0.5] * 200})
+    table, omitted = matrix_table(normalize_matrix(df), token_budget=300)
+    assert omitted > 0 and table.count("\n") < 200
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+from modules import ai_client
+from modules.ai_client import GeminiClient
+from modules.mock_backend import MockGenAI, ResourceExhausted
+from modules.question_format import normalize_question
+from modules.services import question_prompt
+from modules.validators import ALLOWED_TYPES, validate_question_format
+
+@pytest.mark.parametrize("q_type", ALLOWED_TYPES)
+def test_single_question_answers_pass_the_format_checks(mock_ai, q_type):
+    ai = GeminiClient(api_key=f"mock-{q_type}", backend=mock_ai)
+    stt = ai.generate(question_prompt("Toán", "3", "Số học", "Phép cộng", "", q_type, "Mức 1: Biết", 1))
+    assert stt.ok and "Đáp án:" in stt.message
+    content, answer = stt.message.rsplit("Đáp án:", 1)
+    q = normalize_question({"type": q_type, "content": content, "answer": answer})
+    assert [i for i in validate_question_format(q) if i.level == "error"] == []
+
+def test_same_prompt_and_seed_give_the_same_text(mock_ai):
+    ai = GeminiClient(api_key="mock-repeat", backend=mock_ai)
+    a, b, c = (ai.generate("Soạn 1 câu", seed=s) for s in (1, 1, 2))
+    assert a.message == b.message != c.message
+
+def test_failing_model_falls_back_and_opens_its_breaker(monkeypatch):
+    monkeypatch.setattr(ai_client, "BACKOFF_BASE_S", 0.0)  # 503 được thử lại; không chờ backoff thật
+    mock = MockGenAI(latency_s=0.0, jitter_s=0.0, failing_models=["gemini-1.5-flash"])
+    ai = GeminiClient(api_key="mock-fail", backend=mock)
+    for _ in range(2):
+        stt = ai.generate("Soạn 1 câu", task="fast")
+        assert stt.ok and stt.used_model != "gemini-1.5-flash"
+    assert ai.health()["gemini-1.5-flash"]["state"] == "open"
+    assert "gemini-1.5-flash" not in ai.route("Soạn 1 câu", task="fast")
+
+def test_quota_errors_are_raised_like_the_real_api():
+    model = MockGenAI(latency_s=0.0, quota_rate=1.0).GenerativeModel("gemini-1.5-flash")
+    with pytest.raises(ResourceExhausted):
+        model.generate_content("x")
+
+def test_stream_yields_chunks_and_can_be_cancelled(mock_ai):
+    mock_ai.chunk_chars = 5
+    ai = GeminiClient(api_key="mock-stream", backend=mock_ai)
+    stream = ai.generate_stream("Soạn 1 câu", seed=3)
+    pieces = list(stream)
+    assert len(pieces) > 1 and stream.status.ok and "".join(pieces).strip() == stream.status.message
+
+    stream = ai.generate_stream("Soạn 1 câu", seed=4)
+    for _ in stream:
+        stream.cancel()
+    assert not stream.status.ok and stream.text and stream.cancelled
+
+def test_malformed_batch_output_is_cut_short():
+    mock = MockGenAI(malformed_rate=1.0)
+    text = mock._batch('YÊU CẦU:\n[{"id": 0, "dang": "Tự luận", "chu_de": "Số"}]', random.Random(0))
+    assert text.startswith("```json") and not text.rstrip().endswith("```")
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from modules.question_bank import QuestionBank
+
+def _q(content: str, topic: str = "Số học", level: str = "Mức 1: Biết"):
+    return {"subject": "Toán", "grade": "3", "topic": topic, "lesson": "Phép cộng", "yccd": "", "type": "Tự luận",
+            "level": level, "points": 1.0, "content": content, "answer": "..."}
+
+LAN = "Bạn Lan có 12 quả cam, bạn Nam có nhiều hơn Lan 5 quả. Hỏi bạn Nam có bao nhiêu quả cam?"
+
+def test_add_skips_exact_duplicates_and_searches(tmp_path):
+    bank = QuestionBank(tmp_path / "bank.sqlite3")
+    assert bank.add_many([_q(LAN), _q("  " + LAN.upper() + " "), _q(""), _q("Tính chu vi hình vuông cạnh 4 cm.", "Hình học")]) == 2
+    assert bank.count() == 2
+    assert [h.question["topic"] for h in bank.search(subject="Toán", grade="3", topic="Hình học")] == ["Hình học"]
+    hits = bank.search(text="qua cam")  # tìm không dấu
+    assert len(hits) == 1 and hits[0].question["content"] == LAN
+
+    bank.mark_used([hits[0].id])
+    assert [h.used_count for h in bank.search()] == [0, 1]  # câu ít dùng lên trước
+
+def test_duplicate_index_survives_reopen_and_follows_deletes(tmp_path):
+    path = tmp_path / "bank.sqlite3"
+    QuestionBank(path).add_many([_q(LAN)])
+    bank = QuestionBank(path)
+    idx = bank.duplicate_index()
+    hit = idx.best("Ban Lan co 12 qua cam, ban Nam co nhieu hon Lan 5 qua. Hoi ban Nam co bao nhieu qua cam?")
+    assert hit is not None and bank.get(hit[0])["content"] == LAN
+
+    bank.add_many([_q("Một hình chữ nhật dài 6 cm, rộng 4 cm. Tính diện tích.", "Hình học")])
+    assert len(idx) == 2  # chỉ mục đã dựng được cập nhật dần
+    bank.delete(hit[0])
+    assert idx.best(LAN) is None and bank.count() == 1
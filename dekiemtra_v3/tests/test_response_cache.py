@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import time
+
+from modules.response_cache import ResponseCache, make_key
+
+CFG = {"temperature": 0.7}
+
+def test_key_ignores_whitespace_and_unicode_form():
+    nfd = "Soa\u0323n 1 câu   hỏi\n\n\n\nLớp 3 "
+    assert make_key(nfd, "m", CFG, 1) == make_key("Soạn 1 câu hỏi\n\nLớp 3", "m", CFG, 1)
+    assert make_key("p", "m", CFG, 1) != make_key("p", "m", CFG, 2) != make_key("p", "m2", CFG, 2)
+
+def test_get_put_ttl_and_lru_eviction(tmp_path):
+    cache = ResponseCache(tmp_path / "c.sqlite3", max_entries=2)
+    cache.put("a", "m", "A")
+    time.sleep(0.01)
+    cache.put("b", "m", "B")
+    time.sleep(0.01)
+    assert cache.get("a") == "A"  # a mới được dùng -> b bị bỏ trước
+    time.sleep(0.01)
+    cache.put("c", "m", "C")
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == ("A", None, "C")
+    assert cache.stats() == {"entries": 2, "bytes": 2}
+
+    expired = ResponseCache(tmp_path / "c.sqlite3", ttl_s=0.0)
+    time.sleep(0.01)
+    assert expired.get("a") is None and expired.stats()["entries"] == 1
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from modules.similarity import DuplicateIndex, find_duplicates, shingles, signature, similarity
+
+LAN = "Bạn Lan có 12 quả cam, bạn Nam có nhiều hơn Lan 5 quả. Hỏi bạn Nam có bao nhiêu quả cam?"
+
+def test_near_duplicate_ignores_diacritics_case_and_option_labels():
+    folded = "BAN LAN CO 12 QUA CAM, ban Nam co nhieu hon Lan 5 qua. Hoi ban Nam co bao nhieu qua cam?"
+    assert similarity(signature(LAN), signature(folded)) == 1.0
+    mc_dot = f"{LAN}\nA. 15\nB. 17\nC. 7\nD. 12\nĐáp án: B"
+    mc_paren = f"{LAN}\na) 15\nb) 17\nc) 7\nd) 12\nĐáp án: A"  # nhãn, dòng đáp án khác nhau
+    assert similarity(signature(mc_dot), signature(mc_paren)) == 1.0
+
+def test_numbers_inside_the_stem_are_content():
+    assert shingles("Tính 3 : 5") == shingles("Tính 3 5")
+    assert shingles("Tính 3 : 5") != shingles("Tính 5")
+
+def test_index_finds_near_duplicates_but_not_different_questions():
+    idx = DuplicateIndex()
+    idx.add("lan", LAN)
+    idx.add("other", "Một hình vuông có cạnh 4 cm. Tính chu vi hình vuông đó.")
+    hit = idx.best("Ban Lan co 12 qua cam, ban Nam co nhieu hon Lan 5 qua. Hoi ban Nam co bao nhieu qua cam ?")
+    assert hit is not None and hit[0] == "lan"
+    assert idx.best("Kể tên 3 loài chim mà em biết và nêu đặc điểm của chúng.") is None
+    idx.remove("lan")
+    assert idx.best(LAN) is None and len(idx) == 1
+
+def test_find_duplicates_points_back_to_the_first_copy():
+    qs = [{"content": LAN}, {"content": "Tính 25 + 17."}, {"content": LAN.upper()}]
+    assert [(i, j) for i, j, _ in find_duplicates(qs)] == [(2, 0)]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import random
+import re
+
+from modules.variants import make_variants, shuffle_options
+
+MC = {"type": "Trắc nghiệm (4 lựa chọn)", "content": "2 + 2 = ?\nA. 3\nB. 4\nC. 5\nD. 6", "answer": "B", "points": 1.0}
+TF = {"type": "Đúng/Sai", "content": "Ghi Đ hoặc S:\na) 5 > 3\nb) 2 > 7\nc) 4 = 4", "answer": "a-Đ, b-S, c-Đ", "points": 1.0}
+
+def _option(q, label: str) -> str:
+    return re.search(rf"^{label}[\.\)]\s*(.*)$", str(q["content"]), re.M).group(1)
+
+def test_multiple_choice_answer_follows_the_correct_option():
+    for seed in range(10):
+        v = shuffle_options(MC, random.Random(seed))
+        assert _option(v, str(v["answer"])) == "4"
+        assert sorted(_option(v, lab) for lab in "ABCD") == ["3", "4", "5", "6"]
+
+def test_true_false_answers_follow_their_statements():
+    for seed in range(10):
+        v = shuffle_options(TF, random.Random(seed))
+        truth = dict(p.split("-") for p in str(v["answer"]).split(", "))
+        for lab, want in (("5 > 3", "Đ"), ("2 > 7", "S"), ("4 = 4", "Đ")):
+            line = next(ln for ln in str(v["content"]).split("\n") if ln.endswith(lab))
+            assert truth[line[0]] == want
+
+def test_variants_are_stable_and_keep_the_original_as_a():
+    qs = [MC, TF, {"type": "Tự luận", "content": "Kể tên 3 loài hoa.", "answer": "", "points": 2.0}]
+    two = make_variants(qs, 2, seed=2024)
+    three = make_variants(qs, 3, seed=2024)
+    assert [lab for lab, _ in three] == ["A", "B", "C"]
+    assert three[0][1] == qs and three[:2] == two  # thêm mã đề không làm đổi mã cũ
+    assert sorted(q["points"] for q in three[2][1]) == [1.0, 1.0, 2.0]